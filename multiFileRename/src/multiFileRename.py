@@ -1,5 +1,6 @@
 import os
 import datetime
+import threading
 import re
 import tkinter as tk
 from tkinter import filedialog, messagebox
@@ -7,6 +8,18 @@ import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from tkinterdnd2 import DND_FILES, TkinterDnD
 
+from previewGenerator import PreviewGenerator
+from previewTable import PreviewTable
+from renameExecutor import run as run_renames
+from renameJournal import RenameJournal, JournalError, JournalInUse, unfinished_journals
+from renamePlanner import plan_renames, RenamePlanError
+from renameTemplate import compile_template, split_name, TemplateError, MODE_TEMPLATES
+
+# ワーカーから届いたプレビューの結果を見に行く間隔（ミリ秒）
+PREVIEW_POLL_MS = 15
+# リネームの進み具合を見に行く間隔（ミリ秒）
+RENAME_POLL_MS = 200
+
 def natural_sort_key(s: str):
     """文字列を自然順（数値部分は数値としてソート）で並べるためのキー生成関数。"""
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
@@ -32,7 +45,20 @@ class ImageRenameApp(TkinterDnD.Tk):
 
         # 状態変数
         self.file_paths = []
+        # パス -> (拡張子なしの名前, 拡張子)。プレビューのたびにファイル名を分解し直さない
+        self.name_parts = {}
         self.has_images = False
+        # 変換後の名前はワーカースレッドで作る。作り終えたプレビュー（file_paths と同じ並び）は preview_names に入る
+        self.preview_generator = PreviewGenerator()
+        self.preview_names = None
+        self.preview_generation = None
+        self.preview_polling = None
+        # 実行中のリネーム（ジャーナルに記録しながらワーカースレッドで進める）
+        self.rename_journal = None
+        self.rename_thread = None
+        self.rename_undo = False
+        self.rename_failures = []
+        self.rename_stop = threading.Event()
         self.sort_states = {"original": True, "converted": True}
 
         # モード・テンプレート関連変数
@@ -49,14 +75,19 @@ class ImageRenameApp(TkinterDnD.Tk):
 
         self.create_widgets()
         self.bind_events()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.request_preview()
+        # 前回途中で止まったリネームがあれば、続けるか元に戻すかを選ばせる
+        self.after_idle(self.check_unfinished_renames)
 
     def create_widgets(self):
         """GUIウィジェットの生成と配置を行うメソッド。"""
         main_frame = tb.Frame(self, padding=10)
         main_frame.pack(fill=tk.BOTH, expand=True)
 
-        # ツリービュー: 元名、矢印、変換後名
-        self.tree = tb.Treeview(main_frame, columns=("original", "arrow", "converted"), show="headings", bootstyle=DEFAULT)
+        # ツリービュー: 元名、矢印、変換後名（見えている行だけを作る）
+        self.preview_table = PreviewTable(main_frame)
+        self.tree = self.preview_table.tree
         self.tree.heading("original", text="元ファイル名", command=lambda: self.sort_by("original"))
         self.tree.heading("arrow", text="→")
         self.tree.heading("converted", text="変換後ファイル名(プレビュー)")
@@ -64,11 +95,6 @@ class ImageRenameApp(TkinterDnD.Tk):
         self.tree.column("arrow", width=50, anchor="center")
         self.tree.column("converted", width=450, anchor="w")
 
-        vsb = tb.Scrollbar(main_frame, orient="vertical", command=self.tree.yview)
-        self.tree.configure(yscrollcommand=vsb.set)
-        self.tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
-        vsb.pack(fill=tk.Y, side=tk.RIGHT)
-
         # オプションフレーム（技術者向け）
         self.option_frame = tb.Labelframe(self, text="カスタムオプション (技術者向け)", padding=10)
 
@@ -94,6 +120,10 @@ class ImageRenameApp(TkinterDnD.Tk):
         example_label = tb.Label(self.option_frame, text=placeholder_examples, anchor="w", justify="left", bootstyle="secondary")
         example_label.grid(row=1, column=0, columnspan=5, sticky="w", padx=5, pady=5)
 
+        # テンプレートの書式の誤りを表示するラベル
+        self.template_error_label = tb.Label(self.option_frame, text="", anchor="w", bootstyle="danger")
+        self.template_error_label.grid(row=3, column=0, columnspan=5, sticky="w", padx=5)
+
         tb.Label(self.option_frame, text="連番開始番号:", anchor="e").grid(row=2, column=0, sticky="e", padx=5, pady=5)
         tb.Entry(self.option_frame, textvariable=self.start_number_var, width=5).grid(row=2, column=1, sticky="w", padx=5, pady=5)
 
@@ -110,8 +140,12 @@ class ImageRenameApp(TkinterDnD.Tk):
 
         tb.Button(mode_frame, text="クリア", command=self.clear_list, bootstyle="warning", padding=10).pack(side=tk.LEFT, padx=5)
 
-        execute_button = tb.Button(mode_frame, text="実行", bootstyle="primary", command=self.rename_files, padding=(20, 10))
-        execute_button.pack(side=tk.RIGHT, padx=5)
+        # プレビューを作り終えるまでは押せない
+        self.execute_button = tb.Button(mode_frame, text="実行", bootstyle="primary", command=self.rename_files, padding=(20, 10))
+        self.execute_button.pack(side=tk.RIGHT, padx=5)
+        # リネームの進み具合
+        self.progress_label = tb.Label(mode_frame, text="", bootstyle="secondary")
+        self.progress_label.pack(side=tk.RIGHT, padx=5)
 
         hint_label = tb.Label(
             self,
@@ -126,9 +160,9 @@ class ImageRenameApp(TkinterDnD.Tk):
     def bind_events(self):
         """イベントバインドを行うメソッド。"""
         self.tree.bind("<Delete>", self.delete_selected_items)
-        # テンプレートや連番開始番号が変更されたらプレビュー更新
-        self.template_var.trace_add("write", lambda *args: self.update_tree_preview())
-        self.start_number_var.trace_add("write", lambda *args: self.update_tree_preview())
+        # テンプレートや連番開始番号が変更されたらプレビュー更新（作成中のプレビューは打ち切る）
+        self.template_var.trace_add("write", lambda *args: self.request_preview())
+        self.start_number_var.trace_add("write", lambda *args: self.request_preview())
 
     def set_mode(self, mode: str):
         """
@@ -140,16 +174,18 @@ class ImageRenameApp(TkinterDnD.Tk):
             self.option_frame.pack(fill=tk.X, pady=10, padx=10, side=tk.BOTTOM)
         else:
             self.option_frame.pack_forget()
-        self.update_tree_preview()
+        self.request_preview()
 
     def drop_files(self, event):
-        """ファイルをドロップした際に対応拡張子ならリストへ追加し、表示を更新。"""
+        """ファイルをドロップした際に対応拡張子ならリストへ追加し、表示を更新（追加済みのファイルは除く）。"""
         files = self.tk.splitlist(event.data)
         added = False
+        known = set(self.file_paths)
         for file_path in files:
             ext = os.path.splitext(file_path)[1].lower()
-            if ext in self.supported_exts:
+            if ext in self.supported_exts and file_path not in known:
                 self.file_paths.append(file_path)
+                known.add(file_path)
                 added = True
         self.update_tree_preview()
 
@@ -172,8 +208,13 @@ class ImageRenameApp(TkinterDnD.Tk):
             # 元ファイル名でソート
             self.file_paths.sort(key=lambda p: natural_sort_key(os.path.basename(p)), reverse=not ascending)
         elif column == "converted":
-            # 変換後ファイル名でソート
-            converted_names = self.generate_preview_names()
+            # 変換後ファイル名でソート（プレビューを作成中ならその場で作る）
+            converted_names = self.preview_names
+            if converted_names is None:
+                try:
+                    converted_names = self.generate_preview_names()
+                except TemplateError:
+                    return
             combined = list(zip(self.file_paths, converted_names))
             combined.sort(key=lambda x: natural_sort_key(x[1]), reverse=not ascending)
             self.file_paths = [c[0] for c in combined]
@@ -182,76 +223,80 @@ class ImageRenameApp(TkinterDnD.Tk):
         self.update_tree_preview()
 
     def update_tree_preview(self, *args):
-        """ツリービューを現在のファイルリストと設定でプレビューを更新。"""
-        for item_id in self.tree.get_children():
-            self.tree.delete(item_id)
-
-        converted_names = self.generate_preview_names()
-        for original_path, converted in zip(self.file_paths, converted_names):
-            filename = os.path.basename(original_path)
-            self.tree.insert("", "end", values=(filename, "→", converted))
+        """
+        ツリービューを現在のファイルリストで作り直し、変換後の名前の作成をワーカーに頼む。
+        行はファイルのパスで識別し、変換後の名前は届くまで空欄にしておく。
+        """
+        filenames = [os.path.basename(path) for path in self.file_paths]
+        self.preview_table.set_rows(self.file_paths, filenames, [""] * len(self.file_paths))
+        self.request_preview()
 
-    def generate_preview_names(self):
+    def request_preview(self):
         """
-        現在のファイルリストに対して、設定されたモード・テンプレートを用いて
-        プレビュー用の変換後ファイル名リストを生成する。
+        現在のファイルリストと設定で変換後の名前を作り直す。作成中の前の要求は打ち切られ、画面に見えている行から順に届く。
+        テンプレートの解析はここで行い、書式が誤っている間はプレビューを更新せず誤りだけを表示する。
+        すべての行を作り終えるまで実行ボタンは押せない。
         """
-        converted_names = []
-        mode = self.mode_var.get()
-        start_num = self.start_number_var.get()
+        self.preview_names = None
+        self.execute_button.configure(state=DISABLED)
+        try:
+            compiled, start_num = self.compiled_template()
+        except TemplateError as e:
+            self.preview_generator.cancel()
+            self.template_error_label.configure(text=str(e))
+            return
+        self.template_error_label.configure(text="")
+        table = self.preview_table
         # 一度だけ現在日時を取得し、同一プレビュー生成処理内で一貫性を保つ
         now = datetime.datetime.now()
+        self.preview_generation = self.preview_generator.submit(compiled, self.file_paths, self.name_parts, start_num, now,
+                                                                table.offset, table.offset + table.visible_rows())
+        if self.preview_polling is None:
+            self.preview_polling = self.after(PREVIEW_POLL_MS, self.poll_preview)
+
+    def poll_preview(self):
+        """ワーカーから届いた変換後の名前を一覧に反映する。すべて届いたら実行ボタンを押せるようにする。"""
+        self.preview_polling = None
+        if self.preview_generation != self.preview_generator.generation:
+            # 書式の誤りなどで打ち切られた
+            return
+        for _, start, names in self.preview_generator.poll():
+            if start is None:
+                self.preview_names = list(self.preview_table.converted)
+                if self.rename_thread is None:
+                    self.execute_button.configure(state=NORMAL)
+                return
+            self.preview_table.set_converted(start, names)
+        self.preview_polling = self.after(PREVIEW_POLL_MS, self.poll_preview)
 
-        for index, path in enumerate(self.file_paths):
-            base_name = os.path.basename(path)
-            root, ext = os.path.splitext(base_name)
-            seq_num = start_num + index
-
-            if mode == "serial_only":
-                # 連番のみ
-                new_name = f"{seq_num}{ext}"
-            elif mode == "serial_prefix":
-                # 連番_元ファイル名
-                new_name = f"{seq_num}_{root}{ext}"
-            elif mode == "serial_suffix":
-                # 元ファイル名_連番
-                new_name = f"{root}_{seq_num}{ext}"
-            else:
-                # カスタムテンプレート
-                template = self.template_var.get()
-                new_name = self.apply_template(template, root, seq_num, now) + ext
-
-            converted_names.append(new_name)
-        return converted_names
+    def compiled_template(self):
+        """
+        現在のモードのテンプレートを解析したものと、連番開始番号を返す。
+        テンプレートや連番開始番号の書式が誤っていれば、生成を始める前に TemplateError を送出する。
+        """
+        mode = self.mode_var.get()
+        # 既定モードも固定のテンプレートとして扱う（連番のみ: {num}、連番_元ファイル名、元ファイル名_連番）
+        template = MODE_TEMPLATES.get(mode) or self.template_var.get()
+        try:
+            start_num = self.start_number_var.get()
+        except tk.TclError:
+            raise TemplateError("連番開始番号は整数で指定してください。") from None
+        return compile_template(template), start_num
 
-    def apply_template(self, template: str, root: str, seq_num: int, now: datetime.datetime) -> str:
+    def generate_preview_names(self):
         """
-        テンプレート文字列に{filename}, {num}, {date}を適用するヘルパーメソッド。
+        現在のファイルリストに対して、設定されたモード・テンプレートを用いて
+        プレビュー用の変換後ファイル名リストを生成する（テンプレートの解析は1度だけ）。
         """
-        result = template.replace("{filename}", root)
-
-        # {num}置換
-        num_pattern = r"{num(?::(.*?))?}"
-        def replace_num(match):
-            fmt = match.group(1)
-            if fmt:
-                # 指定されたフォーマットで整形
-                return ("{:" + fmt + "}").format(seq_num)
-            else:
-                return str(seq_num)
-        result = re.sub(num_pattern, replace_num, result)
-
-        # {date}置換
-        date_pattern = r"{date(?::(.*?))?}"
-        def replace_date(match):
-            fmt = match.group(1)
-            if fmt:
-                return now.strftime(fmt)
-            else:
-                return now.strftime("%Y%m%d")
-        result = re.sub(date_pattern, replace_date, result)
+        compiled, start_num = self.compiled_template()
+        # 一度だけ現在日時を取得し、同一プレビュー生成処理内で一貫性を保つ
+        now = datetime.datetime.now()
+        return compiled.render(self.split_names(), start_num, now)
 
-        return result
+    def split_names(self):
+        """ファイルリストの各ファイル名の (拡張子なしの名前, 拡張子)。"""
+        parts = self.name_parts
+        return [parts.get(path) or parts.setdefault(path, split_name(path)) for path in self.file_paths]
 
     def rename_files(self):
         """ファイル名変更を実行する。重複チェック、存在チェック、ユーザ確認を行ったうえでリネーム。"""
@@ -259,56 +304,138 @@ class ImageRenameApp(TkinterDnD.Tk):
             messagebox.showwarning("警告", "リネーム対象のファイルがありません。")
             return
 
-        converted_names = self.generate_preview_names()
+        # 画面に表示しているプレビューのとおりに変更する
+        converted_names = self.preview_names
+        if converted_names is None:
+            return
 
         # 重複チェック
         if len(converted_names) != len(set(converted_names)):
             messagebox.showerror("エラー", "同名のファイル名が発生します。テンプレートやモードを見直してください。")
             return
 
-        # ファイル存在チェック
-        for src, dst_name in zip(self.file_paths, converted_names):
-            dst_path = os.path.join(os.path.dirname(src), dst_name)
-            if os.path.exists(dst_path):
-                messagebox.showerror("エラー", f"ファイル '{dst_name}' がすでに存在します。")
-                return
+        # ファイル存在チェック（フォルダごとに一覧を1度だけ取る）と手順の決定
+        # リスト内のファイル同士の入れ替えや連番のずらしは、移動先を先に空ける順に並べる
+        pairs = [(src, os.path.join(os.path.dirname(src), dst_name))
+                 for src, dst_name in zip(self.file_paths, converted_names)]
+        try:
+            moves = plan_renames(pairs)
+        except RenamePlanError as e:
+            messagebox.showerror("エラー", str(e))
+            return
 
         # 実行確認
-        if not messagebox.askyesno("確認", "ファイル名を変更しますか？（元に戻せません）"):
+        if not messagebox.askyesno("確認", "ファイル名を変更しますか？（途中で失敗したときだけ、変更した分を元に戻せます）"):
             return
 
-        # リネーム実行
-        for src, dst_name in zip(self.file_paths, converted_names):
-            dst_path = os.path.join(os.path.dirname(src), dst_name)
+        # リネーム実行（予定をジャーナルに書き出してから始める）
+        try:
+            journal = RenameJournal.create(moves)
+        except OSError as e:
+            messagebox.showerror("エラー", f"ジャーナルを作成できません:\n{e}")
+            return
+        self.start_rename(journal)
+
+    def start_rename(self, journal, undo=False):
+        """
+        ジャーナルの残りの移動（undo なら済んだ移動を元に戻す処理）をワーカースレッドで始める。
+        終わるまで実行ボタンは押せず、進み具合を表示する。
+        """
+        self.rename_journal = journal
+        self.rename_undo = undo
+        self.rename_failures = []
+        self.execute_button.configure(state=DISABLED)
+
+        def work():
             try:
-                os.rename(src, dst_path)
-            except Exception as e:
-                # 一件でも失敗したら処理停止しエラー表示
-                # (ここでロールバック処理を入れるなら、別途対応可能)
-                messagebox.showerror("エラー", f"ファイルのリネーム中にエラーが発生しました:\n{e}")
-                return
+                self.rename_failures = run_renames(journal, undo, stop=self.rename_stop)
+            except OSError as e:
+                # ジャーナルに書き込めないなど
+                self.rename_failures = [(None, e)]
+
+        self.rename_thread = threading.Thread(target=work)
+        self.rename_thread.start()
+        self.after(RENAME_POLL_MS, self.poll_rename)
+
+    def poll_rename(self):
+        """リネームの進み具合を表示し、終わったら結果を知らせる。"""
+        journal = self.rename_journal
+        if self.rename_thread.is_alive():
+            if self.rename_undo:
+                self.progress_label.configure(text=f"元に戻しています（残り {journal.completed} 件）")
+            else:
+                self.progress_label.configure(text=f"リネーム中 {journal.completed} / {len(journal.moves)}")
+            self.after(RENAME_POLL_MS, self.poll_rename)
+            return
+        self.rename_thread = None
+        self.progress_label.configure(text="")
+        if self.rename_failures:
+            self.offer_recovery(journal, self.rename_failures[0][1])
+        elif self.rename_undo:
+            messagebox.showinfo("完了", "変更したファイル名を元に戻しました。")
+            self.request_preview()
+        else:
+            messagebox.showinfo("完了", "すべてのファイル名変更が完了しました。")
+            self.file_paths.clear()
+            self.update_tree_preview()
+
+    def offer_recovery(self, journal, error=None):
+        """途中で止まったリネームを、続けるか、元に戻すか、そのままにする（次回の起動時にまた選べる）かを選ばせる。"""
+        message = f"ファイル名の変更が途中で止まりました（{journal.completed} / {len(journal.moves)} 件を変更済み）。"
+        if error is not None:
+            message += f"\n{error}"
+        message += ("\n\nはい: 残りの変更を続ける\nいいえ: 変更した分を元に戻す\n"
+                    "キャンセル: このままにする（次回の起動時にも選べます）")
+        answer = messagebox.askyesnocancel("リネームの再開", message)
+        if answer is None:
+            journal.close()
+            # リスト上のパスの一部はもう変わっているので、リストは空にする
+            self.file_paths.clear()
+            self.update_tree_preview()
+            return
+        self.start_rename(journal, undo=not answer)
 
-        messagebox.showinfo("完了", "すべてのファイル名変更が完了しました。")
-        self.file_paths.clear()
-        self.update_tree_preview()
+    def check_unfinished_renames(self):
+        """前回途中で止まったリネームのジャーナルがあれば、古いものから1つずつ再開か元に戻すかを選ばせる。"""
+        for path in unfinished_journals():
+            try:
+                journal = RenameJournal.load(path)
+            except (JournalInUse, FileNotFoundError):
+                # ほかのウィンドウで実行中か、今終わったもの
+                continue
+            except (OSError, JournalError) as e:
+                messagebox.showerror("エラー", f"ジャーナルを読み込めません:\n{e}")
+                continue
+            if journal.finished:
+                journal.finish()
+                continue
+            self.offer_recovery(journal)
+            return
 
     def delete_selected_items(self, event):
         """Deleteキー押下で選択中のファイルをリストから削除。"""
-        selected = self.tree.selection()
+        selected = set(self.preview_table.selected_keys())
         if not selected:
             return
 
-        all_items = self.tree.get_children()
-        indexes_to_remove = [all_items.index(sel) for sel in selected]
-        for index in sorted(indexes_to_remove, reverse=True):
-            del self.file_paths[index]
+        self.file_paths = [path for path in self.file_paths if path not in selected]
         self.update_tree_preview()
 
     def clear_list(self):
         """ファイルリストをクリアしてプレビュー更新。"""
         self.file_paths.clear()
+        self.name_parts.clear()
         self.update_tree_preview()
 
+    def close(self):
+        """作成中のプレビューを打ち切り、実行中のリネームは今の移動を終えたところで止めてウィンドウを閉じる（ジャーナルは残る）。"""
+        self.preview_generator.shutdown()
+        if self.rename_thread is not None:
+            self.rename_stop.set()
+            self.rename_thread.join()
+            self.rename_journal.close()
+        self.destroy()
+
 if __name__ == "__main__":
     app = ImageRenameApp()
     app.mainloop()
@@ -0,0 +1,76 @@
+"""
+MultiFileRename のプレビュー（変換後ファイル名の一覧）をワーカースレッドで作る。
+要求ごとに世代番号を振り、新しい要求が来たら古い要求の残りは捨てる（実行中の要求も区切りごとに世代を確かめて打ち切る）。
+結果は CHUNK_SIZE 件ずつキューに入れ、画面に見えている範囲を先に作る。Tk のウィジェットには触れないため、
+受け取る側（Tk のスレッド）が after() で poll() を呼び、結果を一覧に反映する。
+"""
+import concurrent.futures
+import threading
+import queue
+
+from renameTemplate import split_name
+
+# 1回に作ってキューに入れる件数
+CHUNK_SIZE = 2000
+
+
+class PreviewGenerator:
+    """テンプレートの適用を1本のワーカースレッドで行う。最新の要求の結果だけを返す。"""
+
+    def __init__(self):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.results = queue.SimpleQueue()
+        self.generation = 0
+        self._lock = threading.Lock()
+
+    def submit(self, compiled, paths, name_parts, start_number, now, first=0, last=0):
+        """
+        paths（ファイルのパスの並び）に compiled を適用する要求を出し、その世代番号を返す。
+        [first, last) の範囲（画面に見えている行）を先に作る。name_parts はパス -> split_name() の結果のキャッシュで、
+        ワーカーが分解したものも書き足す（dict の1件ずつの読み書きなので Tk のスレッドと同時に使ってよい）。
+        """
+        with self._lock:
+            self.generation += 1
+            generation = self.generation
+        self.executor.submit(self._run, generation, compiled, list(paths), name_parts, start_number, now, first, last)
+        return generation
+
+    def cancel(self):
+        """作成中の要求を打ち切る（以後 poll() は古い要求の結果を返さない）。"""
+        with self._lock:
+            self.generation += 1
+
+    def poll(self):
+        """
+        届いた結果のうち最新の要求のものを (世代番号, 先頭の行番号, 名前のリスト) のリストで返す。
+        要求のすべての行を作り終えたときは、最後に (世代番号, None, None) が入る。
+        """
+        chunks = []
+        while True:
+            try:
+                chunk = self.results.get_nowait()
+            except queue.Empty:
+                return chunks
+            if chunk[0] == self.generation:
+                chunks.append(chunk)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+    def _ranges(self, total, first, last):
+        """作る範囲の順番: 見えている範囲、その後ろ、その前（それぞれ CHUNK_SIZE 件ずつ）。"""
+        first, last = max(0, min(first, total)), max(0, min(last, total))
+        for start, stop in ((first, last), (last, total), (0, first)):
+            for chunk_start in range(start, stop, CHUNK_SIZE):
+                yield chunk_start, min(stop, chunk_start + CHUNK_SIZE)
+
+    def _run(self, generation, compiled, paths, name_parts, start_number, now, first, last):
+        for start, stop in self._ranges(len(paths), first, last):
+            if generation != self.generation:
+                # 新しい要求が来ているので残りは作らない
+                return
+            parts = [name_parts.get(path) or name_parts.setdefault(path, split_name(path))
+                     for path in paths[start:stop]]
+            self.results.put((generation, start, compiled.render(parts, start_number + start, now)))
+        self.results.put((generation, None, None))
@@ -0,0 +1,157 @@
+"""
+MultiFileRename のプレビュー一覧（元ファイル名 → 変換後ファイル名）。
+Treeview には画面に見えている行だけを作り、スクロールに合わせて行を入れ替える（縦スクロールバーは一覧全体に対する位置を示す）。
+行はファイルごとの key で識別し、プレビューを作り直したときは表示中の行のうち値が変わったものだけを書き換える。
+そのためファイルが何万件あっても、テンプレートの入力1文字ごとの再描画の手間は画面に見えている行数で決まる。
+"""
+import itertools
+import tkinter as tk
+import ttkbootstrap as tb
+from ttkbootstrap.constants import *
+
+# 行の高さが分からないとき（まだ1行も表示していないとき）の仮の値（ピクセル）
+DEFAULT_ROW_HEIGHT = 20
+DEFAULT_HEADING_HEIGHT = 25
+# マウスホイール1回で動かす行数
+WHEEL_ROWS = 3
+
+
+class PreviewTable:
+    """
+    key（ファイルごとに不変の値）・元ファイル名・変換後ファイル名の並びを表示する Treeview。
+    選択状態も key で持つため、スクロールで行が作り直されても選択は保たれる。
+    """
+
+    def __init__(self, parent):
+        self.tree = tb.Treeview(parent, columns=("original", "arrow", "converted"), show="headings", bootstyle=DEFAULT)
+        self.vsb = tb.Scrollbar(parent, orient="vertical", command=self.on_scrollbar)
+        self.tree.pack(fill=tk.BOTH, expand=True, side=tk.LEFT)
+        self.vsb.pack(fill=tk.Y, side=tk.RIGHT)
+
+        self.keys = []
+        self.originals = []
+        self.converted = []
+        self.offset = 0  # 一番上に表示している行の番号
+        self.shown = {}  # 表示中の key -> (元ファイル名, 変換後ファイル名)
+        self.iids = {}  # 表示中の key -> Treeview の行ID
+        self.selected = set()  # 選択中の key
+        self._iid_counter = itertools.count()
+        self.row_height = None
+        self.heading_height = None
+
+        self.tree.bind("<Configure>", lambda e: self.refresh())
+        self.tree.bind("<<TreeviewSelect>>", self.on_select)
+        self.tree.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.tree.bind("<Button-4>", self.on_mouse_wheel)
+        self.tree.bind("<Button-5>", self.on_mouse_wheel)
+        self.tree.bind("<Up>", lambda e: self.move_focus(-1))
+        self.tree.bind("<Down>", lambda e: self.move_focus(1))
+        self.tree.bind("<Prior>", lambda e: self.scroll_to(self.offset - self.visible_rows()))
+        self.tree.bind("<Next>", lambda e: self.scroll_to(self.offset + self.visible_rows()))
+
+    def set_rows(self, keys, originals, converted):
+        """一覧全体を設定する。表示中の行のうち値が変わったものだけを書き換える。"""
+        if keys != self.keys:
+            self.keys = list(keys)
+            self.selected &= set(self.keys)
+        self.originals = list(originals)
+        self.converted = list(converted)
+        self.refresh()
+
+    def set_converted(self, start, names):
+        """start 行目からの変換後ファイル名を書き換える。表示中の行にかかるときだけ Treeview を更新する。"""
+        self.converted[start:start + len(names)] = names
+        if start < self.offset + self.visible_rows() and start + len(names) > self.offset:
+            self.refresh()
+
+    def selected_keys(self):
+        """選択中の key（一覧の並び順）。"""
+        return [key for key in self.keys if key in self.selected]
+
+    def visible_rows(self):
+        """Treeview に収まる行数。"""
+        if self.row_height is None and self.shown:
+            # 表示中の行の位置から、見出しと1行の高さを測っておく
+            bbox = self.tree.bbox(self.iids[next(iter(self.shown))])
+            if bbox:
+                self.heading_height, self.row_height = bbox[1], bbox[3]
+        row_height = self.row_height or DEFAULT_ROW_HEIGHT
+        heading_height = self.heading_height or DEFAULT_HEADING_HEIGHT
+        return max(1, (self.tree.winfo_height() - heading_height) // row_height)
+
+    def refresh(self):
+        """スクロール位置に見えている行だけを Treeview に置く。"""
+        visible = self.visible_rows()
+        self.offset = max(0, min(self.offset, len(self.keys) - visible))
+        first, last = self.offset, min(len(self.keys), self.offset + visible)
+        window = self.keys[first:last]
+
+        window_set = set(window)
+        for key in [k for k in self.shown if k not in window_set]:
+            self.tree.delete(self.iids.pop(key))
+            del self.shown[key]
+        for position, key in enumerate(window):
+            values = (self.originals[first + position], self.converted[first + position])
+            old = self.shown.get(key)
+            if old is None:
+                iid = self.iids[key] = f"row{next(self._iid_counter)}"
+                self.tree.insert("", position, iid=iid, values=(values[0], "→", values[1]))
+            else:
+                iid = self.iids[key]
+                if old != values:
+                    self.tree.item(iid, values=(values[0], "→", values[1]))
+                if self.tree.index(iid) != position:
+                    self.tree.move(iid, "", position)
+            self.shown[key] = values
+
+        # 見えている行の選択状態を key の選択に合わせる
+        self.tree.selection_set([self.iids[key] for key in window if key in self.selected])
+        total = len(self.keys)
+        if total:
+            self.vsb.set(first / total, last / total)
+        else:
+            self.vsb.set(0, 1)
+
+    def on_select(self, event):
+        # 見えていない行の選択はそのまま残し、見えている行はクリックなどの結果に合わせる
+        selection = set(self.tree.selection())
+        for key in self.shown:
+            if self.iids[key] in selection:
+                self.selected.add(key)
+            else:
+                self.selected.discard(key)
+
+    def scroll_to(self, offset):
+        self.offset = max(0, offset)
+        self.refresh()
+        return "break"
+
+    def on_scrollbar(self, *args):
+        visible = self.visible_rows()
+        if args[0] == "moveto":
+            self.scroll_to(int(float(args[1]) * len(self.keys)))
+        elif args[0] == "scroll":
+            step = visible if args[2] == "pages" else 1
+            self.scroll_to(self.offset + int(args[1]) * step)
+
+    def on_mouse_wheel(self, event):
+        if event.num == 4 or (event.num != 5 and event.delta > 0):
+            return self.scroll_to(self.offset - WHEEL_ROWS)
+        return self.scroll_to(self.offset + WHEEL_ROWS)
+
+    def move_focus(self, step):
+        """上下キーでのフォーカス移動。表示範囲の端では一覧をスクロールして次の行へ進む。"""
+        focus = self.tree.focus()
+        if focus not in self.iids.values():
+            return None
+        index = self.offset + self.tree.index(focus) + step
+        if not 0 <= index < len(self.keys):
+            return "break"
+        if self.offset <= index < self.offset + self.visible_rows():
+            # 表示範囲の中の移動は Treeview に任せる
+            return None
+        key = self.keys[index]
+        self.selected = {key}
+        self.scroll_to(self.offset + step)
+        self.tree.focus(self.iids[key])
+        return "break"
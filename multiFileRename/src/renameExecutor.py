@@ -0,0 +1,125 @@
+"""
+MultiFileRename のリネームの実行。plan_renames() の手順を RenameJournal に記録しながら進める。
+移動はフォルダごとの列（移動元と移動先のフォルダがつながるものは同じ列）に分け、列どうしは RENAME_WORKERS 本のスレッドで同時に進める。
+列の中は手順の順に1件ずつ移動し、前の移動が書いたパス（一時的な名前）から動かす前にはジャーナルを確定させる。
+途中で失敗・クラッシュしたジャーナルからは、残りを続けて実行するか、済んだ移動を逆順に元に戻す。
+ジャーナルに確定していなかった最後の記録は、列ごとに記録のない最初の数件のパスの有無だけを調べて補う（ファイル一覧は取り直さない）。
+"""
+import concurrent.futures
+import threading
+import os
+
+from renamePlanner import path_key
+
+# 同時に移動を進める列の数
+RENAME_WORKERS = 4
+
+
+def run(journal, undo=False, workers=RENAME_WORKERS, stop=None):
+    """
+    journal の残りの移動を実行する（undo なら済んだ移動を逆順に元に戻す）。失敗した移動の (番号, 例外) のリストを返す。
+    1件失敗するか stop（threading.Event）がセットされると、ほかの列も今の移動を終えたところで止まる。
+    すべて終わったらジャーナルを削除する。
+    """
+    stop = stop or threading.Event()
+    reconcile(journal)
+    journal.begin(undo)
+    moves = journal.moves
+    if undo:
+        steps = [index for index in reversed(range(len(moves))) if journal.done[index]]
+    else:
+        steps = [index for index in range(len(moves)) if not journal.done[index]]
+    failures = []
+
+    def run_lane(lane):
+        unsynced = set()  # この列で書いたパスのうち、その記録をまだ確定させていないもの
+        for index, (src, dst), (src_key, dst_key) in lane:
+            if stop.is_set():
+                return
+            if src_key in unsynced:
+                # 一時的な名前から動かす前に、そこへ移したことを確定させる（クラッシュ後に輪のどこまで進んだか分かるように）
+                journal.sync()
+                unsynced.clear()
+            try:
+                os.rename(src, dst)
+            except OSError as e:
+                failures.append((index, e))
+                stop.set()
+                return
+            journal.record(index, not undo)
+            unsynced.add(dst_key)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(run_lane, split_lanes(moves, steps, undo)))
+    journal.sync()
+    if not failures and not stop.is_set() and journal.completed == (0 if undo else len(moves)):
+        journal.finish()
+    return failures
+
+
+def reconcile(journal):
+    """
+    クラッシュで失われた最後の完了の記録を、実際のパスの有無から補う（最後に始めた処理の向きで調べる）。
+    列の中の移動は順に1件ずつ行い、記録も同じ順に書くため、記録のない最初の移動から順に、
+    移動先があって移動元がないものを済んだものとし、済んでいない移動が見つかったらその列はそこまで。
+    """
+    undo = journal.undoing
+    if undo is None:
+        # まだ何も移動していない
+        return
+    moves = journal.moves
+    if undo:
+        steps = [index for index in reversed(range(len(moves))) if journal.done[index]]
+    else:
+        steps = [index for index in range(len(moves)) if not journal.done[index]]
+    lanes = split_lanes(moves, steps, undo)
+    # 移動元が、あとの移動の移動先にもなっているパス（移動元に別のファイルが入るので、移動元の有無では判断できない）
+    targets = {dst_key for lane in lanes for _, _, (_, dst_key) in lane}
+    for lane in lanes:
+        for index, (src, dst), (src_key, dst_key) in lane:
+            if not _moved(src, dst, src_key == dst_key, src_key in targets):
+                break
+            journal.record(index, not undo)
+    journal.sync()
+
+
+def split_lanes(moves, steps, undo=False):
+    """
+    steps の順の移動を、フォルダのつながりで独立した列に分ける。
+    列の要素は (番号, (移動元, 移動先), (移動元のキー, 移動先のキー))。undo なら移動元と移動先を入れ替える。
+    """
+    items = []
+    for index in steps:
+        src, dst = moves[index]
+        if undo:
+            src, dst = dst, src
+        items.append((index, (src, dst), (path_key(src), path_key(dst))))
+
+    # 移動元と移動先のフォルダを union-find でまとめる
+    parent = {}
+
+    def find(folder):
+        parent.setdefault(folder, folder)
+        while parent[folder] != folder:
+            parent[folder] = parent[parent[folder]]
+            folder = parent[folder]
+        return folder
+
+    for _, _, (src_key, dst_key) in items:
+        src_root = find(src_key.rpartition(os.sep)[0])
+        dst_root = find(dst_key.rpartition(os.sep)[0])
+        if src_root != dst_root:
+            parent[src_root] = dst_root
+
+    lanes = {}
+    for item in items:
+        lanes.setdefault(find(item[2][0].rpartition(os.sep)[0]), []).append(item)
+    return list(lanes.values())
+
+
+def _moved(src, dst, same_file, refilled):
+    """src から dst への移動が済んでいるか。"""
+    if same_file:
+        # 大文字小文字だけの変更は、フォルダの一覧の名前で確かめる
+        return os.path.basename(dst) in os.listdir(os.path.dirname(dst) or ".")
+    return os.path.lexists(dst) and (refilled or not os.path.lexists(src))
@@ -0,0 +1,229 @@
+"""
+MultiFileRename のリネームのジャーナル（追記だけのテキストファイル）。
+実行を始める前に予定の移動をすべて書き出してディスクに確定させ、その後は移動が終わるたびに "D 番号"（元に戻したときは "U 番号"）を追記する。
+完了の記録は JOURNAL_BATCH 件か JOURNAL_INTERVAL 秒ごとにまとめてディスクに確定させる（1件ごとには確定させない）。
+そのためクラッシュの直後は、最後のまとまりの記録が失われていることがある（実際の状態との突き合わせは renameExecutor で行う）。
+
+書式（1行1レコード、パスは JSON の文字列）:
+    F "フォルダ"                 以降の P の移動元のフォルダ
+    P ["移動元の名前", "移動先"]  予定の移動（出てきた順に 0 から番号を振る）。移動先は同じフォルダなら名前だけ
+    S / R                        ここから予定の順に移動する / 移動した分を逆順に元に戻す（どちらもすぐに確定させる）
+    D 番号 / U 番号              移動した / 元に戻した
+    E                            すべて終わった（このジャーナルはもう要らない）
+
+ジャーナルを使っている間は、隣のロックファイル（名前 + LOCK_SUFFIX）を排他ロックしておく。
+ほかのウィンドウが実行中のジャーナルはロックできないため、途中で止まったものとして扱わない（プロセスが終わればロックは外れる）。
+"""
+import threading
+import datetime
+import json
+import time
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# ジャーナルを置くフォルダ（起動時にここに残っているものは、途中で止まったリネーム）
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".multiFileRename", "journals")
+JOURNAL_SUFFIX = ".journal"
+LOCK_SUFFIX = ".lock"
+# 完了の記録をまとめてディスクに確定させる件数と間隔（秒）
+JOURNAL_BATCH = 512
+JOURNAL_INTERVAL = 1.0
+
+
+class JournalError(ValueError):
+    """ジャーナルの書式の誤り。"""
+
+
+class JournalInUse(RuntimeError):
+    """ほかのプロセスが使っている（リネームを実行中の）ジャーナル。"""
+
+
+class RenameJournal:
+    """
+    予定の移動 moves（(移動元, 移動先) のリスト）と、それぞれが移動済みかどうか done を持つ。
+    record() は複数のスレッドから呼んでよい。
+    """
+
+    def __init__(self, path, moves, done, file, lock_file):
+        self.path = path
+        self.moves = moves
+        self.done = done
+        self.completed = sum(done)
+        self.finished = False  # E まで記録されている
+        self.undoing = None  # 最後に始めたのが元に戻す処理か（まだ始めていなければ None）
+        self._file = file
+        self._lock_file = lock_file
+        self._buffer = []
+        self._last_sync = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, moves, directory=JOURNAL_DIR):
+        """新しいジャーナルに予定の移動をすべて書き出し、ディスクに確定させてから返す。"""
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        path = os.path.join(directory, f"rename-{stamp}-{os.getpid()}{JOURNAL_SUFFIX}")
+        lines = []
+        folder = None
+        for src, dst in moves:
+            src_folder, src_name = os.path.split(src)
+            if src_folder != folder:
+                folder = src_folder
+                lines.append("F " + json.dumps(folder, ensure_ascii=False))
+            if os.path.dirname(dst) == folder:
+                dst = os.path.basename(dst)
+            lines.append("P " + json.dumps([src_name, dst], ensure_ascii=False))
+        lock_file = _acquire_lock(path)
+        if lock_file is None:
+            raise JournalInUse(path)
+        file = open(path, 'x', encoding='utf-8', newline='\n')
+        file.write("\n".join(lines) + "\n")
+        _sync_file(file)
+        return cls(path, list(moves), [False] * len(moves), file, lock_file)
+
+    @classmethod
+    def load(cls, path):
+        """
+        途中で止まったジャーナルを読み込み、続きを追記できるように開く。
+        ほかのプロセスが使っているときは JournalInUse。
+        """
+        lock_file = _acquire_lock(path)
+        if lock_file is None:
+            raise JournalInUse(path)
+        try:
+            return cls._read(path, lock_file)
+        except FileNotFoundError:
+            # ロックを取る前にほかのプロセスが終えて削除した
+            _release_lock(lock_file, path)
+            raise
+        except BaseException:
+            _release_lock(lock_file)
+            raise
+
+    @classmethod
+    def _read(cls, path, lock_file):
+        moves = []
+        done = []
+        folder = ""
+        finished = False
+        undoing = None
+        with open(path, encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                if not line.endswith("\n"):
+                    # 書きかけの最後の行（クラッシュ）は無視する
+                    break
+                kind, _, value = line.rstrip("\n").partition(" ")
+                try:
+                    if kind == "F":
+                        folder = json.loads(value)
+                    elif kind == "P":
+                        src_name, dst = json.loads(value)
+                        moves.append((os.path.join(folder, src_name), os.path.join(folder, dst)))
+                        done.append(False)
+                    elif kind in ("D", "U"):
+                        done[int(value)] = kind == "D"
+                    elif kind in ("S", "R"):
+                        undoing = kind == "R"
+                    elif kind == "E":
+                        finished = True
+                    else:
+                        raise ValueError(kind)
+                except (ValueError, IndexError) as e:
+                    raise JournalError(f"ジャーナル '{path}' の {number} 行目が正しくありません: {e}") from None
+        journal = cls(path, moves, done, open(path, 'a', encoding='utf-8', newline='\n'), lock_file)
+        journal.finished = finished
+        journal.undoing = undoing
+        return journal
+
+    def begin(self, undo):
+        """これから予定の順に移動する（undo なら元に戻す）ことを記録し、ディスクに確定させる。"""
+        with self._lock:
+            self._buffer.append("R\n" if undo else "S\n")
+            self._sync_locked()
+            self.undoing = undo
+
+    def record(self, index, done):
+        """index 番の移動が済んだ（done が False なら元に戻した）ことを記録する。"""
+        with self._lock:
+            if self.done[index] != done:
+                self.done[index] = done
+                self.completed += 1 if done else -1
+            self._buffer.append(f"{'D' if done else 'U'} {index}\n")
+            if len(self._buffer) >= JOURNAL_BATCH or time.monotonic() - self._last_sync >= JOURNAL_INTERVAL:
+                self._sync_locked()
+
+    def sync(self):
+        """まだ書き出していない記録をディスクに確定させる。"""
+        with self._lock:
+            self._sync_locked()
+
+    def finish(self):
+        """すべて終わったことを記録してジャーナルを削除する。"""
+        with self._lock:
+            self._buffer.append("E\n")
+            self._sync_locked()
+            self._file.close()
+            self.finished = True
+        os.remove(self.path)
+        _release_lock(self._lock_file, self.path)
+
+    def close(self):
+        """記録を確定させて閉じる（ジャーナルは残し、ロックは外す）。"""
+        with self._lock:
+            if not self._file.closed:
+                self._sync_locked()
+                self._file.close()
+        _release_lock(self._lock_file)
+
+    def _sync_locked(self):
+        if self._buffer:
+            self._file.write("".join(self._buffer))
+            self._buffer.clear()
+            _sync_file(self._file)
+        self._last_sync = time.monotonic()
+
+
+def unfinished_journals(directory=JOURNAL_DIR):
+    """途中で止まったリネームのジャーナルのパス（古い順）。"""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, name) for name in names if name.endswith(JOURNAL_SUFFIX))
+
+
+def _acquire_lock(path):
+    """ジャーナル path のロックファイルを排他ロックして、開いたファイルを返す。ほかのプロセスがロック中なら None。"""
+    lock_file = open(path + LOCK_SUFFIX, 'a+b')
+    try:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def _release_lock(lock_file, path=None):
+    """ロックを外す（ファイルを閉じる）。path を渡すとロックファイルも削除する。"""
+    if lock_file.closed:
+        return
+    lock_file.close()
+    if path is not None:
+        try:
+            os.remove(path + LOCK_SUFFIX)
+        except OSError:
+            pass
+
+
+def _sync_file(file):
+    file.flush()
+    os.fsync(file.fileno())
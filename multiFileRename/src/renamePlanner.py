@@ -0,0 +1,116 @@
+"""
+MultiFileRename のリネームの手順を決める。
+変更前のパスと変更後のパスの組から、移動先がまだ使われている移動（連番を1つずらすときの 1.jpg→2.jpg など）を
+その移動先を空ける移動の後に並べ、入れ替え（1.jpg↔2.jpg）のように輪になった移動は一時的な名前を経由させる。
+移動先が既にあるかどうかは、フォルダごとに1度だけ取ったファイル一覧で調べる（ファイルごとに存在を問い合わせない）。
+"""
+import os
+import sys
+import uuid
+
+# 大文字と小文字を区別しないファイルシステムとして扱うか（Windows と macOS の既定）
+CASE_INSENSITIVE = os.path.normcase("A") == "a" or sys.platform == "darwin"
+
+
+class RenamePlanError(ValueError):
+    """リネームを始める前に分かる誤り（移動先が既にある、移動元が見つからないなど）。"""
+
+
+def path_key(path):
+    """ファイルシステム上で同じファイルを指すパスが同じ値になるキー。"""
+    path = os.path.normcase(os.path.normpath(path))
+    return path.casefold() if CASE_INSENSITIVE else path
+
+
+def _name_key(name):
+    """フォルダの一覧のファイル名の path_key()（区切り文字を含まないので正規化は要らない）。"""
+    return name.casefold() if CASE_INSENSITIVE else name
+
+
+def plan_renames(pairs, listdir=os.listdir):
+    """
+    (変更前のパス, 変更後のパス) の並びから、順に os.rename() すればよい (移動元, 移動先) のリストを作る。
+    変更のない組は含めない。移動先が重なる、移動先に移動しないファイルが既にある、移動元がないときは RenamePlanError。
+    """
+    moves = [(src, dst) for src, dst in pairs if src != dst]
+    keys = [(path_key(src), path_key(dst)) for src, dst in moves]
+    by_source = {}
+    by_target = {}
+    for index, (move, (src_key, dst_key)) in enumerate(zip(moves, keys)):
+        by_source[src_key] = index
+        if dst_key in by_target:
+            raise RenamePlanError(f"同名のファイル名が発生します: '{os.path.basename(move[1])}'")
+        by_target[dst_key] = index
+
+    listings = _listings(moves, keys, listdir)
+    for (src, dst), (src_key, dst_key) in zip(moves, keys):
+        directory, _, name = src_key.rpartition(os.sep)
+        if name not in listings[directory]:
+            raise RenamePlanError(f"ファイル '{src}' が見つかりません。")
+        # 移動先が既にあってよいのは、そのファイル自身もこの中で移動するときだけ
+        directory, _, name = dst_key.rpartition(os.sep)
+        if name in listings[directory] and dst_key not in by_source:
+            raise RenamePlanError(f"ファイル '{os.path.basename(dst)}' がすでに存在します。")
+
+    # 移動ごとに、その移動元へ入ってくる移動（移動元を空けると動かせるようになる移動）。大文字小文字だけの変更は自分自身を除く
+    predecessors = [by_target.get(src_key) for src_key, _ in keys]
+    predecessors = [None if found == index else found for index, found in enumerate(predecessors)]
+    planned = []
+    done = [False] * len(moves)
+
+    def walk_back(index, stop=None):
+        # 移動先が空いている移動から、その移動元を移動先とする移動へと順にさかのぼる
+        while index is not None and index != stop and not done[index]:
+            done[index] = True
+            planned.append(moves[index])
+            index = predecessors[index]
+
+    for index, (_, dst_key) in enumerate(keys):
+        occupant = by_source.get(dst_key)
+        if occupant is None or occupant == index:
+            walk_back(index)
+
+    # 残りはすべて輪になっている。1つを一時的な名前へ逃がし、輪の残りを順に動かしてから元の移動先へ入れる
+    # 一時的な名前への移動は最初にまとめて行う（途中で止まったときに、輪のどこまで進んだかを確かめやすくするため）
+    token = uuid.uuid4().hex[:8]
+    openings = []
+    for index, (src, dst) in enumerate(moves):
+        if done[index]:
+            continue
+        temporary = _temporary_path(src, keys[index][0], token, listings, by_target)
+        done[index] = True
+        openings.append((src, temporary))
+        walk_back(predecessors[index], stop=index)
+        planned.append((temporary, dst))
+    return openings + planned
+
+
+def _listings(moves, keys, listdir):
+    """移動元と移動先のフォルダ（のキー）ごとの、ファイル名のキーの集合（フォルダごとに1度だけ一覧を取る）。"""
+    listings = {}
+    for (src, dst), (src_key, dst_key) in zip(moves, keys):
+        for path, key in ((src, src_key), (dst, dst_key)):
+            directory_key = key.rpartition(os.sep)[0]
+            if directory_key in listings:
+                continue
+            directory = os.path.dirname(path)
+            try:
+                names = listdir(directory or ".")
+            except OSError as e:
+                raise RenamePlanError(f"フォルダ '{directory}' を読めません: {e}") from None
+            listings[directory_key] = {_name_key(name) for name in names}
+    return listings
+
+
+def _temporary_path(src, src_key, token, listings, by_target):
+    """src と同じフォルダで、既存のファイルとも移動先とも重ならない一時的な名前。"""
+    directory, name = os.path.split(src)
+    listing = listings[src_key.rpartition(os.sep)[0]]
+    for attempt in range(1000):
+        temporary = os.path.join(directory, f".{name}.renaming-{token}-{attempt}")
+        temporary_key = path_key(temporary)
+        temporary_name = temporary_key.rpartition(os.sep)[2]
+        if temporary_name not in listing and temporary_key not in by_target:
+            listing.add(temporary_name)
+            return temporary
+    raise RenamePlanError(f"ファイル '{src}' の一時的な名前を決められません。")
@@ -0,0 +1,98 @@
+"""
+MultiFileRename のファイル名テンプレート。
+テンプレートは最初に1度だけ、固定文字列と {filename} / {num} / {date} のプレースホルダの並びに分解し、書式も検証しておく。
+ファイル一覧への適用では、日付を埋め込んだ str.format 用の書式文字列を1つ作り、各ファイルはそれを1回呼ぶだけで名前が決まる。
+ファイル名の (拡張子なしの名前, 拡張子) への分解はテンプレートに依らないため、呼び出し側で1度だけ行って使い回す。
+"""
+import datetime
+import re
+import os
+
+# {date} の書式を省略したときの書式
+DEFAULT_DATE_FORMAT = "%Y%m%d"
+
+# 既定モードのテンプレート（カスタムはユーザーが入力したもの）
+MODE_TEMPLATES = {
+    "serial_only": "{num}",
+    "serial_prefix": "{num}_{filename}",
+    "serial_suffix": "{filename}_{num}",
+}
+
+_PLACEHOLDER = re.compile(r"{filename}|{(num|date)(?::(.*?))?}")
+
+
+class TemplateError(ValueError):
+    """テンプレートの書式の誤り（生成を始める前に検出する）。"""
+
+
+class CompiledTemplate:
+    """
+    解析済みのテンプレート。segments は ("text", 文字列) / ("filename", None) / ("num", 書式) / ("date", 書式) の並び。
+    """
+
+    def __init__(self, template, segments):
+        self.template = template
+        self.segments = segments
+
+    def format_string(self, now):
+        """日付を埋め込み、{0} に元ファイル名、{1} に連番を入れる str.format 用の書式文字列を返す。"""
+        parts = []
+        for kind, value in self.segments:
+            if kind == "text":
+                parts.append(value.replace("{", "{{").replace("}", "}}"))
+            elif kind == "date":
+                parts.append(now.strftime(value).replace("{", "{{").replace("}", "}}"))
+            elif kind == "filename":
+                parts.append("{0}")
+            else:
+                parts.append("{1:" + value + "}")
+        return "".join(parts)
+
+    def render(self, name_parts, start_number, now):
+        """
+        split_name() で分解したファイル名の並びに、start_number からの連番で適用した
+        新しいファイル名（拡張子付き）のリストを返す。
+        """
+        format_name = self.format_string(now).format
+        return [format_name(root, seq_num) + ext for seq_num, (root, ext) in enumerate(name_parts, start_number)]
+
+
+def split_name(path):
+    """パスのファイル名を (拡張子なしの名前, 拡張子) に分ける。"""
+    return os.path.splitext(os.path.basename(path))
+
+
+def compile_template(template):
+    """テンプレートを解析する。書式が正しくなければ TemplateError。"""
+    segments = []
+    position = 0
+    for match in _PLACEHOLDER.finditer(template):
+        if match.start() > position:
+            segments.append(("text", template[position:match.start()]))
+        position = match.end()
+        kind, spec = match.group(1), match.group(2)
+        if kind is None:
+            segments.append(("filename", None))
+        elif kind == "num":
+            segments.append(("num", _checked_number_format(spec or "")))
+        else:
+            segments.append(("date", _checked_date_format(spec or DEFAULT_DATE_FORMAT)))
+    if position < len(template):
+        segments.append(("text", template[position:]))
+    return CompiledTemplate(template, segments)
+
+
+def _checked_number_format(spec):
+    try:
+        format(0, spec)
+    except ValueError as e:
+        raise TemplateError(f"{{num:{spec}}} の書式が正しくありません（{e}）") from None
+    return spec
+
+
+def _checked_date_format(spec):
+    try:
+        datetime.datetime(2000, 1, 1).strftime(spec)
+    except ValueError as e:
+        raise TemplateError(f"{{date:{spec}}} の書式が正しくありません（{e}）") from None
+    return spec
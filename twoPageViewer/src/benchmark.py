@@ -0,0 +1,253 @@
+"""
+見開きビューアの描画処理のベンチマーク（画面は使わない）。
+解像度と形式（JPEG / PNG）の違う合成画像のフォルダを作業フォルダに生成し、ビューアと同じ
+PageRenderer・PagePrefetcher で見開きを順にめくって、ページめくり（両ページの仕上がりの画像がそろうまで）の
+p50 / p95 / p99 と段階ごとの所要時間、ピークRSS を JSON に書き出す。
+PhotoImage の作成とキャンバスの描き直しは Tk が必要なため含まない（ビューアの --timings で計測する）。
+ピークRSS をケースごとに分けて測るため、各ケースは別プロセスで実行する。
+--baseline で以前の結果（同じ表示枠・間隔で測ったもの）を渡すと、しきい値を超えて遅く（大きく）なった入力を検出する。
+
+例:
+    python benchmark.py --out bench.json
+    python benchmark.py --out new.json --baseline bench.json --threshold 0.10
+"""
+import argparse
+import platform
+import subprocess
+import json
+import time
+import sys
+import os
+
+from PIL import Image, ImageDraw
+import PIL
+
+# 合成入力の既定セット: (形式, 幅, 高さ)
+DEFAULT_INPUTS = [
+    ("jpeg", 1200, 1800),
+    ("jpeg", 3000, 4500),
+    ("jpeg", 6000, 9000),
+    ("png", 1200, 1800),
+    ("png", 3000, 4500),
+]
+DEFAULT_PAGES = 20
+# 片側のページの表示枠（ビューアの既定のウィンドウ 800x600 の見開き相当）
+DEFAULT_BOX = (400, 600)
+
+# 以前の結果と比較する指標（どれも値が大きいほど悪い）
+REGRESSION_METRICS = ("turn_p50", "turn_p95", "turn_p99", "peak_rss")
+
+_EXTENSIONS = {"jpeg": ".jpg", "png": ".png"}
+
+
+def synthetic_folder(work_dir, fmt, width, height, pages):
+    return os.path.join(work_dir, f"{fmt}_{width}x{height}_{pages}p")
+
+
+def generate_page(path, fmt, width, height, number):
+    """グラデーションと図形・ページ番号の入った、ページごとに内容の違う画像を作る。"""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    image = Image.merge("RGB", (gradient, gradient.transpose(Image.FLIP_LEFT_RIGHT),
+                                Image.new("L", (width, height), (number * 37) % 256)))
+    draw = ImageDraw.Draw(image)
+    step = max(1, min(width, height) // 12)
+    for i in range(0, min(width, height) // 2, step):
+        draw.ellipse((i, i, width - i, height - i), outline=(255 - i % 256, i % 256, 128), width=max(1, step // 8))
+    draw.text((step, step), f"page {number}", fill=(255, 255, 255))
+    if fmt == "jpeg":
+        image.save(path, "JPEG", quality=90)
+    else:
+        image.save(path, "PNG")
+
+
+def prepare_inputs(work_dir, inputs, pages):
+    """合成画像のフォルダを用意する（既にあれば作り直さない）。"""
+    folders = []
+    for fmt, width, height in inputs:
+        folder = synthetic_folder(work_dir, fmt, width, height, pages)
+        os.makedirs(folder, exist_ok=True)
+        for number in range(1, pages + 1):
+            path = os.path.join(folder, f"page{number:03d}{_EXTENSIONS[fmt]}")
+            if not os.path.exists(path):
+                generate_page(path, fmt, width, height, number)
+        print(f"入力: {os.path.basename(folder)}", file=sys.stderr)
+        folders.append(folder)
+    return folders
+
+
+def peak_rss():
+    """このプロセスのピークRSS（バイト）。取得できなければ None。"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        # Windows ではピークのワーキングセットを返す
+        return getattr(psutil.Process().memory_info(), "peak_wset", None)
+    except ImportError:
+        return None
+
+
+def run_case(folder, box, interval, workers, watermark):
+    """
+    フォルダの見開きを先頭から順にめくり、計測値を返す（このプロセスで1ケースだけ実行する）。
+    ビューアと同じく、表示する見開きは先読み済みならそのまま使い、なければ先読みと一緒にワーカーで描画する。
+    """
+    from pageCache import PageCache
+    from pagePrefetch import PagePrefetcher, PREFETCH_AHEAD, PREFETCH_BEHIND
+    from pageRenderer import PageRenderer
+    from pageSource import FolderSource
+    from pageTimings import StageTimings
+
+    source = FolderSource(folder)
+    source.start_scan()
+    source.wait()
+    if source.error is not None:
+        raise source.error
+
+    timings = StageTimings()
+    renderer = PageRenderer(PageCache(), timings=timings)
+    prefetcher = PagePrefetcher(renderer, max_workers=workers)
+    spreads = (len(source) + 1) // 2
+
+    def requests(spread):
+        return [(source.page(i), box[0], box[1], watermark)
+                for i in (spread * 2, spread * 2 + 1) if i < len(source)]
+
+    for spread in range(spreads):
+        started = time.perf_counter()
+        current = requests(spread)
+        upcoming = [r for s in [*range(spread + 1, spread + 1 + PREFETCH_AHEAD),
+                                *range(spread - PREFETCH_BEHIND, spread)]
+                    if 0 <= s < spreads for r in requests(s)]
+        missing = [r for r in current if renderer.cached(*r) is None]
+        futures, _ = prefetcher.schedule(missing, upcoming)
+        for future in futures:
+            future.result()
+        timings.record("turn", time.perf_counter() - started)
+        # 読んでいる時間の分だけ待つ（その間に先読みが進む）
+        time.sleep(interval)
+    prefetcher.shutdown()
+
+    summary = timings.summary()
+    turn = summary["turn"]
+    return {
+        "spreads": spreads,
+        "turn_p50": turn["p50"],
+        "turn_p95": turn["p95"],
+        "turn_p99": turn["p99"],
+        "turn_max": turn["max"],
+        "stages": {stage: {key: row[key] for key in ("count", "mean", "p50", "p95")}
+                   for stage, row in summary.items() if stage != "turn"},
+        "peak_rss": peak_rss(),
+    }
+
+
+def run_case_in_subprocess(folder, box, interval, workers, watermark):
+    args = {"folder": folder, "box": box, "interval": interval, "workers": workers, "watermark": watermark}
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(args)],
+                            stdout=subprocess.PIPE, text=True, encoding='utf-8', check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    return json.loads(result.stdout)
+
+
+def run_benchmark(folders, box, interval, workers, watermark, repeat):
+    cases = []
+    for folder in folders:
+        runs = [run_case_in_subprocess(folder, box, interval, workers, watermark) for _ in range(repeat)]
+        # 繰り返した中で p50 が中央値の回を代表値にする
+        runs.sort(key=lambda r: r["turn_p50"])
+        case = {"input": os.path.basename(folder), **runs[len(runs) // 2]}
+        cases.append(case)
+        print(f"{case['input']}: p50 {case['turn_p50'] * 1000:.1f}ms  p95 {case['turn_p95'] * 1000:.1f}ms  "
+              f"p99 {case['turn_p99'] * 1000:.1f}ms  peak {(case['peak_rss'] or 0) / 1024 ** 2:.0f}MB",
+              file=sys.stderr)
+    return cases
+
+
+def find_regressions(cases, baseline_cases, threshold):
+    """基準の結果と入力ごとに比べて threshold（割合）を超えて悪化した指標を返す。"""
+    baseline = {case["input"]: case for case in baseline_cases}
+    regressions = []
+    for case in cases:
+        base = baseline.get(case["input"], {})
+        for metric in REGRESSION_METRICS:
+            old, new = base.get(metric), case.get(metric)
+            if old and new is not None and (new - old) / old > threshold:
+                regressions.append({"case": case["input"], "metric": metric,
+                                    "baseline": old, "current": new, "change": round((new - old) / old, 4)})
+    return regressions
+
+
+def parse_box(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="見開きビューアの描画処理のベンチマークを実行します。")
+    parser.add_argument("--work-dir", default="bench_work", help="合成画像のフォルダを置くフォルダ")
+    parser.add_argument("--pages", type=int, default=DEFAULT_PAGES, help="1フォルダの画像の枚数")
+    parser.add_argument("--box", default="%dx%d" % DEFAULT_BOX, help="片側のページの表示枠（幅x高さ）")
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="ページをめくる間隔（秒、0 で続けてめくる＝先読みが追いつかない最悪の場合）")
+    parser.add_argument("--workers", type=int, default=2, help="描画のワーカースレッド数")
+    parser.add_argument("--watermark", action="store_true", help="ファイル名の透かしを入れる")
+    parser.add_argument("--repeat", type=int, default=3, help="各ケースの繰り返し回数（p50 が中央値の回を採用）")
+    parser.add_argument("--out", default="bench.json", help="結果の JSON ファイル")
+    parser.add_argument("--baseline", default=None, help="比較する以前の結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.10, help="悪化とみなす変化の割合")
+    parser.add_argument("--case", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.case:
+        # 親プロセスから呼ばれた1ケース分の実行
+        case = json.loads(args.case)
+        print(json.dumps(run_case(case["folder"], tuple(case["box"]), case["interval"],
+                                  case["workers"], case["watermark"])))
+        return 0
+
+    box = parse_box(args.box)
+    folders = prepare_inputs(args.work_dir, DEFAULT_INPUTS, args.pages)
+    cases = run_benchmark(folders, box, args.interval, args.workers, args.watermark, max(1, args.repeat))
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers,
+        "pages": args.pages,
+        "repeat": args.repeat,
+        "box": list(box),
+        "interval": args.interval,
+        "cases": cases,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if (baseline.get("box"), baseline.get("interval")) != (report["box"], report["interval"]):
+            print(f"基準の結果 '{args.baseline}' は表示枠か間隔が違うため比較しません。", file=sys.stderr)
+        else:
+            regressions = find_regressions(cases, baseline.get("cases", []), args.threshold)
+        report["baseline"] = args.baseline
+        report["threshold"] = args.threshold
+        report["regressions"] = regressions
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for regression in regressions:
+        print(f"悪化: {regression['case']} {regression['metric']} "
+              f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+"""
+見開きビューアで、非常に大きなスキャン画像（数億画素の PNG / TIFF など）をメモリ上限内で縮小デコードする。
+ヘッダの大きさから RGB に展開したときのサイズを見積もり、LARGE_IMAGE_BYTES を超える画像は
+上から帯（数百行ずつ）に分けてデコードし、帯ごとに reduce() で縮小してから貼り合わせる。
+帯に分けられるのは 8 ビットのインターレースなし PNG と、無圧縮の画像（BMP・無圧縮 TIFF など）。
+PNG は IDAT を少しずつ展開し、帯の行だけを Pillow の PNG 用デコーダ（zip）に渡してフィルタを戻させる。
+それ以外の形式は全体をデコードするしかないため、大きな画像の全体デコードは同時に1枚までにする。
+Pillow の画素数の上限（DecompressionBombError）は変えず、上限を超える画像は open_image() で、
+帯に分けられる形式か縮小デコードできる JPEG で MAX_LARGE_PIXELS 以下のものに限って開く。
+"""
+import threading
+import struct
+import zlib
+import io
+import os
+
+from PIL import Image, BmpImagePlugin, JpegImagePlugin, PngImagePlugin, PpmImagePlugin, TiffImagePlugin
+
+from pageTimings import NO_TIMINGS
+
+# RGB（4バイト/画素）に展開したときにこれを超える画像は帯ごとに縮小する
+LARGE_IMAGE_BYTES = 256 * 1024 ** 2
+# 帯1本のデコードに使うメモリの目安（バイト）
+STRIP_BYTES = 32 * 1024 ** 2
+# IDAT を読み進める単位（バイト）
+READ_BLOCK = 1024 ** 2
+# Pillow の画素数の上限（既定で約 1 億 7900 万画素）を超えても開く画像の画素数の上限。
+# 帯ごとにデコードできる形式と、1/8 までの縮小デコードができる JPEG に限る
+MAX_LARGE_PIXELS = 1024 ** 3
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Pillow の上限を超えたときに、形式を決めて直接開くためのファイル先頭のバイト列 -> 画像クラス
+_LARGE_FORMATS = [
+    (_PNG_SIGNATURE, PngImagePlugin.PngImageFile),
+    (b"\xff\xd8\xff", JpegImagePlugin.JpegImageFile),
+    (b"BM", BmpImagePlugin.BmpImageFile),
+    (b"II*\0", TiffImagePlugin.TiffImageFile),
+    (b"MM\0*", TiffImagePlugin.TiffImageFile),
+    (b"P5", PpmImagePlugin.PpmImageFile),
+    (b"P6", PpmImagePlugin.PpmImageFile),
+]
+_CHUNK_HEADER = struct.Struct(">I4s")
+_IHDR = struct.Struct(">IIBBBBB")
+# PNG のカラータイプ -> (モード, 1画素のチャンネル数)（ビット深度 8 のとき1チャンネル1バイト）
+_PNG_MODES = {0: ("L", 1), 2: ("RGB", 3), 3: ("P", 1), 4: ("LA", 2), 6: ("RGBA", 4)}
+# 無圧縮の画像を帯ごとに読むときに扱えるモード（パレットなしで RGB に変換できるもの）
+_RAW_MODES = ("1", "L", "LA", "RGB", "RGBA", "RGBX", "CMYK")
+# reduce() が使えるモード（それ以外は RGB に変換してから縮小する）
+_REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA")
+
+# 帯に分けられない大きな画像の全体デコードは同時に1枚まで
+_full_decode_lock = threading.Lock()
+
+
+def open_image(fp):
+    """
+    Image.open() と同じ。Pillow の画素数の上限を超える画像は、帯ごとにデコードできる形式か JPEG で、
+    MAX_LARGE_PIXELS 以下のときだけ開く（それ以外は Pillow と同じく DecompressionBombError）。
+    """
+    try:
+        return Image.open(fp)
+    except Image.DecompressionBombError:
+        opened = _open_without_pixel_limit(fp)
+        if opened is None:
+            raise
+        if (opened.width * opened.height > MAX_LARGE_PIXELS
+                or (opened.format != "JPEG" and not can_decode_in_strips(opened))):
+            opened.close()
+            raise
+        return opened
+
+
+def _open_without_pixel_limit(fp):
+    if isinstance(fp, (str, bytes, os.PathLike)):
+        with open(fp, "rb") as f:
+            head = f.read(8)
+    else:
+        fp.seek(0)
+        head = fp.read(8)
+        fp.seek(0)
+    for signature, image_class in _LARGE_FORMATS:
+        if head.startswith(signature):
+            try:
+                # 画像クラスを直接使うと、Image.open() の画素数の確認を通らない
+                return image_class(fp)
+            except (OSError, SyntaxError, ValueError):
+                return None
+    return None
+
+
+def can_decode_in_strips(opened):
+    """開いただけの画像を decode_in_strips() で帯ごとにデコードできるか。"""
+    if opened.format == "PNG":
+        opened.fp.seek(0)
+        return _png_header(opened.fp) is not None
+    return _raw_pieces(opened) is not None
+
+
+def is_large(opened):
+    """開いただけの（まだデコードしていない）画像が、そのままデコードするには大きすぎるか。"""
+    return opened.width * opened.height * 4 > LARGE_IMAGE_BYTES
+
+
+def decode_large(opened, needed, timings=NO_TIMINGS):
+    """
+    大きな画像 opened を、needed（幅, 高さ）を下回らない範囲で整数分の1に縮小した RGB 画像にする。
+    帯ごとにデコードできる形式なら、メモリに載るのは帯1本分と縮小後の画像だけになる。
+    """
+    factor = max(1, min(opened.width // needed[0], opened.height // needed[1]))
+    with timings.measure("decode"):
+        image = decode_in_strips(opened, factor)
+    if image is not None:
+        return image
+    with _full_decode_lock:
+        with timings.measure("decode"):
+            opened.load()
+        # RGB への変換で画像がもう1枚増えないよう、できれば先に縮小する
+        reduce_first = factor >= 2 and opened.mode in _REDUCIBLE_MODES
+        image = opened
+        if reduce_first:
+            with timings.measure("resize"):
+                image = image.reduce(factor)
+        with timings.measure("convert"):
+            image = image.convert("RGB")
+        if factor >= 2 and not reduce_first:
+            with timings.measure("resize"):
+                image = image.reduce(factor)
+    return image
+
+
+def decode_in_strips(opened, factor):
+    """帯ごとにデコードして 1/factor に縮小した RGB 画像を返す。帯に分けられない形式なら None。"""
+    if opened.format == "PNG":
+        return _decode_png_strips(opened.fp, factor)
+    return _decode_raw_strips(opened, factor)
+
+
+def _strip_rows(width, factor):
+    """帯1本の行数（縮小の単位 factor の倍数にして、帯の境目で縮小の枠がずれないようにする）。"""
+    return max(factor, STRIP_BYTES // max(1, width * 4) // factor * factor)
+
+
+def _reduced(strip, factor, top=0):
+    """帯 strip の top 行目から下を RGB にして 1/factor に縮小する（RGB の帯は変換のコピーを作らない）。"""
+    if strip.mode != "RGB":
+        strip = strip.convert("RGB")
+    box = (0, top, strip.width, strip.height)
+    return strip.reduce(factor, box) if factor >= 2 else strip.crop(box)
+
+
+class _PngRows:
+    """PNG の IDAT を少しずつ展開し、フィルタがかかったままの行を必要な数だけ返す。"""
+
+    def __init__(self, fp, row_bytes):
+        self.fp = fp
+        self.row_bytes = row_bytes
+        self.inflater = zlib.decompressobj()
+        self.remaining = 0  # 読みかけの IDAT の残りバイト数
+        self.done = False
+
+    def read(self, count, prefix=b""):
+        """count 行分のデータを、prefix を先頭に付けて返す。"""
+        # 展開する量を残りの必要量までに絞るため、必要な分を超えて展開されることはない
+        size = count * self.row_bytes
+        parts = [prefix]
+        while size > 0 and not self.done:
+            data = self._inflate(size)
+            parts.append(data)
+            size -= len(data)
+        if size > 0:
+            raise OSError("image file is truncated")
+        return b"".join(parts)
+
+    def _inflate(self, size):
+        if self.inflater.unconsumed_tail:
+            return self.inflater.decompress(self.inflater.unconsumed_tail, size)
+        data = self._read_idat()
+        if not data:
+            self.done = True
+            return b""
+        return self.inflater.decompress(data, size)
+
+    def _read_idat(self):
+        if self.remaining == 0:
+            # 前の IDAT の CRC を読み飛ばして次のチャンクへ。IDAT 以外なら画像データは終わり
+            self.fp.read(4)
+            header = self.fp.read(_CHUNK_HEADER.size)
+            if len(header) < _CHUNK_HEADER.size:
+                return b""
+            length, kind = _CHUNK_HEADER.unpack(header)
+            if kind != b"IDAT":
+                return b""
+            self.remaining = length
+        data = self.fp.read(min(self.remaining, READ_BLOCK))
+        if not data:
+            return b""
+        self.remaining -= len(data)
+        return data
+
+
+def _png_header(fp):
+    """先頭から読んだ PNG の (幅, 高さ, モード, チャンネル数)。帯に分けられない PNG なら None。"""
+    if fp.read(len(_PNG_SIGNATURE)) != _PNG_SIGNATURE:
+        return None
+    length, kind = _CHUNK_HEADER.unpack(fp.read(_CHUNK_HEADER.size))
+    if kind != b"IHDR" or length != _IHDR.size:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = _IHDR.unpack(fp.read(_IHDR.size))
+    if bit_depth != 8 or interlace or color_type not in _PNG_MODES:
+        return None
+    return (width, height) + _PNG_MODES[color_type]
+
+
+def _decode_png_strips(fp, factor):
+    fp.seek(0)
+    header = _png_header(fp)
+    if header is None:
+        return None
+    width, height, mode, channels = header
+    fp.read(4)
+
+    # IDAT の前にあるチャンクのうち、帯のデコードに必要なのはパレットだけ
+    palette = None
+    while True:
+        length, kind = _CHUNK_HEADER.unpack(fp.read(_CHUNK_HEADER.size))
+        if kind == b"IDAT":
+            break
+        if kind == b"IEND":
+            raise OSError("image file is truncated")
+        if kind == b"PLTE":
+            palette = fp.read(length)
+            fp.read(4)
+        else:
+            fp.seek(length + 4, io.SEEK_CUR)
+
+    rows = _PngRows(fp, 1 + width * channels)
+    rows.remaining = length
+    result = Image.new("RGB", (-(-width // factor), -(-height // factor)))
+    strip_rows = _strip_rows(width, factor)
+    previous = None  # 直前の帯の最後の行（フィルタを戻した値）。次の帯のフィルタが参照する
+    for top in range(0, height, strip_rows):
+        count = min(strip_rows, height - top)
+        # 帯の最初の行のフィルタが参照する前の行を、フィルタなし（種類 0）で先頭に付ける
+        skip = 0 if previous is None else 1
+        data = rows.read(count, b"\0" + previous if skip else b"")
+        strip_height = count + skip
+        # zip デコーダは zlib で圧縮されたデータしか受け取らないため、圧縮なし（レベル 0）で包み直す
+        strip = Image.frombytes(mode, (width, strip_height), zlib.compress(data, 0), "zip", mode)
+        del data
+        if palette is not None:
+            strip.putpalette(palette)
+        previous = strip.crop((0, strip_height - 1, width, strip_height)).tobytes()
+        result.paste(_reduced(strip, factor, skip), (0, top // factor))
+    return result
+
+
+def _raw_row_bytes(mode, rawmode, width):
+    try:
+        return len(Image.new(mode, (width, 1)).tobytes("raw", rawmode))
+    except ValueError:
+        return None
+
+
+def _raw_pieces(opened):
+    """
+    無圧縮の画像（Pillow のタイルが "raw" で、横幅いっぱいの帯になっているもの）のタイルごとの
+    (上端, 下端, オフセット, rawmode, 行のバイト数, 行の向き)。帯に分けて読めない画像なら None。
+    """
+    width = opened.width
+    if opened.mode not in _RAW_MODES or not opened.tile:
+        return None
+    pieces = []
+    for codec, extents, offset, args in opened.tile:
+        if codec != "raw" or extents[0] != 0 or extents[2] != width:
+            return None
+        # 引数は rawmode か (rawmode, 行のバイト数, 行の向き)。省略された値は既定値（0 は自動計算）
+        args = (args,) if isinstance(args, str) else tuple(args)
+        rawmode, stride, orientation = args + (None, 0, 1)[len(args):]
+        if not stride:
+            stride = _raw_row_bytes(opened.mode, rawmode, width)
+            if stride is None:
+                return None
+        pieces.append((extents[1], extents[3], offset, rawmode, stride, orientation))
+    return pieces
+
+
+def _decode_raw_strips(opened, factor):
+    """無圧縮の画像を帯ごとに読む。"""
+    pieces = _raw_pieces(opened)
+    if pieces is None:
+        return None
+    width, height = opened.size
+    fp = opened.fp
+    result = Image.new("RGB", (-(-width // factor), -(-height // factor)))
+    strip_rows = _strip_rows(width, factor)
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        strip = Image.new(opened.mode, (width, bottom - top))
+        for piece_top, piece_bottom, offset, rawmode, stride, orientation in pieces:
+            first, last = max(top, piece_top), min(bottom, piece_bottom)
+            if first >= last:
+                continue
+            # 下から上へ並んだ画像（BMP など）は、ファイル上では帯の下端の行が先に来る
+            if orientation < 0:
+                fp.seek(offset + (piece_bottom - last) * stride)
+            else:
+                fp.seek(offset + (first - piece_top) * stride)
+            data = fp.read((last - first) * stride)
+            if len(data) < (last - first) * stride:
+                raise OSError("image file is truncated")
+            strip.paste(Image.frombytes(opened.mode, (width, last - first), data, "raw",
+                                        rawmode, stride, orientation), (0, first - top))
+        result.paste(_reduced(strip, factor), (0, top // factor))
+    return result
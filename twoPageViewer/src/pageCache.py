@@ -0,0 +1,89 @@
+"""
+見開きビューアのページ画像キャッシュ。
+デコードした元画像と、表示枠に合わせて縮小した画像の両方を、合計バイト数の上限内で保持する。
+上限を超えたら最も長く使われていないものから捨てる（LRU）。
+"""
+from collections import OrderedDict
+import threading
+
+# 既定の容量上限（バイト）
+DEFAULT_MAX_BYTES = 512 * 1024 ** 2
+
+
+def image_bytes(image):
+    """PIL 画像が展開後に占めるおおよそのバイト数。"""
+    return image.width * image.height * len(image.getbands())
+
+
+class PageCache:
+    """
+    キー -> PIL 画像 の LRU キャッシュ（スレッドセーフ）。
+    1枚で上限を超える画像は保持しない。
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # キー -> (画像, バイト数)
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key):
+        """
+        get と同じだが、見つからなくてもミスとして数えない。
+        見つからなければ呼び出し側が別途（ワーカーなどで）get するときに数える。
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, image):
+        size = image_bytes(image)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self.entries[key] = (image, size)
+            self.total_bytes += size
+            self._evict()
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def stats_summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"ページキャッシュ: {len(self.entries)}件 {self.total_bytes / 1024 ** 2:.0f}"
+                f"/{self.max_bytes / 1024 ** 2:.0f}MB  ヒット {self.hits} / ミス {self.misses}"
+                f" ({rate:.0f}%)  破棄 {self.evictions}")
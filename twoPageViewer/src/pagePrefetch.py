@@ -0,0 +1,66 @@
+"""
+見開きビューアの先読み。
+表示中の見開きと、その先・手前の見開きのページ画像をワーカースレッドでデコード・縮小して PageCache に入れておく。
+ページ移動・リサイズ・読み方向の切り替えのたびに予定を組み直し、古い予定のうち未着手のものは捨てる。
+PhotoImage の作成は Tk のスレッドでしか行えないため、ここでは PIL 画像までを用意する。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# 先読みする見開き数（読み進める方向と、その逆方向）
+PREFETCH_AHEAD = 3
+PREFETCH_BEHIND = 1
+DEFAULT_WORKERS = 2
+
+
+class PagePrefetcher:
+    """
+    描画要求 (パス, 幅, 高さ, 透かし) をワーカーで PageRenderer.render に渡す。
+    schedule() を呼ぶたびに世代が進み、前の世代で未着手の要求は実行されない。
+    """
+
+    def __init__(self, renderer, max_workers=DEFAULT_WORKERS):
+        self.renderer = renderer
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.generation = 0
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def schedule(self, current, upcoming, previews=()):
+        """
+        粗い下描きの要求 previews、表示する見開きの要求 current、先読みの要求 upcoming の順に投入する。
+        (current の Future のリスト, previews の Future のリスト) を返す。
+        """
+        render = self.renderer.render
+        with self.lock:
+            generation = self._cancel_locked()
+            preview_futures = [self.executor.submit(self._run, generation, self.renderer.render_preview, request)
+                               for request in previews]
+            current_futures = [self.executor.submit(self._run, generation, render, request)
+                               for request in current]
+            prefetch_futures = [self.executor.submit(self._run, generation, render, request)
+                                for request in upcoming if request not in current]
+            self.futures = preview_futures + current_futures + prefetch_futures
+        return current_futures, preview_futures
+
+    def cancel(self):
+        with self.lock:
+            self._cancel_locked()
+
+    def _cancel_locked(self):
+        self.generation += 1
+        for future in self.futures:
+            future.cancel()
+        self.futures = []
+        return self.generation
+
+    def _run(self, generation, render, request):
+        # 投入後にページ移動などで予定が組み直されていれば、デコードせずに終える
+        if generation != self.generation:
+            return None
+        return render(*request)
+
+    def shutdown(self, wait=True):
+        """未着手の要求を捨てて終了する。wait なら実行中の描画が終わるまで待つ。"""
+        self.cancel()
+        self.executor.shutdown(wait=wait)
@@ -0,0 +1,192 @@
+"""
+見開きビューアの1ページ分の描画処理（GUI に依存しない部分）。
+画像を開いて RGB にデコードし、表示枠に収まるよう LANCZOS で縮小して、必要ならファイル名の透かしを入れる。
+デコードは表示サイズに近い解像度で行う（JPEG はデコーダの縮小（draft）、それ以外は reduce()）。
+全体を展開すると大きすぎる画像は largeImage で帯ごとに縮小する。
+デコード済みの元画像と縮小後の画像は PageCache に保持し、同じページを再表示するときはデコードしない。
+RenditionCache を渡すと縮小後の画像をディスクにも保存し、次回の起動でも元画像をデコードせずに表示する。
+StageTimings を渡すと、開く・デコード・変換・縮小・透かしの段階ごとの所要時間を記録する。
+"""
+import sqlite3
+import sys
+
+from PIL import Image, ImageDraw, ImageFont
+
+from largeImage import open_image, is_large, decode_large
+from pageCache import PageCache
+from pageTimings import NO_TIMINGS
+from renditionCache import bucket_box
+
+WATERMARK_COLOR = (128, 128, 128)
+WATERMARK_MARGIN = 10
+# デコード時に縮小してよいのは表示サイズのこの倍率まで（LANCZOS での仕上げの画質を保つ）
+REDUCING_GAP = 2.0
+
+
+def fit_size(image_width, image_height, box_width, box_height):
+    """縦横比を保って (box_width, box_height) に収まる最大のサイズを返す。"""
+    image_ratio = image_width / image_height
+    box_ratio = box_width / box_height
+    if image_ratio > box_ratio:
+        width = box_width
+        height = int(width / image_ratio)
+    else:
+        height = box_height
+        width = int(height * image_ratio)
+    return max(1, width), max(1, height)
+
+
+def decode_for_box(fp, box_width, box_height, reducing_gap=REDUCING_GAP, timings=NO_TIMINGS):
+    """
+    表示枠に合わせて縮小してよい範囲で、できるだけ小さくデコードした RGB 画像を返す。
+    fp はパスまたはファイルオブジェクト。元の大きさは image.info["original_size"] に残す。
+    """
+    with timings.measure("open"):
+        opened = open_image(fp)
+    with opened:
+        original_size = opened.size
+        target = fit_size(*original_size, box_width, box_height)
+        needed = (max(1, int(target[0] * reducing_gap)), max(1, int(target[1] * reducing_gap)))
+        # JPEG なら DCT の段階で 1/2, 1/4, 1/8 に縮小してデコードする（他の形式では何もしない）
+        opened.draft("RGB", needed)
+        if is_large(opened):
+            # 全体を展開するとメモリに載りきらない画像は、帯ごとに縮小しながらデコードする
+            image = decode_large(opened, needed, timings)
+        else:
+            with timings.measure("decode"):
+                opened.load()
+            with timings.measure("convert"):
+                image = opened.convert("RGB")
+    factor = min(image.width // needed[0], image.height // needed[1])
+    if factor >= 2:
+        with timings.measure("resize"):
+            image = image.reduce(factor)
+    image.info["original_size"] = original_size
+    return image
+
+
+def covers(source, width, height):
+    """デコード済みの source から表示枠 width x height の画像を作るのに解像度が足りるか。"""
+    if source.size == source.info.get("original_size", source.size):
+        return True
+    target = fit_size(source.width, source.height, width, height)
+    return source.width >= target[0] and source.height >= target[1]
+
+
+def make_thumbnail(page, size):
+    """size x size に収まるサムネイル（JPEG は縮小デコードするため元画像の全画素は展開しない）。"""
+    with page.open() as fp:
+        image = decode_for_box(fp, size, size, reducing_gap=1.0)
+    return image.resize(fit_size(image.width, image.height, size, size), Image.BILINEAR)
+
+
+def quick_fit(image, width, height):
+    """ウィンドウのリサイズ中に出す仮の画像。表示中の画像を BILINEAR で拡大縮小するだけ（デコードしない）。"""
+    return image.resize(fit_size(image.width, image.height, width, height), Image.BILINEAR)
+
+
+def fit_rendition(rendition, width, height):
+    """表示枠の区分の大きさで保存された画像を、実際の表示枠に収める。"""
+    size = fit_size(rendition.width, rendition.height, width, height)
+    if size == rendition.size:
+        return rendition.copy()
+    return rendition.resize(size, Image.LANCZOS)
+
+
+def draw_watermark(image, text):
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((WATERMARK_MARGIN, WATERMARK_MARGIN), text, font=font, fill=WATERMARK_COLOR)
+
+
+class PageRenderer:
+    """
+    ページ画像を表示枠に合わせて用意する。ページは pageSource の FilePage / ArchivePage。
+    元画像は (ページ, 更新日時) 、縮小結果は (ページ, 更新日時, 表示枠, 透かしの有無) をキーにキャッシュする。
+    """
+
+    def __init__(self, cache=None, disk_cache=None, timings=NO_TIMINGS):
+        self.cache = cache if cache is not None else PageCache()
+        self.disk_cache = disk_cache
+        self.timings = timings
+
+    def load_source(self, page, mtime, width, height):
+        """表示枠 width x height に足りる解像度の元画像を返す（キャッシュのものが小さすぎればデコードし直す）。"""
+        key = ("source", page, mtime)
+        image = self.cache.get(key)
+        if image is None or not covers(image, width, height):
+            with page.open() as fp:
+                image = decode_for_box(fp, width, height, timings=self.timings)
+            self.cache.put(key, image)
+        return image
+
+    def cached(self, page, width, height, watermark):
+        """キャッシュ済みならページ画像を、なければ None を返す（デコードはしない）。"""
+        return self.cache.peek(("fitted", page, page.stamp(), (width, height), watermark))
+
+    def render(self, page, width, height, watermark):
+        """表示枠 width x height に収めたページ画像（PIL 画像）を返す。"""
+        mtime = page.stamp()
+        key = ("fitted", page, mtime, (width, height), watermark)
+        image = self.cache.get(key)
+        if image is not None:
+            return image
+
+        image = self.fit_page(page, mtime, width, height)
+        if watermark:
+            with self.timings.measure("watermark"):
+                draw_watermark(image, page.name)
+        self.cache.put(key, image)
+        return image
+
+    def fit_page(self, page, mtime, width, height):
+        """透かしなしで表示枠に収めた画像。ディスクキャッシュにあれば元画像はデコードしない。"""
+        if self.disk_cache is None:
+            source = self.load_source(page, mtime, width, height)
+            with self.timings.measure("resize"):
+                return source.resize(fit_size(source.width, source.height, width, height), Image.LANCZOS)
+
+        rendition = self.disk_cache.get(page, width, height)
+        if rendition is None:
+            # 表示枠の区分の大きさで作って保存し、そこから実際の枠へ縮小する
+            bucket_width, bucket_height = bucket_box(width, height)
+            source = self.load_source(page, mtime, bucket_width, bucket_height)
+            with self.timings.measure("resize"):
+                rendition = source.resize(fit_size(source.width, source.height, bucket_width, bucket_height),
+                                          Image.LANCZOS)
+            try:
+                self.disk_cache.put(page, width, height, rendition)
+            except (OSError, sqlite3.Error) as e:
+                # ディスクキャッシュへの保存に失敗しても表示には影響させない
+                print(f"ディスクキャッシュへの保存に失敗しました: {e}", file=sys.stderr)
+        with self.timings.measure("resize"):
+            return fit_rendition(rendition, width, height)
+
+    def render_preview(self, page, width, height, watermark):
+        """
+        LANCZOS の結果より先に出す、粗いが速いページ画像を返す（キャッシュしない）。
+        デコード済みの元画像があればそれを、なければ JPEG を 1/8 までの縮小デコードで使う。
+        どちらもできない（JPEG 以外で未デコード）場合は None。
+        """
+        mtime = page.stamp()
+        source = self.cache.peek(("source", page, mtime))
+        if source is None and self.disk_cache is not None:
+            # ディスクキャッシュにあれば、それがそのまま仕上がりの画像になる
+            rendition = self.disk_cache.get(page, width, height)
+            if rendition is not None:
+                image = fit_rendition(rendition, width, height)
+                if watermark:
+                    draw_watermark(image, page.name)
+                self.cache.put(("fitted", page, mtime, (width, height), watermark), image)
+                return image
+        if source is None:
+            with page.open() as fp, open_image(fp) as opened:
+                if opened.format != "JPEG":
+                    return None
+                opened.draft("RGB", fit_size(*opened.size, width, height))
+                source = opened.convert("RGB")
+        image = source.resize(fit_size(source.width, source.height, width, height), Image.BILINEAR,
+                              reducing_gap=1.0)
+        if watermark:
+            draw_watermark(image, page.name)
+        return image
@@ -0,0 +1,319 @@
+"""
+見開きビューアで表示するページの一覧（画像フォルダ、または ZIP / CBZ アーカイブ）。
+フォルダはバックグラウンドで os.scandir により走査し、見つかった画像を随時自然順（page2 < page10）の一覧に取り込む。
+一覧はフォルダのパスと、ファイル名・ソートキーの並びだけを持つ（フルパスの文字列は必要になったときに作る）。
+アーカイブは展開せず、セントラルディレクトリから作った目次をもとに必要なページだけを読み出す。
+無圧縮で格納されたページはメモリマップしたアーカイブから直接読む。
+"""
+from collections import namedtuple
+import threading
+import zipfile
+import struct
+import mmap
+import time
+import io
+import re
+import os
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+ARCHIVE_EXTS = (".zip", ".cbz")
+# 走査中に見つけた画像を一覧へ取り込む間隔（秒）。
+# 一覧が大きくなり取り込みに時間が掛かるようになったら、間隔を取り込み時間の MERGE_BACKOFF 倍まで広げる
+MERGE_INTERVAL = 0.1
+MERGE_BACKOFF = 4
+
+_DIGITS = re.compile(r'\d+')
+# ZIP のローカルファイルヘッダ（ファイル名・拡張フィールドの長さはオフセット 26, 28）
+_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def _encode_number(match):
+    digits = match.group().lstrip('0') or '0'
+    # 桁数を先頭に付けると、文字列の比較で数値の大小順になる
+    return '\0' + chr(0x30 + len(digits)) + digits
+
+
+def natural_sort_key(name):
+    """
+    自然順に並べるためのキー（文字列）。数値部分は数値として比較される。
+    リストのキーより小さいため、大量のファイル名を保持しても軽い。
+    """
+    return _DIGITS.sub(_encode_number, name.lower())
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTS
+
+
+def is_archive(path):
+    return os.path.isfile(path) and path.lower().endswith(ARCHIVE_EXTS)
+
+
+def open_source(path):
+    """フォルダまたはアーカイブのパスから、対応するページ一覧を作る（走査はまだ始めない）。"""
+    if is_archive(path):
+        return ArchiveSource(path)
+    return FolderSource(path)
+
+
+class FilePage(namedtuple("FilePage", ["path"])):
+    """フォルダ内の画像ファイル1枚。"""
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def identity(self):
+        """起動をまたいでも変わらないページの識別子（ディスクキャッシュのキー）。"""
+        return os.path.abspath(self.path)
+
+    def stamp(self):
+        """内容が変わったことを検出するための値（更新日時とサイズ）。"""
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def open(self):
+        return open(self.path, 'rb')
+
+
+class ArchivePage(namedtuple("ArchivePage", ["archive", "member"])):
+    """アーカイブ内の画像1枚（member はアーカイブ内のパス）。"""
+    __slots__ = ()
+
+    @property
+    def name(self):
+        return self.member.rsplit("/", 1)[-1]
+
+    @property
+    def identity(self):
+        return os.path.abspath(self.archive.path) + "::" + self.member
+
+    def stamp(self):
+        return self.archive.stamp, self.archive.infos[self.member].CRC
+
+    def open(self):
+        return self.archive.open_member(self.member)
+
+
+class _ScanningSource:
+    """
+    バックグラウンドで作る、自然順に並んだページ一覧の共通部分。
+    走査中も len() と page() は使え、一覧が更新されるたびに version が増える。
+    scan_names は見つけた画像の名前を順に返す関数（走査のスレッドで呼ばれる）。
+    """
+
+    def __init__(self, scan_names):
+        self._scan_names = scan_names
+        self.names = []  # 自然順に並べた名前
+        self.keys = []  # names と同じ並びのソートキー
+        self.version = 0
+        self.scanning = False
+        self.error = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def start_scan(self):
+        self.scanning = True
+        self._thread = threading.Thread(target=self._run_scan, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def close(self):
+        """走査を止め、開いているファイルを閉じる（一覧を使い終わったときに呼ぶ）。"""
+        self.cancel()
+
+    def wait(self):
+        """走査が終わるまで待つ（GUI を使わない処理向け）。"""
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run_scan(self):
+        batch = []
+        last_merge = time.monotonic()
+        interval = MERGE_INTERVAL
+        try:
+            for name in self._scan_names():
+                if self._cancel.is_set():
+                    return
+                batch.append((natural_sort_key(name), name))
+                if time.monotonic() - last_merge >= interval:
+                    started = time.monotonic()
+                    self._merge(batch)
+                    batch = []
+                    last_merge = time.monotonic()
+                    interval = max(MERGE_INTERVAL, (last_merge - started) * MERGE_BACKOFF)
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            self.error = e
+        finally:
+            self._merge(batch)
+            self.scanning = False
+
+    def _merge(self, batch):
+        """ソート済みの一覧に新しい画像をまとめて差し込む（読み取り側からは一覧の差し替えに見える）。"""
+        if not batch:
+            return
+        # 既存の一覧と追加分をそれぞれ整列済みの並びにしておくと、sorted はほぼ線形時間で結合する
+        batch.sort()
+        merged = sorted([*zip(self.keys, self.names), *batch])
+        keys = [key for key, _ in merged]
+        names = [name for _, name in merged]
+        self.keys, self.names = keys, names
+        self.version += 1
+
+
+class FolderSource(_ScanningSource):
+    """フォルダ内の画像の一覧。start_scan() で os.scandir による走査を始める。"""
+
+    def __init__(self, folder):
+        super().__init__(self._folder_names)
+        self.folder = folder
+
+    def page(self, index):
+        return FilePage(os.path.join(self.folder, self.names[index]))
+
+    def _folder_names(self):
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if is_image_name(entry.name) and entry.is_file():
+                    yield entry.name
+
+
+class _MappedMember(io.RawIOBase):
+    """メモリマップ上の無圧縮メンバーを、アーカイブ全体を読まずに読むためのファイルオブジェクト。"""
+
+    def __init__(self, view, on_close):
+        self.view = view
+        self.pos = 0
+        self.on_close = on_close
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = max(0, min(len(buffer), len(self.view) - self.pos))
+        buffer[:size] = self.view[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.pos = max(0, offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        if not self.closed:
+            self.view.release()
+            self.on_close()
+        super().close()
+
+
+class ArchiveSource(_ScanningSource):
+    """
+    ZIP / CBZ 内の画像の一覧。start_scan() でセントラルディレクトリから目次を作る（中身は読まない）。
+    ページの読み出しはワーカースレッドから同時に行われてよい。
+    close() でアーカイブのファイルとメモリマップを閉じる（読み出し中のメンバーがあれば、最後の1つを閉じたときにマップを閉じる）。
+    """
+
+    def __init__(self, path):
+        super().__init__(self._archive_names)
+        self.path = path
+        self.infos = {}  # メンバー名 -> ZipInfo
+        self.stamp = None
+        self.zip = None
+        self.map = None
+        self.data_offsets = {}  # 無圧縮メンバー名 -> データの開始位置
+        self.open_members = 0  # メモリマップを参照している、開いたままのメンバーの数
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def page(self, index):
+        return ArchivePage(self, self.names[index])
+
+    def _archive_names(self):
+        stat = os.stat(self.path)
+        self.stamp = (stat.st_mtime_ns, stat.st_size)
+        archive = zipfile.ZipFile(self.path)
+        try:
+            with open(self.path, 'rb') as f:
+                archive_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except BaseException:
+            archive.close()
+            raise
+        with self.lock:
+            if self.closed:
+                # 目次を作る前に close() された
+                archive.close()
+                archive_map.close()
+                return iter(())
+            self.zip, self.map = archive, archive_map
+        infos = {}
+        for info in archive.infolist():
+            # フォルダや暗号化されたメンバーは表示しない
+            if info.is_dir() or info.flag_bits & 0x1 or not is_image_name(info.filename):
+                continue
+            infos[info.filename] = info
+        self.infos = infos
+        return iter(infos)
+
+    def _data_offset(self, info):
+        offset = self.data_offsets.get(info.filename)
+        if offset is None:
+            header = self.map[info.header_offset:info.header_offset + _LOCAL_HEADER.size]
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack(header)
+            if signature != _LOCAL_HEADER_SIGNATURE:
+                raise zipfile.BadZipFile(f"ローカルヘッダが壊れています: {info.filename}")
+            offset = info.header_offset + _LOCAL_HEADER.size + name_length + extra_length
+            self.data_offsets[info.filename] = offset
+        return offset
+
+    def open_member(self, member):
+        info = self.infos[member]
+        with self.lock:
+            if self.closed:
+                raise ValueError(f"アーカイブ '{self.path}' は閉じられています。")
+            if info.compress_type == zipfile.ZIP_STORED:
+                offset = self._data_offset(info)
+                view = memoryview(self.map)[offset:offset + info.file_size]
+                self.open_members += 1
+                return io.BufferedReader(_MappedMember(view, self._member_closed))
+            member_file = self.zip.open(info)
+        # 圧縮されたメンバーは展開が必要なため、1枚分だけメモリに読み出す（展開はロックの外で、ほかのページと並行に行う）
+        with member_file:
+            return io.BytesIO(member_file.read())
+
+    def close(self):
+        super().close()
+        with self.lock:
+            self.closed = True
+            if self.zip is not None:
+                self.zip.close()
+                self.zip = None
+            self._close_map_locked()
+
+    def _member_closed(self):
+        with self.lock:
+            self.open_members -= 1
+            self._close_map_locked()
+
+    def _close_map_locked(self):
+        # メンバーがマップを参照している間は閉じられない（BufferError）ため、最後のメンバーが閉じられるまで待つ
+        if self.closed and self.map is not None and not self.open_members:
+            self.map.close()
+            self.map = None
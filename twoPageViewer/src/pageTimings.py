@@ -0,0 +1,109 @@
+"""
+見開きビューアのページめくりの段階別の所要時間を、メモリ上のヒストグラムに記録する。
+段階はファイルを開く（ヘッダの読み込み）・デコード・RGB への変換・縮小・透かし・PhotoImage の作成・キャンバスの描き直しと、
+ページめくり全体（update_page から仕上がりの画像を表示するまで）。
+ヒストグラムは対数目盛りの固定の区間で数えるため、記録が増えてもメモリは増えない（パーセンタイルは区間の上限で近似する）。
+計測しないときは NO_TIMINGS を渡す（何もしない）。
+"""
+from contextlib import contextmanager, nullcontext
+import threading
+import math
+import time
+
+STAGES = ("open", "decode", "convert", "resize", "watermark", "photoimage", "canvas", "turn")
+# 最小の区間の上限（秒）と、2倍ごとの区間の数。区間数 BUCKETS で約 50 秒までを数え、それ以上は最後の区間に入れる
+BUCKET_BASE = 0.00005
+BUCKETS_PER_OCTAVE = 4
+BUCKETS = 80
+
+
+def bucket_of(seconds):
+    if seconds <= BUCKET_BASE:
+        return 0
+    return min(BUCKETS - 1, math.ceil(math.log2(seconds / BUCKET_BASE) * BUCKETS_PER_OCTAVE))
+
+
+def bucket_upper(index):
+    """区間 index の上限（秒）。"""
+    return BUCKET_BASE * 2 ** (index / BUCKETS_PER_OCTAVE)
+
+
+class StageTimings:
+    """段階ごとの所要時間のヒストグラム（スレッドセーフ。ワーカースレッドからも記録してよい）。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.totals = {}
+            self.maxima = {}
+
+    def record(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = [0] * BUCKETS
+                self.totals[stage] = 0.0
+                self.maxima[stage] = 0.0
+            histogram[bucket_of(seconds)] += 1
+            self.totals[stage] += seconds
+            self.maxima[stage] = max(self.maxima[stage], seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def percentile(self, stage, fraction):
+        """段階 stage の所要時間のパーセンタイル（秒、記録がなければ None）。"""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                return None
+            rank = max(1, math.ceil(fraction * sum(histogram)))
+            seen = 0
+            for index, count in enumerate(histogram):
+                seen += count
+                if seen >= rank:
+                    # 区間の上限が実測の最大値を超える場合は最大値を使う
+                    return min(bucket_upper(index), self.maxima[stage])
+        return None
+
+    def summary(self):
+        """{段階: {"count", "mean", "p50", "p95", "p99", "max"}}（時間は秒）。記録のない段階は含めない。"""
+        with self.lock:
+            stages = [stage for stage in STAGES if stage in self.histograms]
+            stages += sorted(stage for stage in self.histograms if stage not in STAGES)
+            counts = {stage: sum(self.histograms[stage]) for stage in stages}
+            totals = dict(self.totals)
+            maxima = dict(self.maxima)
+        return {stage: {"count": counts[stage], "mean": totals[stage] / counts[stage],
+                        "p50": self.percentile(stage, 0.5), "p95": self.percentile(stage, 0.95),
+                        "p99": self.percentile(stage, 0.99), "max": maxima[stage]}
+                for stage in stages}
+
+    def format_summary(self):
+        lines = [f"{'段階':<10} {'回数':>6} {'平均':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'最大':>9}"]
+        for stage, row in self.summary().items():
+            values = "".join(f" {row[key] * 1000:>7.1f}ms" for key in ("mean", "p50", "p95", "p99", "max"))
+            lines.append(f"{stage:<10} {row['count']:>6}{values}")
+        return "\n".join(lines)
+
+
+class _NoTimings:
+    """計測しないときの StageTimings の代わり。"""
+
+    def record(self, stage, seconds):
+        pass
+
+    def measure(self, stage):
+        return nullcontext()
+
+
+NO_TIMINGS = _NoTimings()
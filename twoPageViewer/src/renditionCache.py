@@ -0,0 +1,184 @@
+"""
+見開きビューアの縮小済みページ画像を、起動をまたいで再利用するためのディスクキャッシュ（SQLite 1ファイル）。
+ページの識別子と表示枠の大きさの区分（BUCKET_STEP 単位に切り上げ）をキーに、枠に収めた画像を JPEG で保存する。
+元ファイルの更新日時・サイズ（アーカイブならアーカイブの更新日時・サイズとメンバーの CRC）が
+保存時と違うエントリは使わずに削除する。合計サイズが上限を超えたら最も長く使われていないものから消す。
+"""
+import threading
+import sqlite3
+import time
+import io
+import os
+
+from PIL import Image
+
+# 既定の容量上限（バイト）
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+# 表示枠の幅・高さをこの単位で切り上げて区分する（ウィンドウの細かなサイズ違いでも同じエントリを使う）
+BUCKET_STEP = 64
+JPEG_QUALITY = 90
+# 上限を超えたときは、この割合まで減らす
+EVICT_TO = 0.9
+# 使用日時の更新はメモリにためておき、この件数か間隔（秒）ごとにまとめて書き込む
+TOUCH_BATCH = 64
+TOUCH_INTERVAL = 5.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS renditions (
+    page TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    stamp TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (page, bucket)
+);
+CREATE INDEX IF NOT EXISTS renditions_last_used ON renditions (last_used);
+"""
+
+
+def default_cache_dir():
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "UhiyamaLab", "twoPageViewer")
+
+
+def default_cache_path():
+    return os.path.join(default_cache_dir(), "renditions.sqlite3")
+
+
+def bucket_box(width, height):
+    """表示枠 width x height が属する区分の枠（BUCKET_STEP の倍数に切り上げ）。"""
+    return (-(-width // BUCKET_STEP) * BUCKET_STEP, -(-height // BUCKET_STEP) * BUCKET_STEP)
+
+
+class RenditionCache:
+    """
+    ページ（pageSource の FilePage / ArchivePage）ごとの縮小画像のディスクキャッシュ（スレッドセーフ）。
+    使用日時の更新はメモリにためて、TOUCH_BATCH 件・TOUCH_INTERVAL 秒ごとか、次の書き込み・close() のときにまとめてコミットする
+    （読み込みだけでは書き込みのトランザクションを開いたままにせず、同じファイルを使うほかのウィンドウを待たせない）。
+    データベースの誤り（ほかのプロセスがロック中など）は、読み込みではキャッシュになかったものとして扱う。
+    """
+
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.touched = {}  # (page, bucket) -> まだ書き込んでいない使用日時
+        self.last_touch_flush = time.monotonic()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM renditions").fetchone()[0]
+
+    @staticmethod
+    def _row_key(page, width, height):
+        return page.identity, "%dx%d" % bucket_box(width, height)
+
+    def get(self, page, width, height):
+        """表示枠 width x height の区分で保存された画像を返す。なければ（内容が変わっていれば）None。"""
+        page_id, bucket = self._row_key(page, width, height)
+        stamp = repr(page.stamp())
+        with self.lock:
+            try:
+                row = self.conn.execute("SELECT stamp, data FROM renditions WHERE page = ? AND bucket = ?",
+                                        (page_id, bucket)).fetchone()
+                if row is not None and row[0] != stamp:
+                    # 元画像が変わっていれば古いエントリは捨てる
+                    self._delete(page_id, bucket)
+                    self.conn.commit()
+                    row = None
+            except sqlite3.Error:
+                self._rollback()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.touched[(page_id, bucket)] = time.time()
+            if (len(self.touched) >= TOUCH_BATCH
+                    or time.monotonic() - self.last_touch_flush >= TOUCH_INTERVAL):
+                try:
+                    self._flush_touched()
+                    self.conn.commit()
+                except sqlite3.Error:
+                    # 使用日時は追い出しの順番にしか使わないため、書き込めなければ捨てる
+                    self._rollback()
+            self.hits += 1
+        image = Image.open(io.BytesIO(row[1]))
+        image.load()
+        return image
+
+    def put(self, page, width, height, image):
+        """bucket_box(width, height) に収めた画像 image を保存する。"""
+        page_id, bucket = self._row_key(page, width, height)
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=JPEG_QUALITY)
+        data = buffer.getvalue()
+        with self.lock:
+            total_bytes = self.total_bytes
+            try:
+                self._delete(page_id, bucket)
+                self.conn.execute("INSERT INTO renditions (page, bucket, stamp, data, size, last_used) "
+                                  "VALUES (?, ?, ?, ?, ?, ?)",
+                                  (page_id, bucket, repr(page.stamp()), data, len(data), time.time()))
+                self.total_bytes += len(data)
+                self._flush_touched()
+                self._evict()
+                self.conn.commit()
+            except sqlite3.Error:
+                # 書き込みのトランザクションを開いたままにしない
+                self._rollback()
+                self.total_bytes = total_bytes
+                raise
+
+    def _flush_touched(self):
+        self.conn.executemany("UPDATE renditions SET last_used = ? WHERE page = ? AND bucket = ?",
+                              [(last_used, page_id, bucket) for (page_id, bucket), last_used in self.touched.items()])
+        self.touched.clear()
+        self.last_touch_flush = time.monotonic()
+
+    def _rollback(self):
+        self.touched.clear()
+        self.last_touch_flush = time.monotonic()
+        try:
+            self.conn.rollback()
+        except sqlite3.Error:
+            pass
+
+    def _delete(self, page_id, bucket):
+        row = self.conn.execute("SELECT size FROM renditions WHERE page = ? AND bucket = ?",
+                                (page_id, bucket)).fetchone()
+        if row is not None:
+            self.conn.execute("DELETE FROM renditions WHERE page = ? AND bucket = ?", (page_id, bucket))
+            self.total_bytes -= row[0]
+
+    def _evict(self):
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO
+        victims = []
+        for page_id, bucket, size in self.conn.execute(
+                "SELECT page, bucket, size FROM renditions ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            victims.append((page_id, bucket))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM renditions WHERE page = ? AND bucket = ?", victims)
+
+    def stats_summary(self):
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0.0
+        return (f"ディスクキャッシュ: {self.total_bytes / 1024 ** 2:.0f}/{self.max_bytes / 1024 ** 2:.0f}MB"
+                f"  ヒット {self.hits} / ミス {self.misses} ({rate:.0f}%)")
+
+    def close(self):
+        with self.lock:
+            try:
+                self._flush_touched()
+                self.conn.commit()
+            except sqlite3.Error:
+                self._rollback()
+            self.conn.close()
@@ -0,0 +1,201 @@
+"""
+見開きビューアの下部に出すサムネイルの帯。
+キャンバス上には見えている範囲（と両隣）のサムネイルだけを作り、スクロールで外れたものは破棄する。
+サムネイルはワーカースレッドで縮小デコードして小さな LRU キャッシュに保持し、PhotoImage は表示中のものだけ持つ。
+そのため本のページ数が多くても、メモリと初期化の負担は画面に見えている枚数で決まる。
+"""
+from concurrent.futures import ThreadPoolExecutor
+import tkinter as tk
+from PIL import ImageTk
+import ttkbootstrap as ttk
+
+from pageCache import PageCache
+from pageRenderer import make_thumbnail
+
+THUMB_SIZE = 96
+THUMB_PAD = 4
+CELL_WIDTH = THUMB_SIZE + THUMB_PAD * 2
+# サムネイルの下にページ番号を入れる分の高さを足す
+STRIP_HEIGHT = THUMB_SIZE + THUMB_PAD * 2 + 14
+# サムネイルのキャッシュの容量上限（バイト）
+THUMB_CACHE_BYTES = 32 * 1024 ** 2
+THUMB_WORKERS = 2
+# 生成中のサムネイルの完了を確認する間隔（ミリ秒）
+THUMB_POLL_MS = 50
+# 見えている範囲の外に、あらかじめ用意しておくサムネイルの数（片側）
+OVERSCAN = 2
+
+CURRENT_OUTLINE = "#2780e3"
+OTHER_OUTLINE = "#cccccc"
+
+
+class ThumbnailStrip:
+    """
+    ページ一覧（pageSource）のサムネイルを横に並べた帯。クリックされると on_select(ページ番号) を呼ぶ。
+    右綴じでは1ページ目が右端に来るよう、並びを左右反転する。
+    """
+
+    def __init__(self, parent, on_select, right_to_left=True):
+        self.on_select = on_select
+        self.right_to_left = right_to_left
+        self.source = None
+        self.count = 0
+        self.current = ()
+
+        self.frame = ttk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, height=STRIP_HEIGHT, bg="white", highlightthickness=0)
+        self.scrollbar = ttk.Scrollbar(self.frame, orient=tk.HORIZONTAL, command=self.canvas.xview)
+        self.canvas.configure(xscrollcommand=self.on_view_changed)
+        self.canvas.pack(side=tk.TOP, fill=tk.X)
+        self.scrollbar.pack(side=tk.TOP, fill=tk.X)
+        self.canvas.bind("<Button-1>", self.on_click)
+        self.canvas.bind("<Configure>", lambda e: self.schedule_refresh())
+
+        self.cache = PageCache(THUMB_CACHE_BYTES)
+        self.executor = ThreadPoolExecutor(max_workers=THUMB_WORKERS, thread_name_prefix="thumbnail")
+        self.items = {}  # ページ番号 -> (ページ, キャンバス上のアイテムIDのリスト)
+        self.photos = {}  # ページ番号 -> 表示中の PhotoImage
+        self.pending = {}  # ページ -> 生成中のサムネイルの Future
+        self.refresh_id = None
+        self.poll_id = None
+
+    def set_source(self, source):
+        """ページ一覧を設定する（走査中に一覧が増えたときも呼ぶ）。"""
+        self.source = source
+        self.count = len(source)
+        self.canvas.configure(scrollregion=(0, 0, self.count * CELL_WIDTH, STRIP_HEIGHT))
+        # 走査中は一覧の途中に画像が差し込まれて番号がずれるため、表示中のものを作り直す
+        # （サムネイル自体はキャッシュと生成中の Future を使い回す）
+        self.clear_items()
+        self.schedule_refresh()
+
+    def set_direction(self, right_to_left):
+        self.right_to_left = right_to_left
+        self.clear_items()
+        self.schedule_refresh()
+
+    def set_current(self, indices):
+        """表示中の見開きのページ番号を強調し、帯の見える位置までスクロールする。"""
+        self.current = tuple(indices)
+        if not self.current or not self.count:
+            return
+        left = min(self.slot_of(index) for index in self.current) * CELL_WIDTH
+        right = (max(self.slot_of(index) for index in self.current) + 1) * CELL_WIDTH
+        view_left = self.canvas.canvasx(0)
+        view_width = self.canvas.winfo_width()
+        if left < view_left or right > view_left + view_width:
+            center = (left + right) / 2 - view_width / 2
+            self.canvas.xview_moveto(max(0.0, center / (self.count * CELL_WIDTH)))
+        for index, (_, ids) in self.items.items():
+            self.canvas.itemconfigure(ids[0], outline=self.outline(index))
+
+    def slot_of(self, index):
+        return self.count - 1 - index if self.right_to_left else index
+
+    def outline(self, index):
+        return CURRENT_OUTLINE if index in self.current else OTHER_OUTLINE
+
+    def on_view_changed(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if self.refresh_id is None:
+            self.refresh_id = self.canvas.after_idle(self.refresh)
+
+    def visible_range(self):
+        """見えている（と両隣 OVERSCAN 枚の）ページ番号の範囲。"""
+        view_left = self.canvas.canvasx(0)
+        first_slot = max(0, int(view_left // CELL_WIDTH) - OVERSCAN)
+        last_slot = min(self.count - 1, int((view_left + self.canvas.winfo_width()) // CELL_WIDTH) + OVERSCAN)
+        return {self.slot_of(slot) for slot in range(first_slot, last_slot + 1)}
+
+    def refresh(self):
+        self.refresh_id = None
+        if self.source is None:
+            return
+        visible = self.visible_range() if self.count else set()
+
+        # 見えなくなったサムネイルのアイテム・PhotoImage を捨てる
+        for index in [i for i in self.items if i not in visible]:
+            self.remove_item(index)
+
+        for index in sorted(visible):
+            if index in self.items:
+                continue
+            page = self.source.page(index)
+            self.create_item(index, page)
+            image = self.cache.peek(page)
+            if image is not None:
+                self.show_thumbnail(index, image)
+            elif page not in self.pending:
+                self.pending[page] = self.executor.submit(self.generate, page)
+
+        # 見えなくなったページのサムネイルは、まだ生成が始まっていなければ取り消す
+        visible_pages = {page for page, _ in self.items.values()}
+        for page in [p for p in self.pending if p not in visible_pages]:
+            self.pending.pop(page).cancel()
+        if self.pending and self.poll_id is None:
+            self.poll_id = self.canvas.after(THUMB_POLL_MS, self.poll_pending)
+
+    def generate(self, page):
+        image = make_thumbnail(page, THUMB_SIZE)
+        self.cache.put(page, image)
+        return image
+
+    def poll_pending(self):
+        self.poll_id = None
+        done = {page: future for page, future in self.pending.items() if future.done()}
+        for page in done:
+            del self.pending[page]
+        for index, (page, ids) in list(self.items.items()):
+            future = done.get(page)
+            if future is None or future.cancelled() or future.exception() is not None:
+                continue
+            if index not in self.photos:
+                self.show_thumbnail(index, future.result())
+        if self.pending:
+            self.poll_id = self.canvas.after(THUMB_POLL_MS, self.poll_pending)
+
+    def create_item(self, index, page):
+        x = self.slot_of(index) * CELL_WIDTH
+        rect = self.canvas.create_rectangle(x + THUMB_PAD, THUMB_PAD, x + CELL_WIDTH - THUMB_PAD,
+                                            THUMB_PAD + THUMB_SIZE, outline=self.outline(index), width=2)
+        label = self.canvas.create_text(x + CELL_WIDTH / 2, THUMB_PAD * 2 + THUMB_SIZE + 4,
+                                        text=str(index + 1), font=("Arial", 8), anchor="n")
+        self.items[index] = (page, [rect, label])
+
+    def show_thumbnail(self, index, image):
+        photo = ImageTk.PhotoImage(image)
+        x = self.slot_of(index) * CELL_WIDTH + CELL_WIDTH / 2
+        self.items[index][1].append(self.canvas.create_image(x, THUMB_PAD + THUMB_SIZE / 2, image=photo,
+                                                          anchor="center"))
+        self.photos[index] = photo
+
+    def remove_item(self, index):
+        for item in self.items.pop(index)[1]:
+            self.canvas.delete(item)
+        self.photos.pop(index, None)
+
+    def clear_items(self):
+        for index in list(self.items):
+            self.remove_item(index)
+
+    def on_click(self, event):
+        slot = int(self.canvas.canvasx(event.x) // CELL_WIDTH)
+        if 0 <= slot < self.count:
+            self.on_select(self.slot_of(slot))
+
+    def close(self):
+        # 予約したままの再描画と読み込み待ちの確認を止める（閉じた後にウィジェットへ触れないように）
+        if self.refresh_id is not None:
+            self.canvas.after_cancel(self.refresh_id)
+            self.refresh_id = None
+        if self.poll_id is not None:
+            self.canvas.after_cancel(self.poll_id)
+            self.poll_id = None
+        self.clear_items()
+        for future in self.pending.values():
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
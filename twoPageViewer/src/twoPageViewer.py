@@ -1,11 +1,23 @@
 import os
+import sys
 import math
+import time
+import argparse
+import sqlite3
 import tkinter as tk
 from tkinter import filedialog, messagebox
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import ImageTk
 import ttkbootstrap as ttk
 from ttkbootstrap.constants import *
 
+from pageCache import PageCache, DEFAULT_MAX_BYTES
+from pageRenderer import PageRenderer, quick_fit
+from pagePrefetch import PagePrefetcher, PREFETCH_AHEAD, PREFETCH_BEHIND
+from pageSource import open_source, is_archive, ARCHIVE_EXTS
+from pageTimings import StageTimings, NO_TIMINGS
+from renditionCache import RenditionCache, default_cache_path, DEFAULT_MAX_BYTES as DISK_CACHE_MAX_BYTES
+from thumbnailStrip import ThumbnailStrip
+
 try:
     from tkinterdnd2 import DND_FILES, TkinterDnD
     dnd_enabled = True
@@ -15,8 +27,21 @@ except ImportError:
 # バージョン情報
 __version__ = "1.0.0"
 
+# ワーカーでの描画の完了を確認する間隔（ミリ秒）
+RENDER_POLL_MS = 15
+# フォルダ走査の進み具合を確認する間隔（ミリ秒）
+SCAN_POLL_MS = 100
+# リサイズが止まってから仕上げの描画を始めるまでの待ち時間（ミリ秒）。
+# 直近の描画に掛かった時間の RESIZE_DELAY_FACTOR 倍を、この範囲に収めて使う
+RESIZE_DELAY_MIN_MS = 60
+RESIZE_DELAY_MAX_MS = 250
+RESIZE_DELAY_FACTOR = 2
+# 計測結果の表示を更新する間隔（ミリ秒）
+TIMINGS_OVERLAY_MS = 500
+
 class ImageViewerApp:
-    def __init__(self, root):
+    def __init__(self, root, cache_max_bytes=DEFAULT_MAX_BYTES, disk_cache_max_bytes=DISK_CACHE_MAX_BYTES,
+                 timings=False):
         self.root = root
         # タイトルにバージョン番号を表示
         self.root.title(f"TwoPage Viewer v{__version__}")
@@ -28,13 +53,41 @@ class ImageViewerApp:
         # 読み方向 (True: 右綴じ, False: 左綴じ)
         self.read_right_to_left = True
 
-        self.images = []
+        # 表示中のページ一覧（pageSource の FolderSource / ArchiveSource）
+        self.source = None
         self.current_page = 0
         self.total_pages = 0
+        # 表示中（描画待ちを含む）の見開きの (左, 右) のページ
+        self.shown_pages = None
+        # 表示中の見開きの (左, 右) の PIL 画像（リサイズ中の仮表示に使う）
+        self.shown_images = None
+
+        # デコード済み・縮小済みのページ画像キャッシュ（見開きを行き来してもデコードし直さない）
+        self.page_cache = PageCache(cache_max_bytes)
+        # 縮小済みのページ画像は起動をまたいでディスクにも残す（0MB なら使わない）
+        self.disk_cache = None
+        if disk_cache_max_bytes > 0:
+            try:
+                self.disk_cache = RenditionCache(default_cache_path(), disk_cache_max_bytes)
+            except (OSError, sqlite3.Error) as e:
+                print(f"ディスクキャッシュを開けません: {e}", file=sys.stderr)
+        # ページめくりの段階ごとの所要時間の計測（timings のときだけ。F2 で表示、終了時にも出力する）
+        self.timings = StageTimings() if timings else NO_TIMINGS
+        self.timings_label = None
+        self.renderer = PageRenderer(self.page_cache, self.disk_cache, self.timings)
+        # 表示中の見開きの前後をワーカーで先読みする
+        self.prefetcher = PagePrefetcher(self.renderer)
+        # 表示要求ごとに増える。古い要求の描画結果は表示しない
+        self.render_token = 0
+        self.last_window_size = None
+        # 表示中の見開きへの移動を始めた時刻と、直近のワーカーでの描画に掛かった時間（ミリ秒）
+        self.turn_started = None
+        self.last_render_ms = 0
 
         # リサイズ後の再描画デバウンス用ID
         self.resize_after_id = None
-        self.resize_delay = 500  # ミリ秒
+        # リサイズ中の仮表示用ID
+        self.rescale_after_id = None
 
         # メインフレーム
         self.main_frame = ttk.Frame(self.root, padding=20)
@@ -45,7 +98,7 @@ class ImageViewerApp:
         self.title_label.pack(pady=(0,20))
 
         # 説明ラベル
-        self.label = ttk.Label(self.main_frame, text="画像フォルダをここにドラッグ＆ドロップ\nまたは「フォルダを開く」で指定してください", 
+        self.label = ttk.Label(self.main_frame, text="画像フォルダまたは ZIP / CBZ ファイルをここにドラッグ＆ドロップ\nまたは「フォルダを開く」「アーカイブを開く」で指定してください", 
                                anchor=tk.CENTER, font=("Arial", 12))
         self.label.pack(pady=10)
 
@@ -53,6 +106,10 @@ class ImageViewerApp:
         self.select_btn = ttk.Button(self.main_frame, text="フォルダを開く", command=self.open_folder_dialog, bootstyle="outline-primary")
         self.select_btn.pack(pady=10)
 
+        # アーカイブ選択ボタン
+        self.select_archive_btn = ttk.Button(self.main_frame, text="アーカイブを開く", command=self.open_archive_dialog, bootstyle="outline-primary")
+        self.select_archive_btn.pack(pady=10)
+
         # D&Dサポート
         if dnd_enabled:
             self.root.drop_target_register(DND_FILES)
@@ -62,9 +119,11 @@ class ImageViewerApp:
         self.viewer_frame = None
         self.progress_bar = None
         self.page_label = None
+        self.thumbnails = None
 
         # リサイズイベントバインド
         self.root.bind("<Configure>", self.on_window_resize)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def open_folder_dialog(self):
         folder = filedialog.askdirectory()
@@ -74,28 +133,33 @@ class ImageViewerApp:
                 self.back_to_main()
             self.prepare_viewer(folder)
 
+    def open_archive_dialog(self):
+        patterns = " ".join(f"*{ext}" for ext in ARCHIVE_EXTS)
+        archive = filedialog.askopenfilename(filetypes=[("ZIP / CBZ", patterns), ("すべてのファイル", "*.*")])
+        if archive:
+            if self.viewer_frame:
+                self.back_to_main()
+            self.prepare_viewer(archive)
+
     def drop_folder(self, event):
         path = event.data.strip("{}")
-        if os.path.isdir(path):
+        if os.path.isdir(path) or is_archive(path):
             # もしすでに表示中なら戻る
             if self.viewer_frame:
                 self.back_to_main()
             self.prepare_viewer(path)
         else:
-            messagebox.showerror("エラー", "有効なフォルダをドロップしてください。")
+            messagebox.showerror("エラー", "有効なフォルダまたは ZIP / CBZ ファイルをドロップしてください。")
 
     def prepare_viewer(self, folder):
-        # 画像読み込み
-        exts = [".jpg", ".jpeg", ".png", ".gif", ".bmp"]
-        files = [f for f in os.listdir(folder) if os.path.splitext(f)[1].lower() in exts]
-        files.sort()
-        if not files:
-            messagebox.showerror("エラー", "このフォルダには画像がありません。")
-            return
-
-        self.images = [os.path.join(folder, f) for f in files]
-        self.total_pages = math.ceil(len(self.images)/2)
+        # 画像の一覧はバックグラウンドで走査（アーカイブなら目次を作成）し、見つかったものから表示する
+        if self.source is not None:
+            self.source.close()
+        self.source = open_source(folder)
+        self.source.start_scan()
+        self.total_pages = 0
         self.current_page = 0
+        self.shown_pages = None
 
         # メイン非表示
         self.main_frame.pack_forget()
@@ -129,12 +193,16 @@ class ImageViewerApp:
         self.watermark_check = ttk.Checkbutton(nav_frame, text="ファイル名表示", variable=self.watermark_var, command=self.update_page, bootstyle="round-toggle")
         self.watermark_check.pack(side=tk.LEFT, padx=5)
 
-        self.progress_bar = ttk.Progressbar(nav_frame, mode='determinate', maximum=self.total_pages, bootstyle="info-striped")
+        self.progress_bar = ttk.Progressbar(nav_frame, mode='determinate', maximum=1, bootstyle="info-striped")
         self.progress_bar.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(10,5))
 
         self.page_label = ttk.Label(nav_frame, text="", font=("Arial", 10))
         self.page_label.pack(side=tk.LEFT, padx=5)
 
+        # サムネイルの帯（クリックしたページの見開きへ移動）
+        self.thumbnails = ThumbnailStrip(self.viewer_frame, self.jump_to_index, self.read_right_to_left)
+        self.thumbnails.frame.pack(side=tk.BOTTOM, fill=tk.X, pady=(5,0))
+
         # 画像表示領域
         self.image_frame = ttk.Frame(self.viewer_frame)
         self.image_frame.pack(fill=tk.BOTH, expand=True)
@@ -155,7 +223,33 @@ class ImageViewerApp:
 
         self.bind_keys()  # キーバインド
 
-        self.update_page()
+        self.poll_scan(None)
+
+    def poll_scan(self, version):
+        source = self.source
+        if source is None or not self.viewer_frame:
+            return
+        if source.version != version:
+            version = source.version
+            self.total_pages = math.ceil(len(source)/2)
+            self.progress_bar.configure(maximum=max(1, self.total_pages))
+            self.thumbnails.set_source(source)
+            # 走査中に表示中の見開きより前に並ぶ画像が見つかった場合は描き直す
+            if len(source) and self.spread_pages(self.current_page) != self.shown_pages:
+                self.update_page()
+            else:
+                self.update_page_label()
+        if source.scanning:
+            self.root.after(SCAN_POLL_MS, self.poll_scan, version)
+            return
+
+        self.update_page_label()
+        if source.error is not None:
+            messagebox.showerror("エラー", f"画像の一覧を読み込めませんでした。\n{source.error}")
+            self.back_to_main()
+        elif not len(source):
+            messagebox.showerror("エラー", "このフォルダ（アーカイブ）には画像がありません。")
+            self.back_to_main()
 
     def bind_keys(self):
         self.root.unbind("<MouseWheel>")
@@ -175,32 +269,54 @@ class ImageViewerApp:
             self.root.bind("<Left>", lambda e: self.prev_page())
             self.root.bind("<Right>", lambda e: self.next_page())
 
+        if self.timings is not NO_TIMINGS:
+            self.root.bind("<F2>", lambda e: self.toggle_timings_overlay())
+
     def toggle_direction(self):
         self.read_right_to_left = self.dir_var.get()
         self.dir_check.configure(text="右綴じ" if self.read_right_to_left else "左綴じ")
         self.bind_keys()
+        self.thumbnails.set_direction(self.read_right_to_left)
         self.update_page()
 
+    def toggle_timings_overlay(self):
+        """段階ごとの所要時間を画像の上に重ねて表示する（もう一度押すと消す）。"""
+        if self.timings_label is not None:
+            self.timings_label.destroy()
+            self.timings_label = None
+            return
+        if not self.viewer_frame:
+            return
+        self.timings_label = tk.Label(self.image_frame, justify=tk.LEFT, anchor="nw", font=("Courier", 9),
+                                      bg="black", fg="white")
+        self.timings_label.place(x=10, y=10)
+        self.update_timings_overlay()
+
+    def update_timings_overlay(self):
+        if self.timings_label is None or not self.timings_label.winfo_exists():
+            self.timings_label = None
+            return
+        self.timings_label.configure(text=self.timings.format_summary())
+        self.root.after(TIMINGS_OVERLAY_MS, self.update_timings_overlay)
+
     def on_mouse_wheel(self, event):
         if event.num == 4 or (hasattr(event, 'delta') and event.delta > 0):
             self.prev_page()
         elif event.num == 5 or (hasattr(event, 'delta') and event.delta < 0):
             self.next_page()
 
-    def update_page(self):
-        if not self.images:
-            return
-
-        idx_left = self.current_page * 2
-        idx_right = idx_left + 1
-
+    def spread_pages(self, page):
+        """見開き page の (左ページ, 右ページ)。ページがない側は None。"""
+        idx_first = page * 2
+        count = len(self.source)
+        first = self.source.page(idx_first) if idx_first < count else None
+        second = self.source.page(idx_first + 1) if idx_first + 1 < count else None
         if self.read_right_to_left:
-            right_img_path = self.images[idx_left] if idx_left < len(self.images) else None
-            left_img_path = self.images[idx_right] if idx_right < len(self.images) else None
-        else:
-            left_img_path = self.images[idx_left] if idx_left < len(self.images) else None
-            right_img_path = self.images[idx_right] if idx_right < len(self.images) else None
+            return second, first
+        return first, second
 
+    def canvas_boxes(self):
+        """左右のキャンバスの ((幅, 高さ), (幅, 高さ))。"""
         self.left_canvas.update_idletasks()
         self.right_canvas.update_idletasks()
 
@@ -213,47 +329,112 @@ class ImageViewerApp:
         if left_h < 1: left_h = 600
         if right_w < 1: right_w = 400
         if right_h < 1: right_h = 600
+        return (left_w, left_h), (right_w, right_h)
+
+    def spread_requests(self, page, boxes, watermark):
+        """見開き page の左右ページの描画要求 (ページ, 幅, 高さ, 透かし)。ページがない側は None。"""
+        return [(item, width, height, watermark) if item is not None else None
+                for item, (width, height) in zip(self.spread_pages(page), boxes)]
+
+    def prefetch_requests(self, boxes, watermark):
+        """先読みする見開き（先の PREFETCH_AHEAD 件、手前の PREFETCH_BEHIND 件）の描画要求。"""
+        pages = [self.current_page + i for i in range(1, PREFETCH_AHEAD + 1)]
+        pages += [self.current_page - i for i in range(1, PREFETCH_BEHIND + 1)]
+        requests = []
+        for page in pages:
+            if 0 <= page < self.total_pages:
+                requests += [r for r in self.spread_requests(page, boxes, watermark) if r is not None]
+        return requests
+
+    def update_page_label(self):
+        self.progress_bar['value'] = self.current_page + 1
+        text = f"{self.current_page + 1}/{self.total_pages}"
+        if self.source.scanning:
+            text += " (読み込み中)"
+        self.page_label.configure(text=text)
+
+    def update_page(self, preview=True):
+        """
+        表示中の見開きを描画する。preview なら未描画のページは粗い下描きを先に出す
+        （リサイズの仕上げでは仮表示が出ているため下描きは省く）。
+        """
+        if not self.source:
+            return
 
-        def load_and_resize(pth, width, height):
-            if pth is None:
-                return None
-            img = Image.open(pth).convert("RGB")
-            img_ratio = img.width / img.height
-            frame_ratio = width / height
-            if img_ratio > frame_ratio:
-                new_width = width
-                new_height = int(new_width / img_ratio)
-            else:
-                new_height = height
-                new_width = int(new_height * img_ratio)
-            img = img.resize((new_width, new_height), Image.LANCZOS)
-
-            if self.watermark_var.get() and pth is not None:
-                draw = ImageDraw.Draw(img)
-                filename = os.path.basename(pth)
-                font = ImageFont.load_default()
-                text_color = (128, 128, 128)
-                margin = 10
-                draw.text((margin, margin), filename, font=font, fill=text_color)
-
-            return ImageTk.PhotoImage(img)
-
-        left_img_obj = load_and_resize(left_img_path, left_w, left_h)
-        right_img_obj = load_and_resize(right_img_path, right_w, right_h)
-
-        self.left_canvas.delete("all")
-        self.right_canvas.delete("all")
-
-        if left_img_obj:
-            self.left_canvas.create_image(left_w/2, left_h/2, image=left_img_obj, anchor="center")
-        if right_img_obj:
-            self.right_canvas.create_image(right_w/2, right_h/2, image=right_img_obj, anchor="center")
-
-        self.left_canvas.image = left_img_obj
-        self.right_canvas.image = right_img_obj
+        self.turn_started = time.perf_counter()
+        self.update_page_label()
+        self.shown_pages = self.spread_pages(self.current_page)
+        self.thumbnails.set_current(i for i in (self.current_page * 2, self.current_page * 2 + 1)
+                                    if i < len(self.source))
+
+        boxes = self.canvas_boxes()
+        watermark = self.watermark_var.get()
+        current = self.spread_requests(self.current_page, boxes, watermark)
+        upcoming = self.prefetch_requests(boxes, watermark)
+
+        # 先読み済みならその場で表示し、なければワーカーでの描画を待つ
+        self.render_token += 1
+        images = [self.renderer.cached(*r) if r is not None else None for r in current]
+        missing = [r for r, img in zip(current, images) if r is not None and img is None]
+        # 未描画のページは、まず粗い下描きを出してから LANCZOS の結果に差し替える
+        futures, preview_futures = self.prefetcher.schedule(missing, upcoming,
+                                                            previews=missing if preview else ())
+        if not missing:
+            self.show_spread(current, images)
+            self.timings.record("turn", time.perf_counter() - self.turn_started)
+            return
+        self.poll_render(self.render_token, current, images,
+                         dict(zip(missing, futures)), dict(zip(missing, preview_futures)))
 
-        self.progress_bar['value'] = self.current_page + 1
-        self.page_label.configure(text=f"{self.current_page + 1}/{self.total_pages}")
+    def poll_render(self, token, current, images, pending, previews):
+        # 待っている間に別の見開きへ移動していれば、この結果は使わない
+        if token != self.render_token or not self.viewer_frame:
+            return
+        if all(future.done() for future in pending.values()):
+            images = [pending[r].result() if r in pending else img for r, img in zip(current, images)]
+            self.show_spread(current, images)
+            elapsed = time.perf_counter() - self.turn_started
+            self.timings.record("turn", elapsed)
+            self.last_render_ms = elapsed * 1000
+            return
+        if previews and all(future.done() for future in previews.values()):
+            # 下描きは1度だけ出す（仕上がったページがあればそちらを使い、下描きのないページは今の表示のままにする）
+            shown = self.shown_images or (None, None)
+            self.show_spread(current, [
+                self.finished_or_preview(pending.get(r), previews.get(r), img, previous)
+                for r, img, previous in zip(current, images, shown)
+            ])
+            previews = {}
+        self.root.after(RENDER_POLL_MS, self.poll_render, token, current, images, pending, previews)
+
+    @staticmethod
+    def finished_or_preview(future, preview, image, previous):
+        if future is None:
+            return image
+        if future.done():
+            return future.result()
+        draft = preview.result() if preview is not None else None
+        # JPEG 以外のページには下描きがない（None）ため、仕上がるまで前の画像を残す
+        return draft if draft is not None else previous
+
+    def show_spread(self, current, images):
+        self.shown_images = images
+        self.draw_images([(r[1], r[2]) if r is not None else None for r in current], images)
+
+    def draw_images(self, boxes, images):
+        # PhotoImage は Tk のスレッドでだけ作る
+        for canvas, box, img in zip((self.left_canvas, self.right_canvas), boxes, images):
+            with self.timings.measure("photoimage"):
+                img_obj = ImageTk.PhotoImage(img) if img is not None else None
+            with self.timings.measure("canvas"):
+                canvas.delete("all")
+                if img_obj:
+                    width, height = box
+                    canvas.create_image(width/2, height/2, image=img_obj, anchor="center")
+                canvas.image = img_obj
+                # 描き直しの時間まで計るため、ここで画面に反映させる
+                if self.timings is not NO_TIMINGS:
+                    canvas.update_idletasks()
 
     def next_page(self):
         if self.current_page < self.total_pages - 1:
@@ -269,36 +450,104 @@ class ImageViewerApp:
         self.current_page = 0
         self.update_page()
 
+    def jump_to_index(self, index):
+        """画像 index（0始まり）を含む見開きへ移動する。"""
+        self.current_page = index // 2
+        self.update_page()
+
     def back_to_main(self):
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+            self.thumbnails = None
         if self.viewer_frame:
             self.viewer_frame.pack_forget()
             self.viewer_frame.destroy()
             self.viewer_frame = None
 
-        self.images = []
+        if self.source is not None:
+            self.source.close()
+        self.source = None
         self.current_page = 0
         self.total_pages = 0
+        self.shown_pages = None
+        self.shown_images = None
+        self.render_token += 1
+        self.prefetcher.cancel()
+        self.page_cache.clear()
 
         self.root.unbind("<MouseWheel>")
         self.root.unbind("<Button-4>")
         self.root.unbind("<Button-5>")
         self.root.unbind("<Left>")
         self.root.unbind("<Right>")
+        self.root.unbind("<F2>")
+        self.timings_label = None
 
         self.main_frame.pack(fill=tk.BOTH, expand=True)
 
     def on_window_resize(self, event):
+        # 子ウィジェットの Configure や、大きさの変わらない移動は無視する
+        if event.widget is not self.root or (event.width, event.height) == self.last_window_size:
+            return
+        self.last_window_size = (event.width, event.height)
+
         if self.resize_after_id is not None:
             self.root.after_cancel(self.resize_after_id)
-        
-        if self.viewer_frame and self.images:
-            self.resize_after_id = self.root.after(self.resize_delay, self.update_page)
+
+        if self.viewer_frame and self.source:
+            # 古い大きさでの先読み・描画は無駄になるので止めておく
+            self.prefetcher.cancel()
+            self.render_token += 1
+            # ドラッグ中は表示中の画像を拡大縮小しただけの仮表示を出し、止まったら1度だけ LANCZOS で描き直す
+            if self.rescale_after_id is None:
+                self.rescale_after_id = self.root.after_idle(self.show_rescaled)
+            self.resize_after_id = self.root.after(self.resize_delay(), self.finish_resize)
+
+    def resize_delay(self):
+        """仕上げの描画が重いほど、リサイズが止まったと判断するまで長めに待つ。"""
+        delay = int(self.last_render_ms * RESIZE_DELAY_FACTOR)
+        return min(RESIZE_DELAY_MAX_MS, max(RESIZE_DELAY_MIN_MS, delay))
+
+    def show_rescaled(self):
+        self.rescale_after_id = None
+        if not self.viewer_frame or self.shown_images is None:
+            return
+        boxes = self.canvas_boxes()
+        self.draw_images(boxes, [quick_fit(img, *box) if img is not None else None
+                                 for img, box in zip(self.shown_images, boxes)])
+
+    def finish_resize(self):
+        self.resize_after_id = None
+        # 元画像はキャッシュにあるため、デコードし直さずに新しい大きさへ縮小する
+        self.update_page(preview=False)
+
+    def on_close(self):
+        if self.thumbnails is not None:
+            self.thumbnails.close()
+        self.prefetcher.shutdown()
+        if self.source is not None:
+            self.source.close()
+        if self.disk_cache is not None:
+            self.disk_cache.close()
+        if self.timings is not NO_TIMINGS:
+            print(self.timings.format_summary(), file=sys.stderr)
+        self.root.destroy()
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TwoPage Viewer")
+    parser.add_argument("--cache-mb", type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="ページ画像キャッシュの容量上限（MB）")
+    parser.add_argument("--disk-cache-mb", type=int, default=DISK_CACHE_MAX_BYTES // 1024 ** 2,
+                        help="縮小済み画像のディスクキャッシュの容量上限（MB、0で使わない）")
+    parser.add_argument("--timings", action="store_true",
+                        help="ページめくりの段階ごとの所要時間を計測する（F2 で表示、終了時に出力）")
+    args = parser.parse_args()
+
     if dnd_enabled:
         root = TkinterDnD.Tk()
     else:
         root = tk.Tk()
-    app = ImageViewerApp(root)
+    app = ImageViewerApp(root, cache_max_bytes=args.cache_mb * 1024 ** 2,
+                         disk_cache_max_bytes=args.disk_cache_mb * 1024 ** 2, timings=args.timings)
     root.mainloop()
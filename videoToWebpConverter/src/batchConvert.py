@@ -0,0 +1,155 @@
+"""
+ディスプレイなしで動画・GIF を一括で WebP に変換するコマンドラインツール。
+指定したファイル・フォルダ（サブフォルダを含む）を走査し、見つけたファイルから順に
+並列ワーカーへ流し込む。ファイルごとの結果は JSONL（1行1レコード）で標準出力に書き出す。
+
+例:
+    python batchConvert.py ./clips --fps 10 --width 640 --quality 75 > results.jsonl
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+
+from mediaProbe import ProbeCache, default_probe_cache_path, default_encode_cache_dir
+from encodeCache import EncodeCache, DEFAULT_MAX_BYTES
+from jobMetrics import MetricsLog, default_metrics_path
+from targetSize import parse_size
+from converterEngine import (
+    ConversionJob, JobScheduler, default_worker_count, is_supported,
+    validate_settings, STATUS_DONE,
+)
+
+
+def iter_input_files(paths, recursive=True):
+    """入力パスから対応形式のファイルを見つけた順に返す（一覧を作り切らずに流す）。"""
+    for path in paths:
+        if os.path.isfile(path):
+            if is_supported(path):
+                yield path
+            continue
+        if not recursive:
+            with os.scandir(path) as entries:
+                for entry in sorted(entries, key=lambda e: e.name):
+                    if entry.is_file() and is_supported(entry.name):
+                        yield entry.path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if is_supported(name):
+                    yield os.path.join(dirpath, name)
+
+
+def mirrored_output_dir(filepath, roots, output_root):
+    """--output-dir 指定時、入力フォルダ構成を出力先に再現したディレクトリを返す。"""
+    if output_root is None:
+        return None
+    for root in roots:
+        if os.path.isdir(root):
+            rel = os.path.relpath(os.path.dirname(filepath), root)
+            if not rel.startswith(os.pardir):
+                return os.path.normpath(os.path.join(output_root, rel))
+    return output_root
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="動画・GIF を WebP に一括変換します。")
+    parser.add_argument("inputs", nargs="+", help="変換するファイルまたはフォルダ")
+    parser.add_argument("--fps", default="10", help="フレームレート (デフォルト: 10)")
+    parser.add_argument("--width", default="640", help="幅（ピクセル） (デフォルト: 640)")
+    parser.add_argument("--quality", default="75", help="品質 0-100 (デフォルト: 75)")
+    parser.add_argument("--target-size", default=None,
+                        help="目標ファイルサイズ（例: 500K, 2M）。指定すると --quality の代わりに自動で品質を決める")
+    parser.add_argument("--dedup", type=float, default=0.0,
+                        help="ほぼ同一の連続フレームを間引くしきい値の倍率 (0=無効, 1=標準, 大きいほど積極的)")
+    parser.add_argument("--workers", type=int, default=default_worker_count(),
+                        help="同時変換数 (デフォルト: CPUコア数の半分)")
+    parser.add_argument("--segments", type=int, default=1,
+                        help="長い動画を最大この数の区間に分けて並列にエンコードする (デフォルト: 1=分割しない)")
+    parser.add_argument("--output-dir", default=None,
+                        help="出力先フォルダ（未指定なら入力ファイルと同じフォルダ）")
+    parser.add_argument("--no-recursive", action="store_true", help="サブフォルダを走査しない")
+    parser.add_argument("--probe-cache", default=default_probe_cache_path(),
+                        help="ffprobe結果のキャッシュファイル（空文字でキャッシュしない）")
+    parser.add_argument("--encode-cache", default=default_encode_cache_dir(),
+                        help="変換結果キャッシュのフォルダ（空文字でキャッシュしない）")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="変換結果キャッシュの容量上限（MB）")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="終了時に変換結果キャッシュの統計を標準エラーに表示する")
+    parser.add_argument("--metrics", default=default_metrics_path(),
+                        help="ジョブごとの計測値を追記するファイル（空文字で記録しない）")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="同名の .webp がすでにある入力はスキップする")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        fps, width, quality = validate_settings(args.fps, args.width, args.quality)
+        if args.workers < 1 or args.segments < 1:
+            raise ValueError("--workers, --segments は1以上で指定してください")
+        if args.dedup < 0:
+            raise ValueError("--dedup は0以上で指定してください")
+        target_bytes = parse_size(args.target_size) if args.target_size else None
+    except ValueError as e:
+        print(f"入力エラー: {e}", file=sys.stderr)
+        return 2
+
+    output_lock = threading.Lock()
+    failures = []
+    # 待機中のジョブを抱えすぎないよう、投入数に上限を設ける
+    in_flight = threading.BoundedSemaphore(args.workers * 4)
+
+    def write_record(record):
+        with output_lock:
+            sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    def on_finished(job):
+        record = job.to_record()
+        if job.status != STATUS_DONE:
+            failures.append(job.filepath)
+        write_record(record)
+        in_flight.release()
+
+    encode_cache = None
+    if args.encode_cache:
+        encode_cache = EncodeCache(args.encode_cache, args.cache_max_mb * 1024 ** 2)
+    metrics_log = MetricsLog(args.metrics) if args.metrics else None
+    scheduler = JobScheduler(args.workers, on_finished=on_finished, keep_finished=False,
+                             probe_cache=ProbeCache(args.probe_cache or None),
+                             encode_cache=encode_cache, metrics_log=metrics_log)
+    try:
+        for filepath in iter_input_files(args.inputs, recursive=not args.no_recursive):
+            output_dir = mirrored_output_dir(filepath, args.inputs, args.output_dir)
+            if args.skip_existing:
+                base = os.path.splitext(os.path.basename(filepath))[0]
+                existing = os.path.join(output_dir or os.path.dirname(filepath), base + ".webp")
+                if os.path.exists(existing):
+                    write_record({"input": filepath, "output": existing, "status": "skipped"})
+                    continue
+            in_flight.acquire()
+            scheduler.prefetch_probes([filepath])
+            scheduler.submit(ConversionJob(filepath, fps, width, quality, output_dir,
+                                           segments=args.segments, target_bytes=target_bytes,
+                                           dedup=args.dedup))
+        scheduler.shutdown(wait=True)
+    except KeyboardInterrupt:
+        print("中断しました。実行中の変換をキャンセルします。", file=sys.stderr)
+        scheduler.shutdown()
+        return 130
+    finally:
+        if metrics_log is not None:
+            metrics_log.close()
+
+    if args.cache_stats and encode_cache is not None:
+        print(encode_cache.stats_summary(), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
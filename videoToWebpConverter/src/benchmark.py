@@ -0,0 +1,214 @@
+"""
+変換処理のベンチマーク。
+ffmpeg の lavfi テストソースから再現性のある合成動画（MP4 / MOV / MKV / GIF、複数の解像度・長さ）を
+作業フォルダに生成し、fps・幅・品質の組み合わせごとに converterEngine と同じコマンドで変換して
+所要時間・エンコード fps・出力サイズ・子プロセスのピークRSS を JSON / CSV に書き出す。
+--baseline で以前の結果を渡すと、しきい値を超えて遅く（大きく）なったケースを検出する。
+
+例:
+    python benchmark.py --out bench.json --csv bench.csv
+    python benchmark.py --out new.json --baseline bench.json --threshold 0.10
+"""
+import argparse
+import itertools
+import platform
+import statistics
+import subprocess
+import json
+import time
+import csv
+import sys
+import os
+
+from converterEngine import FfmpegRun, build_ffmpeg_command, FFMPEG_ENCODING
+from processMonitor import ProcessMonitor
+
+# 合成入力の既定セット: (形式, 幅, 高さ, 秒数)
+DEFAULT_INPUTS = [
+    ("mp4", 640, 360, 5),
+    ("mp4", 1920, 1080, 10),
+    ("mov", 1280, 720, 5),
+    ("mkv", 1280, 720, 10),
+    ("gif", 480, 270, 5),
+]
+DEFAULT_FPS = [10, 20]
+DEFAULT_WIDTHS = [320, 640]
+DEFAULT_QUALITIES = [50, 75, 90]
+
+# 比較する指標と、値が大きいほど悪いかどうか
+REGRESSION_METRICS = {"wall_time": True, "encode_fps": False, "output_bytes": True}
+
+_CODEC_ARGS = {
+    "mp4": ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'medium'],
+    "mov": ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'medium'],
+    "mkv": ['-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-preset', 'medium'],
+}
+
+
+def synthetic_input_path(work_dir, fmt, width, height, seconds):
+    return os.path.join(work_dir, f"testsrc_{width}x{height}_{seconds}s.{fmt}")
+
+
+def generate_input(path, fmt, width, height, seconds):
+    """lavfi の testsrc2 から合成動画を作る。ビット単位で同じ結果になるよう bitexact を指定する。"""
+    rate = 10 if fmt == "gif" else 30
+    source = f"testsrc2=size={width}x{height}:rate={rate}:duration={seconds}"
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'lavfi', '-i', source,
+           '-fflags', '+bitexact', '-flags:v', '+bitexact', '-map_metadata', '-1']
+    if fmt == "gif":
+        cmd += ['-vf', 'split[a][b];[a]palettegen[p];[b][p]paletteuse']
+    else:
+        cmd += _CODEC_ARGS[fmt] + ['-threads', '1']
+    cmd.append(path)
+    subprocess.run(cmd, check=True, stdin=subprocess.DEVNULL)
+
+
+def prepare_inputs(work_dir, inputs):
+    """合成入力を用意する（既にあれば作り直さない）。"""
+    os.makedirs(work_dir, exist_ok=True)
+    paths = []
+    for fmt, width, height, seconds in inputs:
+        path = synthetic_input_path(work_dir, fmt, width, height, seconds)
+        if not os.path.exists(path):
+            print(f"入力を生成中: {os.path.basename(path)}", file=sys.stderr)
+            generate_input(path, fmt, width, height, seconds)
+        paths.append(path)
+    return paths
+
+
+def run_case(input_path, output_path, fps, width, quality, threads):
+    """1ケースを変換して計測値を返す。"""
+    cmd = build_ffmpeg_command(input_path, output_path, fps, width, quality, threads)
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    started = time.perf_counter()
+    run = FfmpegRun(cmd)
+    monitor = ProcessMonitor(run.process)
+    returncode = run.wait()
+    wall_time = time.perf_counter() - started
+    monitor.stop()
+    if returncode != 0:
+        raise RuntimeError(f"変換に失敗しました: {os.path.basename(input_path)}\n{''.join(run.stderr_tail)}")
+    frames = run.progress.frame
+    return {
+        "wall_time": wall_time,
+        "frames": frames,
+        "encode_fps": frames / wall_time if wall_time > 0 else None,
+        "output_bytes": os.path.getsize(output_path),
+        "peak_rss": monitor.peak_rss,
+        "cpu_time": monitor.cpu_time,
+    }
+
+
+def case_key(case):
+    return f"{case['input']}|fps={case['fps']}|width={case['width']}|quality={case['quality']}"
+
+
+def run_benchmark(input_paths, fps_list, widths, qualities, repeat, threads, work_dir):
+    cases = []
+    output_path = os.path.join(work_dir, "bench_output.webp")
+    for input_path, fps, width, quality in itertools.product(input_paths, fps_list, widths, qualities):
+        runs = [run_case(input_path, output_path, fps, width, quality, threads) for _ in range(repeat)]
+        # 繰り返した中で所要時間が中央値の回を代表値にする
+        runs.sort(key=lambda r: r["wall_time"])
+        result = dict(runs[len(runs) // 2])
+        result["wall_time_min"] = runs[0]["wall_time"]
+        result["wall_time_stdev"] = statistics.pstdev(r["wall_time"] for r in runs)
+        case = {"input": os.path.basename(input_path), "fps": fps, "width": width,
+                "quality": quality, **result}
+        cases.append(case)
+        print(f"{case_key(case)}: {case['wall_time']:.2f}s, {case['output_bytes']} bytes", file=sys.stderr)
+    return cases
+
+
+def ffmpeg_version():
+    try:
+        result = subprocess.run(['ffmpeg', '-version'], stdout=subprocess.PIPE, text=True,
+                                encoding=FFMPEG_ENCODING, errors='replace')
+        return result.stdout.splitlines()[0]
+    except (OSError, IndexError):
+        return None
+
+
+def find_regressions(cases, baseline_cases, threshold):
+    """基準の結果と比べて threshold（割合）を超えて悪化したケースを返す。"""
+    baseline = {case_key(case): case for case in baseline_cases}
+    regressions = []
+    for case in cases:
+        base = baseline.get(case_key(case))
+        if base is None:
+            continue
+        for metric, higher_is_worse in REGRESSION_METRICS.items():
+            old, new = base.get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (change if higher_is_worse else -change) > threshold:
+                regressions.append({"case": case_key(case), "metric": metric,
+                                    "baseline": old, "current": new, "change": round(change, 4)})
+    return regressions
+
+
+def write_csv(path, cases):
+    fields = ["input", "fps", "width", "quality", "wall_time", "wall_time_min", "wall_time_stdev",
+              "frames", "encode_fps", "output_bytes", "peak_rss", "cpu_time"]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(cases)
+
+
+def parse_list(text):
+    return [int(value) for value in text.split(",") if value]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="動画→WebP 変換のベンチマークを実行します。")
+    parser.add_argument("--work-dir", default="bench_work", help="合成入力と一時出力を置くフォルダ")
+    parser.add_argument("--fps", default=",".join(map(str, DEFAULT_FPS)), help="fps の候補（カンマ区切り）")
+    parser.add_argument("--widths", default=",".join(map(str, DEFAULT_WIDTHS)), help="幅の候補（カンマ区切り）")
+    parser.add_argument("--qualities", default=",".join(map(str, DEFAULT_QUALITIES)), help="品質の候補（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=3, help="各ケースの繰り返し回数（中央値を採用）")
+    parser.add_argument("--threads", type=int, default=1, help="ffmpeg の -threads")
+    parser.add_argument("--out", default="bench.json", help="結果の JSON ファイル")
+    parser.add_argument("--csv", default=None, help="結果の CSV ファイル")
+    parser.add_argument("--baseline", default=None, help="比較する以前の結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=0.10, help="悪化とみなす変化の割合")
+    args = parser.parse_args(argv)
+
+    input_paths = prepare_inputs(args.work_dir, DEFAULT_INPUTS)
+    cases = run_benchmark(input_paths, parse_list(args.fps), parse_list(args.widths),
+                          parse_list(args.qualities), max(1, args.repeat), args.threads, args.work_dir)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "ffmpeg": ffmpeg_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": args.threads,
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(cases, baseline.get("cases", []), args.threshold)
+        report["baseline"] = args.baseline
+        report["threshold"] = args.threshold
+        report["regressions"] = regressions
+
+    with open(args.out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.csv:
+        write_csv(args.csv, cases)
+
+    for regression in regressions:
+        print(f"悪化: {regression['case']} {regression['metric']} "
+              f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})",
+              file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,704 @@
+"""
+動画・GIF を WebP に変換する処理のうち、GUI に依存しない部分。
+GUI（videoToWebpConverter.py）とバッチ CLI（batchConvert.py）の両方から利用する。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import subprocess
+import threading
+import itertools
+import tempfile
+import shutil
+import time
+import sys
+import os
+import shlex
+
+from mediaProbe import ProbeCache
+from processMonitor import ProcessMonitor
+from segmentEncoder import plan_segments, merge_animated_webp
+from targetSize import SizeModel, SAMPLE_QUALITIES, sample_windows, candidate_widths
+
+SUPPORTED_EXTS = ('.mp4', '.mov', '.avi', '.mkv', '.gif')
+
+# ffmpeg / ffprobe の出力エンコーディング（Windowsのデフォルト）
+FFMPEG_ENCODING = 'cp932'
+
+# ジョブの状態
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_ERROR = "error"
+STATUS_CANCELLED = "cancelled"
+
+FINISHED_STATUSES = (STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED)
+
+# 機械可読な進捗を標準出力へ出させ、人間向けの統計行は止める
+PROGRESS_ARGS = ['-hide_banner', '-nostats', '-progress', 'pipe:1']
+# エラー報告用に保持する標準エラー出力の末尾行数
+STDERR_TAIL_LINES = 60
+# 重複フレーム除去（mpdecimate）の標準パラメータ（ffmpeg の既定値と同じ）
+DEDUP_HI = 64 * 12
+DEDUP_LO = 64 * 5
+DEDUP_FRAC = 0.33
+# 目標サイズ指定時に本番エンコードを行う最大回数（見積もりが外れたときの補正を含む）
+MAX_FULL_ENCODES = 2
+# ジョブの進捗を公開する最小間隔（秒）
+PROGRESS_MIN_INTERVAL = 0.25
+
+
+def default_worker_count():
+    # libwebpのエンコードはほぼ1コアで動くため、コア数の半分を同時変換数の目安にする
+    cpus = os.cpu_count() or 1
+    return max(1, cpus // 2)
+
+
+def is_supported(filepath):
+    return filepath.lower().endswith(SUPPORTED_EXTS)
+
+
+def validate_settings(fps, width, quality):
+    """設定値を整数に変換して検証する。不正な値なら ValueError を送出する。"""
+    fps = int(fps)
+    width = int(width)
+    quality = int(quality)
+    if fps < 1 or width < 1 or not (0 <= quality <= 100):
+        raise ValueError("fps, width は1以上、quality は0-100で指定してください")
+    return fps, width, quality
+
+
+def dedup_filter(threshold):
+    """
+    ほぼ同一の連続フレームを間引く mpdecimate フィルタ。
+    threshold は類似度のしきい値の倍率（1.0 が ffmpeg の標準値、大きいほど積極的に間引く）。
+    間引いたフレームの表示時間は直前のフレームに足される（-vsync 0 でタイムスタンプを維持）。
+    """
+    hi = int(DEDUP_HI * threshold)
+    lo = int(DEDUP_LO * threshold)
+    return f'mpdecimate=hi={hi}:lo={lo}:frac={DEDUP_FRAC}'
+
+
+def build_ffmpeg_command(filepath, output_path, fps, width, quality, threads=1, start=None, length=None,
+                         dedup=0.0):
+    """
+    変換に使う ffmpeg のコマンドライン（引数リスト）を組み立てる。
+    start, length（秒）を指定するとその区間だけを変換する（分割エンコード用）。
+    dedup に正の値を指定すると重複フレームを間引く（dedup_filter のしきい値）。
+    """
+    threads = str(threads)
+    decimate = [dedup_filter(dedup)] if dedup > 0 else []
+    seek = []
+    if start is not None:
+        seek += ['-ss', f'{start:.6f}']
+    if length is not None:
+        seek += ['-t', f'{length:.6f}']
+    # 入力ファイルがGIFかどうかをチェック
+    if filepath.lower().endswith('.gif'):
+        return [
+            'ffmpeg',
+            '-threads', threads,
+            *seek,
+            '-i', filepath,
+            '-vf', ','.join([f'fps={fps}'] + decimate + [f'scale={width}:-1:flags=lanczos']),  # フレームレートと解像度を設定
+            '-loop', '0',
+            '-lossless', '0',
+            '-q:v', str(quality),
+            '-preset', 'default',
+            *(['-vsync', '0'] if decimate else []),
+            '-threads', threads,
+            output_path
+        ]
+    return [
+        'ffmpeg',
+        '-threads', threads,
+        *seek,
+        '-i', filepath,
+        '-vf', ','.join([f'fps={fps}'] + decimate + [f'scale={width}:-1:flags=lanczos']),  # フレームレートと解像度を設定
+        '-vcodec', 'libwebp',
+        '-lossless', '0',
+        '-q:v', str(quality),  # 品質を設定
+        '-loop', '0',
+        '-an',
+        '-preset', 'default',
+        '-vsync', '0',
+        '-threads', threads,
+        output_path
+    ]
+
+
+def get_unique_filename(filepath, output_dir=None, reserved=()):
+    """
+    入力ファイルと同じ名前の .webp 出力パスを返す。
+    既存ファイルや予約済みのパスと重なる場合は _1, _2 ... を付加する。
+    """
+    base, ext = os.path.splitext(filepath)
+    if output_dir is None:
+        output_dir = os.path.dirname(filepath)
+    base_name = os.path.basename(base)
+    counter = 1
+    output_path = os.path.join(output_dir, base_name + '.webp')
+    while os.path.exists(output_path) or output_path in reserved:
+        output_path = os.path.join(output_dir, f"{base_name}_{counter}.webp")
+        counter += 1
+    return output_path
+
+
+def ffmpeg_time_to_seconds(time_str):
+    try:
+        h, m, s = time_str.split(':')
+        s = float(s)
+        return int(h) * 3600 + int(m) * 60 + s
+    except ValueError:
+        return 0
+
+
+class FfmpegProgress:
+    """
+    ffmpeg -progress の key=value 出力を集計する。
+    1ブロックは progress=continue / progress=end の行で終わる。
+    """
+
+    def __init__(self):
+        self.frame = 0
+        self.fps = 0.0
+        self.speed = 0.0
+        self.out_time = 0.0  # 秒
+        self.total_size = 0  # バイト
+        self.ended = False
+
+    def feed(self, line):
+        """1行を取り込み、ブロックの終わりなら True を返す。"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return False
+        value = value.strip()
+        try:
+            if key == 'frame':
+                self.frame = int(value)
+            elif key == 'fps':
+                self.fps = float(value)
+            elif key == 'speed':
+                self.speed = float(value.rstrip('x'))
+            elif key in ('out_time_us', 'out_time_ms'):
+                # out_time_ms も実際の単位はマイクロ秒
+                self.out_time = int(value) / 1_000_000
+            elif key == 'out_time' and not self.out_time:
+                self.out_time = ffmpeg_time_to_seconds(value)
+            elif key == 'total_size':
+                self.total_size = int(value)
+            elif key == 'progress':
+                self.ended = value == 'end'
+                return True
+        except ValueError:
+            # 値が N/A の場合など
+            pass
+        return False
+
+
+class FfmpegRun:
+    """
+    実行中の ffmpeg 1プロセス。
+    進捗（標準出力）と標準エラーの末尾は、それぞれ別スレッドで読み取る。
+    """
+
+    def __init__(self, cmd):
+        self.process = subprocess.Popen(
+            [cmd[0], *PROGRESS_ARGS, *cmd[1:]],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding=FFMPEG_ENCODING,
+            errors='replace'
+        )
+        self.progress = FfmpegProgress()
+        # 標準エラーは末尾だけをリングバッファに残す
+        self.stderr_tail = deque(maxlen=STDERR_TAIL_LINES)
+        self.readers = [
+            threading.Thread(target=self._read_progress, daemon=True),
+            threading.Thread(target=self.stderr_tail.extend, args=(self.process.stderr,), daemon=True),
+        ]
+        for reader in self.readers:
+            reader.start()
+
+    def _read_progress(self):
+        for line in self.process.stdout:
+            self.progress.feed(line)
+
+    def wait(self):
+        self.process.wait()
+        for reader in self.readers:
+            reader.join()
+        return self.process.returncode
+
+
+class ConversionJob:
+    """
+    1ファイル分の変換ジョブ。
+    状態・進捗はワーカースレッドが書き込み、呼び出し側（GUIのタイマーなど）が読み取る。
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, filepath, fps, width, quality, output_dir=None, segments=1, target_bytes=None,
+                 dedup=0.0):
+        self.id = next(self._ids)
+        self.filepath = filepath
+        self.fps = fps
+        self.width = width
+        self.quality = quality
+        self.output_dir = output_dir
+        self.segments = segments  # 分割エンコードの最大区間数（1なら分割しない）
+        self.segments_used = 1
+        self.target_bytes = target_bytes  # 目標ファイルサイズ（バイト）。指定時は quality より優先
+        self.quality_used = quality
+        self.over_target = None  # 目標サイズ指定時、やり直しても出力が目標を超えたか
+        self.dedup = dedup  # 重複フレーム除去のしきい値（0なら除去しない）
+        self.frames_dropped = None  # 重複として間引いたフレーム数の見積もり
+        self.status = STATUS_QUEUED
+        self.progress = 0.0  # 0-100（GIFはNone=不確定）
+        self.progress_info = {}  # 直近の ffmpeg 進捗（frame, fps, speed, out_time, total_size）
+        self.media = None  # 入力の MediaInfo（変換開始時に取得）
+        self.effective_width = None  # 入力幅で頭打ちにした実際の出力幅
+        self.probe_time = 0.0
+        self.encode_time = 0.0  # ffmpeg の実行に掛かった時間の合計（サンプルのエンコードを含む）
+        # ffmpeg 子プロセスのリソース使用量（CPU時間・I/Oは合計、ピークRSSは同時実行分の合計の最大）
+        self.resources = {"cpu_time": None, "peak_rss": None, "read_bytes": None, "write_bytes": None}
+        self.eta = None  # 残り時間の見積もり（秒）
+        self.cache_hit = None  # 変換キャッシュを使ったか（キャッシュ無効ならNone）
+        # 進捗を公開するたびに増える。表示側は値が変わったジョブだけ描き直す
+        self.revision = 0
+        self.output_path = None
+        self.error = ""
+        self.returncode = None
+        self.submitted_at = None
+        self.started_at = None
+        self.finished_at = None
+        self.processes = []
+        self.future = None
+        self.cancel_requested = threading.Event()
+        self.lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATUSES
+
+    @property
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    @property
+    def queue_wait(self):
+        """投入されてから変換が始まるまで（キャンセルされた場合は終了まで）の待ち時間。"""
+        if self.submitted_at is None:
+            return None
+        return (self.started_at or self.finished_at or time.monotonic()) - self.submitted_at
+
+    def add_resources(self, monitors):
+        """同時に実行した ffmpeg プロセス群の計測値を積算する。"""
+        totals = self.resources
+        for key in ("cpu_time", "read_bytes", "write_bytes"):
+            values = [getattr(monitor, key) for monitor in monitors if getattr(monitor, key) is not None]
+            if values:
+                totals[key] = (totals[key] or 0) + sum(values)
+        peaks = [monitor.peak_rss for monitor in monitors if monitor.peak_rss is not None]
+        if peaks:
+            totals["peak_rss"] = max(totals["peak_rss"] or 0, sum(peaks))
+
+    def to_record(self):
+        """CLI の JSONL 出力などに使う、結果の辞書表現。"""
+        output_bytes = None
+        if self.status == STATUS_DONE and self.output_path and os.path.exists(self.output_path):
+            output_bytes = os.path.getsize(self.output_path)
+        duration = self.media.duration if self.media else None
+        achieved_speed = None
+        if self.status == STATUS_DONE and duration and self.encode_time > 0:
+            achieved_speed = round(duration / self.encode_time, 3)
+        queue_wait = self.queue_wait
+        return {
+            "input": self.filepath,
+            "output": self.output_path if self.status == STATUS_DONE else None,
+            "status": self.status,
+            "fps": self.fps,
+            "width": self.width,
+            "quality": self.quality,
+            "width_used": self.effective_width,
+            "quality_used": self.quality_used,
+            "target_bytes": self.target_bytes,
+            "over_target": self.over_target,
+            "segments": self.segments_used,
+            "dedup": self.dedup,
+            "duration": duration,
+            "queue_wait": None if queue_wait is None else round(queue_wait, 3),
+            "probe_time": round(self.probe_time, 3),
+            "encode_time": round(self.encode_time, 3),
+            "elapsed": round(self.elapsed, 3),
+            "output_bytes": output_bytes,
+            "cache": None if self.cache_hit is None else ("hit" if self.cache_hit else "miss"),
+            "frames": self.progress_info.get("frame"),
+            "frames_dropped": self.frames_dropped,
+            "speed": self.progress_info.get("speed"),
+            "achieved_speed": achieved_speed,
+            **self.resources,
+            "returncode": self.returncode,
+            "error": self.error or None,
+        }
+
+
+class JobScheduler:
+    """
+    同時実行数を制限した変換ジョブキュー。
+    ffmpegの -threads は同時実行数でコアを等分した値を各ジョブに割り当てる。
+    on_finished を渡すと、ジョブ終了ごとにワーカースレッドから呼び出される。
+    keep_finished=False なら終了したジョブは jobs から取り除く（大量バッチ向け）。
+    metrics_log（jobMetrics.MetricsLog）を渡すと、終了したジョブの計測値を追記する。
+    """
+
+    def __init__(self, max_workers=None, on_finished=None, keep_finished=True, probe_cache=None,
+                 encode_cache=None, metrics_log=None):
+        self.max_workers = max_workers or default_worker_count()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self.probe_cache = probe_cache or ProbeCache()
+        self.encode_cache = encode_cache
+        self.metrics_log = metrics_log
+        # 変換待ちのジョブの ffprobe を先回りして並列に済ませておくためのプール
+        self.probe_executor = ThreadPoolExecutor(max_workers=self.probe_cache.max_workers)
+        self.on_finished = on_finished
+        self.keep_finished = keep_finished
+        self.jobs = []
+        self.jobs_lock = threading.Lock()
+        # 同時実行中のジョブ同士で出力ファイル名が衝突しないよう予約しておく
+        self.reserved_outputs = set()
+        self.output_lock = threading.Lock()
+
+    def ffmpeg_threads(self):
+        cpus = os.cpu_count() or 1
+        return max(1, cpus // self.max_workers)
+
+    def is_idle(self):
+        return all(job.finished for job in self.jobs)
+
+    def resize(self, max_workers):
+        """同時実行数を変更する。実行中のジョブは旧プールで最後まで処理される。"""
+        if max_workers == self.max_workers:
+            return
+        self.executor.shutdown(wait=False)
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, job):
+        with self.jobs_lock:
+            self.jobs.append(job)
+        job.submitted_at = time.monotonic()
+        job.future = self.executor.submit(self.run_job, job)
+        return job
+
+    def prefetch_probes(self, filepaths):
+        """ドロップされたファイル群の ffprobe をバックグラウンドで並列実行しておく。"""
+        for filepath in filepaths:
+            self.probe_executor.submit(self.probe_cache.get, filepath)
+
+    def cancel(self, job):
+        if job.finished:
+            return
+        job.cancel_requested.set()
+        # 待機中ならキューから取り除く
+        if job.future is not None and job.future.cancel():
+            self._finish(job, STATUS_CANCELLED)
+            return
+        # 実行中ならffmpegを停止する（状態はワーカー側で更新）
+        with job.lock:
+            for process in job.processes:
+                if process.poll() is None:
+                    process.terminate()
+
+    def cancel_all(self):
+        with self.jobs_lock:
+            jobs = list(self.jobs)
+        for job in jobs:
+            self.cancel(job)
+
+    def remove_finished(self):
+        with self.jobs_lock:
+            self.jobs = [job for job in self.jobs if not job.finished]
+
+    def shutdown(self, wait=False):
+        if not wait:
+            self.cancel_all()
+        self.executor.shutdown(wait=wait)
+        self.probe_executor.shutdown(wait=wait)
+        self.save_caches()
+
+    def save_caches(self):
+        self.probe_cache.save()
+        if self.encode_cache is not None:
+            self.encode_cache.save()
+
+    def reserve_output(self, job):
+        with self.output_lock:
+            output_path = get_unique_filename(job.filepath, job.output_dir, self.reserved_outputs)
+            self.reserved_outputs.add(output_path)
+        return output_path
+
+    def release_output(self, output_path):
+        with self.output_lock:
+            self.reserved_outputs.discard(output_path)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.monotonic()
+        job.revision += 1
+        if not self.keep_finished:
+            with self.jobs_lock:
+                self.jobs.remove(job)
+        if self.metrics_log is not None:
+            self.metrics_log.write(job.to_record())
+        if self.on_finished is not None:
+            self.on_finished(job)
+
+    def run_job(self, job):
+        if job.cancel_requested.is_set():
+            self._finish(job, STATUS_CANCELLED)
+            return
+
+        job.started_at = time.monotonic()
+        if job.output_dir:
+            os.makedirs(job.output_dir, exist_ok=True)
+        output_path = self.reserve_output(job)
+        job.output_path = output_path
+        try:
+            status = self.convert(job, output_path)
+        except Exception as e:
+            job.error = str(e)
+            status = STATUS_ERROR
+        finally:
+            self.release_output(output_path)
+        self._finish(job, status)
+
+    def convert(self, job, output_path):
+        """ffmpeg を実行して1ジョブを変換し、終了時の状態を返す。"""
+        filepath = job.filepath
+        is_gif = filepath.lower().endswith('.gif')
+
+        probe_start = time.monotonic()
+        info = self.probe_cache.get(filepath)
+        job.probe_time = time.monotonic() - probe_start
+        job.media = info
+
+        # 元動画より大きい幅には拡大しない
+        width = min(job.width, info.width) if info.width else job.width
+        job.effective_width = width
+
+        # 進捗は出力時刻/長さで求める。長さが不明ならフレーム数の見積もりを使う
+        total_duration = info.duration
+        total_frames = info.estimated_frames(None if is_gif else job.fps)
+
+        # 目標サイズ指定時は、サンプルのエンコード結果から品質と幅を決める
+        quality = job.quality
+        model = None
+        if job.target_bytes and info.duration > 0:
+            status, quality, width, model = self.choose_target_settings(job, info, width, output_path)
+            if status != STATUS_DONE:
+                return status
+            job.effective_width = width
+
+        for attempt in range(MAX_FULL_ENCODES):
+            job.quality_used = quality
+            status = self.encode(job, output_path, width, quality, total_duration, total_frames)
+            if status != STATUS_DONE or model is None:
+                return status
+            actual = os.path.getsize(job.output_path)
+            job.over_target = actual > job.target_bytes
+            if not job.over_target or attempt == MAX_FULL_ENCODES - 1:
+                # 最後の回は予算を超えていても出力を残し、超えたことだけを記録する
+                return status
+            # 見積もりが外れて予算を超えた場合だけ、実測で補正した品質でやり直す
+            model = model.scaled(actual / model.predict(quality, info.duration))
+            next_quality = model.best_quality(job.target_bytes, info.duration)
+            if next_quality is None or next_quality >= quality:
+                return status
+            if job.output_path == output_path:
+                os.remove(output_path)
+            job.output_path = output_path
+            quality = next_quality
+        return status
+
+    def choose_target_settings(self, job, info, width, output_path):
+        """
+        目標サイズに収まる品質・幅をサンプルのエンコードから決め、
+        (状態, 品質, 幅, SizeModel) を返す。どの幅でも収まらなければ最小の幅・品質0にする。
+        """
+        windows = sample_windows(info.duration)
+        sample_seconds = sum(length for _, length in windows)
+        sample_dir = tempfile.mkdtemp(prefix=".webp_samples_", dir=os.path.dirname(output_path))
+        try:
+            for candidate in candidate_widths(width):
+                cmds = []
+                paths = {quality: [] for quality in SAMPLE_QUALITIES}
+                for quality in SAMPLE_QUALITIES:
+                    for i, (start, length) in enumerate(windows):
+                        path = os.path.join(sample_dir, f"{candidate}_{quality}_{i}.webp")
+                        paths[quality].append(path)
+                        cmds.append(build_ffmpeg_command(job.filepath, path, job.fps, candidate, quality,
+                                                         start=start, length=length, dedup=job.dedup))
+                # サンプルも1スレッドずつのプロセスで、ジョブのスレッド数の枠を超えない本数ずつ実行する
+                budget = self.ffmpeg_threads()
+                for first in range(0, len(cmds), budget):
+                    status = self.run_ffmpeg(job, cmds[first:first + budget], 0, 0)
+                    if status != STATUS_DONE:
+                        return status, None, None, None
+                model = SizeModel.fit([
+                    (quality, sum(os.path.getsize(path) for path in paths[quality]) / sample_seconds)
+                    for quality in SAMPLE_QUALITIES
+                ])
+                quality = model.best_quality(job.target_bytes, info.duration)
+                if quality is not None:
+                    return STATUS_DONE, quality, candidate, model
+            return STATUS_DONE, 0, candidate, model
+        finally:
+            shutil.rmtree(sample_dir, ignore_errors=True)
+
+    def encode(self, job, output_path, width, quality, total_duration, total_frames):
+        """指定した幅・品質で1回エンコードする（変換キャッシュ・分割エンコードを含む）。"""
+        filepath = job.filepath
+        is_gif = filepath.lower().endswith('.gif')
+        cmd = build_ffmpeg_command(filepath, output_path, job.fps, width, quality,
+                                   self.ffmpeg_threads(), dedup=job.dedup)
+
+        # 同じ入力・同じ設定の変換結果があればエンコードせずに再利用する
+        cache_key = None
+        if self.encode_cache is not None:
+            cache_key = self.encode_cache.make_key(cmd, filepath, output_path)
+            cached_path = self.encode_cache.lookup(cache_key, output_path)
+            job.cache_hit = cached_path is not None
+            if cached_path:
+                job.output_path = cached_path
+                job.progress = 100.0
+                job.eta = 0.0
+                return STATUS_DONE
+
+        job.progress = 0.0 if total_duration or total_frames else None
+        # 区間のプロセスは同時に動くため、区間数はジョブのスレッド数の枠（1区間1スレッド以上）までにする
+        segment_count = min(job.segments, self.ffmpeg_threads())
+        segments = [] if is_gif else plan_segments(total_duration, job.fps, segment_count)
+        if segments:
+            status = self.convert_segmented(job, output_path, width, quality, segments,
+                                            total_duration, total_frames)
+        else:
+            status = None
+        if status is None:
+            job.segments_used = 1
+            status = self.run_ffmpeg(job, [cmd], total_duration, total_frames)
+
+        if status == STATUS_CANCELLED:
+            # 中断された出力ファイルは削除する
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        elif status == STATUS_DONE:
+            job.progress = 100.0
+            job.eta = 0.0
+            if job.dedup > 0 and total_frames:
+                # フィルタ内で間引かれたフレームは ffmpeg の統計に出ないため、入力側の見積もりとの差で数える
+                job.frames_dropped = max(0, total_frames - job.progress_info.get("frame", total_frames))
+            if cache_key is not None:
+                try:
+                    self.encode_cache.store(cache_key, output_path)
+                except OSError as e:
+                    # キャッシュへの登録失敗は変換結果には影響させない
+                    print(f"変換キャッシュへの登録に失敗しました: {e}", file=sys.stderr)
+        return status
+
+    def convert_segmented(self, job, output_path, width, quality, segments, total_duration, total_frames):
+        """
+        区間ごとに別プロセスでエンコードして結合する。
+        区間の結果を結合できなかった場合は None を返し、呼び出し側で1プロセス変換に切り替える。
+        """
+        job.segments_used = len(segments)
+        threads = max(1, self.ffmpeg_threads() // len(segments))
+        segment_dir = tempfile.mkdtemp(prefix=".webp_segments_", dir=os.path.dirname(output_path))
+        try:
+            segment_paths = [os.path.join(segment_dir, f"{i:04d}.webp") for i in range(len(segments))]
+            cmds = [
+                build_ffmpeg_command(job.filepath, path, job.fps, width, quality, threads,
+                                     start=start, length=length, dedup=job.dedup)
+                for path, (start, length) in zip(segment_paths, segments)
+            ]
+            status = self.run_ffmpeg(job, cmds, total_duration, total_frames)
+            if status != STATUS_DONE:
+                return status
+            try:
+                merge_animated_webp(segment_paths, output_path)
+            except ValueError as e:
+                print(f"分割エンコード結果を結合できないため1プロセスで変換します: {e}", file=sys.stderr)
+                return None
+            return STATUS_DONE
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+
+    def run_ffmpeg(self, job, cmds, total_duration, total_frames):
+        """
+        ffmpeg を（分割エンコードなら複数同時に）実行し、終了時の状態を返す。
+        進捗は全プロセスの合計を PROGRESS_MIN_INTERVAL ごとにジョブへ公開する。
+        """
+        for cmd in cmds:
+            # コマンドを文字列にして表示（デバッグ用。CLIの標準出力を汚さないよう標準エラーへ）
+            cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
+            print(f"実行コマンド: {cmd_str}", file=sys.stderr)
+
+        with job.lock:
+            # ロック取得前にキャンセルされていれば起動しない
+            if job.cancel_requested.is_set():
+                return STATUS_CANCELLED
+            job.status = STATUS_RUNNING
+            job.revision += 1
+            started = time.monotonic()
+            runs = [FfmpegRun(cmd) for cmd in cmds]
+            job.processes = [run.process for run in runs]
+            monitors = [ProcessMonitor(run.process) for run in runs]
+
+        while True:
+            running = [run for run in runs if run.process.poll() is None]
+            if not running:
+                break
+            try:
+                running[0].process.wait(timeout=PROGRESS_MIN_INTERVAL)
+            except subprocess.TimeoutExpired:
+                pass
+            self.publish_progress(job, runs, total_duration, total_frames)
+
+        returncodes = [run.wait() for run in runs]
+        job.encode_time += time.monotonic() - started
+        for monitor in monitors:
+            monitor.stop()
+        job.add_resources(monitors)
+        self.publish_progress(job, runs, total_duration, total_frames)
+        job.returncode = next((code for code in returncodes if code != 0), 0)
+
+        if job.cancel_requested.is_set():
+            return STATUS_CANCELLED
+        if job.returncode == 0:
+            return STATUS_DONE
+        failed = next(run for run in runs if run.process.returncode != 0)
+        job.error = ''.join(failed.stderr_tail)
+        return STATUS_ERROR
+
+    def publish_progress(self, job, runs, total_duration, total_frames):
+        progresses = [run.progress for run in runs]
+        out_time = sum(p.out_time for p in progresses)
+        frame = sum(p.frame for p in progresses)
+        # 並列実行中のプロセスの速度は足し合わせた値が全体の速度になる
+        speed = sum(p.speed for p in progresses)
+        job.progress_info = {
+            "frame": frame,
+            "fps": sum(p.fps for p in progresses),
+            "speed": speed,
+            "out_time": out_time,
+            "total_size": sum(p.total_size for p in progresses),
+        }
+        if total_duration > 0:
+            job.progress = min(100.0, out_time / total_duration * 100)
+            if speed > 0:
+                job.eta = max(0.0, (total_duration - out_time) / speed)
+        elif total_frames > 0:
+            job.progress = min(100.0, frame / total_frames * 100)
+        job.revision += 1
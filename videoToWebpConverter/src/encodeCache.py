@@ -0,0 +1,180 @@
+"""
+変換結果（WebP）のキャッシュ。
+入力ファイルの内容の指紋と、出力に影響する ffmpeg 引数の組をキーにして出力を保存し、
+同じ入力・同じ設定の再変換ではエンコードせずに既存の出力を再利用（ハードリンク）する。
+指紋はファイル全体のハッシュで、同じファイル（パス・サイズ・更新日時が同じ）の指紋は1度だけ計算する。
+"""
+import hashlib
+import threading
+import shutil
+import json
+import time
+import os
+
+# 既定の容量上限（バイト）
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# 入力の指紋を計算するときの読み取りブロックの大きさ（バイト）
+FINGERPRINT_CHUNK = 1024 * 1024
+
+# 出力内容に影響しない ffmpeg 引数（キーから除外する）
+_IGNORED_ARGS = {'-threads'}
+
+
+def file_fingerprint(filepath):
+    """
+    ファイル全体を FINGERPRINT_CHUNK ずつ読んで内容の指紋を作る。
+    一部だけのハッシュでは、サイズが同じで途中だけ違う動画（同じ長さで撮り直したものなど）に前回の出力を返してしまう。
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(FINGERPRINT_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def normalized_args(cmd, input_path, output_path):
+    """ffmpeg 引数から入出力パスとスレッド数を取り除き、キーに使える形にする。"""
+    args = []
+    skip_next = False
+    for arg in cmd[1:]:
+        if skip_next:
+            skip_next = False
+            continue
+        if arg in _IGNORED_ARGS:
+            skip_next = True
+            continue
+        if arg == input_path:
+            arg = '{input}'
+        elif arg == output_path:
+            arg = '{output}'
+        args.append(arg)
+    return args
+
+
+def link_or_copy(src, dst):
+    # 同じドライブならハードリンク（容量を使わない）、できなければコピー
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class EncodeCache:
+    """
+    出力 WebP を cache_dir 以下に保存する、容量上限つきの LRU キャッシュ。
+    統計（ヒット・ミス・節約したバイト数）は索引ファイルに一緒に保存する。
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.stats = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        self.fingerprints = {}  # (パス, サイズ, 更新日時) -> 指紋（目標サイズのやり直しなどで読み直さないため）
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            self.stats.update(data.get("stats", {}))
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"entries": self.entries, "stats": self.stats}, ensure_ascii=False)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.index_path)
+
+    def make_key(self, cmd, input_path, output_path):
+        payload = json.dumps([self.fingerprint(input_path),
+                              normalized_args(cmd, input_path, output_path)])
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def fingerprint(self, input_path):
+        stat = os.stat(input_path)
+        identity = (os.path.abspath(input_path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            fingerprint = self.fingerprints.get(identity)
+        if fingerprint is None:
+            fingerprint = file_fingerprint(input_path)
+            with self.lock:
+                self.fingerprints[identity] = fingerprint
+        return fingerprint
+
+    def _blob_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".webp")
+
+    def lookup(self, key, output_path):
+        """
+        キャッシュにあれば出力を用意してそのパスを返す（なければ None）。
+        前回の出力ファイルが同じフォルダに変更されずに残っていればそれをそのまま返し、
+        なければ output_path にハードリンクする。
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            blob = self._blob_path(key)
+            if entry is None or not os.path.exists(blob):
+                self.entries.pop(key, None)
+                self.stats["misses"] += 1
+                return None
+            entry["last_access"] = time.time()
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += entry["size"]
+            previous = entry.get("output")
+
+        if previous and os.path.dirname(previous) == os.path.dirname(output_path) \
+                and os.path.exists(previous) and os.path.samefile(previous, blob):
+            return previous
+        link_or_copy(blob, output_path)
+        with self.lock:
+            entry["output"] = output_path
+        return output_path
+
+    def store(self, key, output_path):
+        """変換済みの出力をキャッシュに登録し、容量上限を超えたら古いものから削除する。"""
+        blob = self._blob_path(key)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        if os.path.exists(blob):
+            os.remove(blob)
+        link_or_copy(output_path, blob)
+        with self.lock:
+            self.entries[key] = {
+                "size": os.path.getsize(blob),
+                "last_access": time.time(),
+                "output": output_path,
+            }
+            self._evict()
+
+    def _evict(self):
+        total = sum(entry["size"] for entry in self.entries.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)["size"]
+            try:
+                os.remove(self._blob_path(key))
+            except OSError:
+                pass
+
+    def total_bytes(self):
+        with self.lock:
+            return sum(entry["size"] for entry in self.entries.values())
+
+    def stats_summary(self):
+        """統計の表示用文字列。"""
+        with self.lock:
+            stats = dict(self.stats)
+            entries = len(self.entries)
+        return (f"キャッシュ: ヒット {stats['hits']} / ミス {stats['misses']} / "
+                f"節約 {stats['bytes_saved'] / 1024 ** 2:.1f} MB / {entries} 件 "
+                f"{self.total_bytes() / 1024 ** 2:.1f} MB")
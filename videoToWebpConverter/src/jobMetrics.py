@@ -0,0 +1,149 @@
+"""
+変換ジョブごとの計測値（待ち時間・ffprobe時間・エンコード時間・ffmpegのCPU時間/メモリ/I/O など）を
+JSONL 形式でローテーションするファイルに追記し、設定プロファイルごとの p50 / p95 を集計する。
+
+集計の表示:
+    python jobMetrics.py                 # 既定のメトリクスファイルを集計
+    python jobMetrics.py path/to/jobs.jsonl
+"""
+from logging.handlers import RotatingFileHandler
+import argparse
+import itertools
+import logging
+import json
+import math
+import sys
+import os
+
+from mediaProbe import default_cache_dir
+
+# 1ファイルの上限と、残す世代数
+DEFAULT_MAX_BYTES = 10 * 1024 ** 2
+DEFAULT_BACKUP_COUNT = 5
+
+# 集計する指標
+SUMMARY_METRICS = ("queue_wait", "probe_time", "encode_time", "achieved_speed", "cpu_time",
+                   "peak_rss", "read_bytes", "write_bytes", "output_bytes")
+# 設定プロファイルを区別する項目
+PROFILE_KEYS = ("fps", "width", "quality", "target_bytes", "segments", "dedup")
+# 既定値のままなら表示を省く項目
+_PROFILE_DEFAULTS = {"target_bytes": None, "segments": 1, "dedup": 0}
+
+_logger_ids = itertools.count()
+
+
+def default_metrics_path():
+    return os.path.join(default_cache_dir(), "metrics", "jobs.jsonl")
+
+
+class MetricsLog:
+    """ジョブの計測レコードを1行1JSONで追記する（サイズ上限でローテーション）。"""
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                           encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter("%(message)s"))
+        self.logger = logging.getLogger(f"videoToWebpConverter.metrics.{next(_logger_ids)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+    def write(self, record):
+        # logging のハンドラはスレッドセーフなので、ワーカースレッドから直接呼んでよい
+        self.logger.info(json.dumps(record, ensure_ascii=False))
+
+    def close(self):
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+
+
+def read_records(path, backup_count=DEFAULT_BACKUP_COUNT):
+    """ローテーション済みの古いファイルも含めてレコードを読み出す（古い順）。"""
+    paths = [f"{path}.{i}" for i in range(backup_count, 0, -1)] + [path]
+    for file_path in paths:
+        if not os.path.exists(file_path):
+            continue
+        with open(file_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def percentile(values, fraction):
+    """最近傍順位法によるパーセンタイル。"""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def profile_name(record):
+    parts = []
+    for key in PROFILE_KEYS:
+        value = record.get(key)
+        if key in _PROFILE_DEFAULTS and value == _PROFILE_DEFAULTS[key]:
+            continue
+        parts.append(f"{key}={value}")
+    return " ".join(parts)
+
+
+def summarize(records, status="done"):
+    """{プロファイル: {"count": n, 指標: (p50, p95), ...}} を返す。"""
+    groups = {}
+    for record in records:
+        if status and record.get("status") != status:
+            continue
+        groups.setdefault(profile_name(record), []).append(record)
+    summary = {}
+    for name, group in sorted(groups.items()):
+        row = {"count": len(group)}
+        for metric in SUMMARY_METRICS:
+            values = [r[metric] for r in group if isinstance(r.get(metric), (int, float))]
+            if values:
+                row[metric] = (percentile(values, 0.5), percentile(values, 0.95))
+        summary[name] = row
+    return summary
+
+
+def _format_value(metric, value):
+    if metric in ("peak_rss", "read_bytes", "write_bytes", "output_bytes"):
+        return f"{value / 1024 ** 2:.1f}MB"
+    if metric == "achieved_speed":
+        return f"{value:.2f}x"
+    return f"{value:.2f}s"
+
+
+def format_summary(summary):
+    lines = []
+    for name, row in summary.items():
+        lines.append(f"[{name}] 件数: {row['count']}")
+        for metric in SUMMARY_METRICS:
+            if metric in row:
+                p50, p95 = row[metric]
+                lines.append(f"  {metric:<14} p50 {_format_value(metric, p50):>10}  "
+                             f"p95 {_format_value(metric, p95):>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="変換ジョブのメトリクスを設定プロファイルごとに集計します。")
+    parser.add_argument("path", nargs="?", default=default_metrics_path(), help="メトリクスファイル")
+    parser.add_argument("--status", default="done", help="集計するジョブの状態（空文字ですべて）")
+    parser.add_argument("--json", action="store_true", help="集計結果を JSON で出力する")
+    args = parser.parse_args(argv)
+
+    summary = summarize(read_records(args.path), args.status or None)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    elif summary:
+        print(format_summary(summary))
+    else:
+        print("集計できるレコードがありません。", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
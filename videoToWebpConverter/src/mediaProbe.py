@@ -0,0 +1,212 @@
+"""
+ffprobe による入力動画の情報取得と、そのディスクキャッシュ。
+1回の ffprobe 呼び出しで長さ・解像度・フレームレート・コーデック・フレーム数を取得し、
+パス・サイズ・更新日時をキーに保存して、同じファイルの再変換では ffprobe を起動しない。
+"""
+from concurrent.futures import Future
+import subprocess
+import threading
+import json
+import os
+
+# キャッシュに保持する最大件数（超えたら古いものから捨てる）
+MAX_CACHE_ENTRIES = 20000
+
+
+def default_cache_dir():
+    """キャッシュ類を置くフォルダ（Windows は LOCALAPPDATA、それ以外は ~/.cache）。"""
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "UhiyamaLab", "videoToWebpConverter")
+
+
+def default_probe_cache_path():
+    return os.path.join(default_cache_dir(), "probe_cache.json")
+
+
+def default_encode_cache_dir():
+    return os.path.join(default_cache_dir(), "encode_cache")
+
+
+def _parse_rate(rate):
+    # "30000/1001" のような分数表記を float にする
+    try:
+        num, _, den = rate.partition('/')
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError, AttributeError):
+        return 0.0
+
+
+def _to_float(value, default=0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+class MediaInfo:
+    """ffprobe で取得した入力ファイルの情報。"""
+
+    def __init__(self, duration=0.0, width=0, height=0, fps=0.0, codec=None, frame_count=0):
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.frame_count = frame_count
+
+    def to_dict(self):
+        return {
+            "duration": self.duration,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "codec": self.codec,
+            "frame_count": self.frame_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{key: data.get(key) for key in
+                      ("duration", "width", "height", "fps", "codec", "frame_count")
+                      if data.get(key) is not None})
+
+    def estimated_frames(self, output_fps=None):
+        """出力フレーム数の見積もり。fps を変換する場合は長さ×出力fpsで計算する。"""
+        if output_fps and self.duration:
+            return int(round(self.duration * output_fps))
+        if self.frame_count:
+            return self.frame_count
+        return int(round(self.duration * self.fps))
+
+
+def probe_media(filepath):
+    """ffprobe を1回だけ実行して MediaInfo を返す。取得できなかった値は 0 のまま。"""
+    cmd = [
+        'ffprobe',
+        '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries',
+        'format=duration:stream=codec_name,width,height,avg_frame_rate,r_frame_rate,nb_frames,duration',
+        '-of', 'json',
+        filepath
+    ]
+    result = subprocess.run(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        encoding='utf-8',
+        errors='replace'
+    )
+    try:
+        data = json.loads(result.stdout or "{}")
+    except ValueError:
+        data = {}
+    streams = data.get("streams") or [{}]
+    stream = streams[0]
+    fmt = data.get("format") or {}
+
+    fps = _parse_rate(stream.get("avg_frame_rate")) or _parse_rate(stream.get("r_frame_rate"))
+    duration = _to_float(fmt.get("duration")) or _to_float(stream.get("duration"))
+    frame_count = int(_to_float(stream.get("nb_frames")))
+    if not frame_count and duration and fps:
+        frame_count = int(round(duration * fps))
+    return MediaInfo(
+        duration=duration,
+        width=int(stream.get("width") or 0),
+        height=int(stream.get("height") or 0),
+        fps=fps,
+        codec=stream.get("codec_name"),
+        frame_count=frame_count,
+    )
+
+
+class ProbeCache:
+    """
+    probe_media の結果をパス・サイズ・更新日時をキーに保持するキャッシュ。
+    cache_path を指定するとJSONファイルに保存・読み込みする（None ならメモリのみ）。
+    同じファイルへの同時問い合わせは1回の ffprobe にまとめる。
+    """
+
+    def __init__(self, cache_path=None, max_workers=None):
+        self.cache_path = cache_path
+        self.max_workers = max_workers or min(8, (os.cpu_count() or 1) * 2)
+        self.entries = {}
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            # 壊れたキャッシュは捨てて作り直す
+            self.entries = {}
+
+    def save(self):
+        if not self.cache_path:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            # 古い順（挿入順）に捨てて件数を抑える
+            overflow = len(self.entries) - MAX_CACHE_ENTRIES
+            for key in list(self.entries)[:max(0, overflow)]:
+                del self.entries[key]
+            data = json.dumps(self.entries, ensure_ascii=False)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = self.cache_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_path)
+
+    def get(self, filepath):
+        """ファイルの MediaInfo を返す。キャッシュが有効ならffprobeを起動しない。"""
+        key = os.path.abspath(filepath)
+        try:
+            stat = os.stat(key)
+        except OSError:
+            return probe_media(filepath)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                self.hits += 1
+                return MediaInfo.from_dict(entry["info"])
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+                self.misses += 1
+
+        if not owner:
+            # 他のスレッドが同じファイルを調査中なので結果を待つ
+            return future.result()
+
+        try:
+            info = probe_media(filepath)
+            # 何も取れなかった（ffprobeが失敗した）結果はキャッシュしない
+            if info.duration or info.width:
+                with self.lock:
+                    self.entries.pop(key, None)
+                    self.entries[key] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                        "info": info.to_dict(),
+                    }
+                    self.dirty = True
+            future.set_result(info)
+            return info
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
@@ -0,0 +1,112 @@
+"""
+実行中の子プロセス（ffmpeg）のリソース使用量を定期的に取得する。
+psutil があればそれを使い、なければ Linux の /proc から読む。
+どちらも使えない環境では値は None のままになる。
+"""
+import threading
+import os
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# サンプリング間隔（秒）
+SAMPLE_INTERVAL = 0.1
+
+
+def _read_proc(pid):
+    """/proc から (RSS, ピークRSS, CPU時間, 読み込みバイト, 書き込みバイト) を読む。"""
+    rss = peak = cpu = read_bytes = write_bytes = None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+        with open(f"/proc/{pid}/stat") as f:
+            # comm に空白が入ることがあるため ')' 以降で分割する
+            fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{pid}/io") as f:
+            for line in f:
+                if line.startswith("read_bytes:"):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith("write_bytes:"):
+                    write_bytes = int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return rss, peak, cpu, read_bytes, write_bytes
+
+
+class ProcessMonitor:
+    """
+    子プロセスを別スレッドで監視し、ピークRSS・CPU時間・I/Oバイト数を記録する。
+    プロセス終了後の値は最後に取得できたサンプルになる。
+    """
+
+    def __init__(self, process, interval=SAMPLE_INTERVAL):
+        self.process = process
+        self.interval = interval
+        self.peak_rss = None
+        self.cpu_time = None
+        self.read_bytes = None
+        self.write_bytes = None
+        self.samples = 0
+        self._stop = threading.Event()
+        self._handle = None
+        if psutil is not None:
+            try:
+                self._handle = psutil.Process(process.pid)
+            except psutil.Error:
+                pass
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        if self._handle is not None:
+            try:
+                with self._handle.oneshot():
+                    rss = self._handle.memory_info().rss
+                    times = self._handle.cpu_times()
+                    cpu = times.user + times.system
+                    try:
+                        io = self._handle.io_counters()
+                        read_bytes, write_bytes = io.read_bytes, io.write_bytes
+                    except (psutil.Error, AttributeError):
+                        # macOS では I/O カウンタが取れない
+                        read_bytes = write_bytes = None
+                peak = rss
+            except psutil.Error:
+                return
+        else:
+            rss, peak, cpu, read_bytes, write_bytes = _read_proc(self.process.pid)
+            if rss is None and cpu is None:
+                return
+        self.samples += 1
+        if peak is not None:
+            self.peak_rss = max(self.peak_rss or 0, peak, rss or 0)
+        if cpu is not None:
+            self.cpu_time = cpu
+        if read_bytes is not None:
+            self.read_bytes = read_bytes
+        if write_bytes is not None:
+            self.write_bytes = write_bytes
+
+    def _run(self):
+        while self.process.poll() is None and not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def to_dict(self):
+        return {
+            "peak_rss": self.peak_rss,
+            "cpu_time": self.cpu_time,
+            "read_bytes": self.read_bytes,
+            "write_bytes": self.write_bytes,
+        }
@@ -0,0 +1,176 @@
+"""
+長い動画を時間で分割して並列にエンコードし、1つのアニメーション WebP に結合する。
+libwebp のアニメーションエンコードはほぼ1コアしか使わないため、区間ごとに別の ffmpeg
+プロセスでエンコードし、出来上がった WebP のフレーム（ANMF チャンク）を再エンコードせずに
+コンテナ上で連結する。
+
+単体で実行すると、通常の1プロセス変換と分割変換の結果を比較して検証できる:
+    python segmentEncoder.py input.mp4 --segments 4
+"""
+import struct
+import os
+
+# 分割する1区間の最短の長さ（秒）。短すぎる区間はプロセス起動のコストが勝つ
+SEGMENT_MIN_SECONDS = 5.0
+
+_ANMF_HEADER_SIZE = 16
+_FLAG_ANIMATION = 0x02
+_FLAG_ALPHA = 0x10
+_ANMF_NO_BLEND = 0x02
+
+
+def plan_segments(duration, fps, count, min_seconds=SEGMENT_MIN_SECONDS):
+    """
+    長さ duration 秒の動画を count 個以下の区間 [(開始秒, 長さ秒), ...] に分ける。
+    区間の境界は出力フレーム間隔（1/fps）の倍数に揃え、結合後のフレーム位置が
+    1プロセスで変換した場合と一致するようにする。分割しない場合は [] を返す。
+    """
+    if count < 2 or duration <= 0 or fps <= 0:
+        return []
+    count = min(count, int(duration // min_seconds))
+    if count < 2:
+        return []
+    total_frames = int(round(duration * fps))
+    bounds = [round(total_frames * i / count) for i in range(count + 1)]
+    segments = []
+    for i in range(count):
+        start = bounds[i] / fps
+        # 最後の区間は末尾まで（端数フレームを落とさない）
+        length = (bounds[i + 1] - bounds[i]) / fps if i < count - 1 else duration - start
+        segments.append((start, length))
+    return segments
+
+
+def _read_chunks(path):
+    """WebP(RIFF) ファイルを [(FourCC, payload), ...] に分解する。"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WEBP':
+        raise ValueError(f"WebP ファイルではありません: {path}")
+    chunks = []
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        size = struct.unpack('<I', data[pos + 4:pos + 8])[0]
+        chunks.append((fourcc, data[pos + 8:pos + 8 + size]))
+        pos += 8 + size + (size & 1)
+    return chunks
+
+
+def _chunk(fourcc, payload):
+    pad = b'\0' if len(payload) & 1 else b''
+    return fourcc + struct.pack('<I', len(payload)) + payload + pad
+
+
+def _frame_duration(anmf_payload):
+    return int.from_bytes(anmf_payload[12:15], 'little')
+
+
+def read_animation(path):
+    """
+    アニメーション WebP を (VP8X, ANIM, [ANMF...]) の payload に分解する。
+    アニメーションでない（1フレームの静止画など）場合は ValueError。
+    """
+    chunks = _read_chunks(path)
+    vp8x = next((payload for fourcc, payload in chunks if fourcc == b'VP8X'), None)
+    anim = next((payload for fourcc, payload in chunks if fourcc == b'ANIM'), None)
+    frames = [payload for fourcc, payload in chunks if fourcc == b'ANMF']
+    if vp8x is None or anim is None or not frames or not (vp8x[0] & _FLAG_ANIMATION):
+        raise ValueError(f"アニメーション WebP ではありません: {path}")
+    return vp8x, anim, frames
+
+
+def animation_stats(path):
+    """アニメーション WebP の (フレーム数, 合計表示時間ミリ秒) を返す。"""
+    _, _, frames = read_animation(path)
+    return len(frames), sum(_frame_duration(frame) for frame in frames)
+
+
+def merge_animated_webp(segment_paths, output_path, loop=0):
+    """
+    区間ごとのアニメーション WebP を再エンコードせずに1つに連結する。
+    各区間の先頭フレームは「ブレンドしない」に書き換え、前の区間の最後のフレームの
+    上に重ねずにキャンバス全体を置き換えるようにする。
+    """
+    vp8x = None
+    anim = None
+    flags = 0
+    frames = []
+    for path in segment_paths:
+        seg_vp8x, seg_anim, seg_frames = read_animation(path)
+        if vp8x is None:
+            vp8x, anim = seg_vp8x, seg_anim
+        elif seg_vp8x[4:10] != vp8x[4:10]:
+            raise ValueError("区間ごとのキャンバスサイズが一致しません")
+        flags |= seg_vp8x[0]
+        first = bytearray(seg_frames[0])
+        first[15] |= _ANMF_NO_BLEND
+        frames.append(bytes(first))
+        frames.extend(seg_frames[1:])
+
+    vp8x = bytes([flags | _FLAG_ANIMATION]) + vp8x[1:]
+    anim = anim[:4] + struct.pack('<H', loop)
+    body = b'WEBP' + _chunk(b'VP8X', vp8x) + _chunk(b'ANIM', anim)
+    body += b''.join(_chunk(b'ANMF', frame) for frame in frames)
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', len(body)) + body)
+    os.replace(tmp_path, output_path)
+
+
+def compare_outputs(single_path, merged_path, segments, fps):
+    """
+    1プロセス変換と分割変換の結果を比較し、(一致したか, 説明) を返す。
+    区間の境界ごとに最大1フレーム・1フレーム分の時間の差を許容する。
+    """
+    single_frames, single_ms = animation_stats(single_path)
+    merged_frames, merged_ms = animation_stats(merged_path)
+    frame_tolerance = max(0, segments - 1)
+    ms_tolerance = frame_tolerance * 1000.0 / fps + 1
+    ok = (abs(single_frames - merged_frames) <= frame_tolerance
+          and abs(single_ms - merged_ms) <= ms_tolerance)
+    detail = (f"1プロセス: {single_frames} フレーム / {single_ms} ms, "
+              f"分割: {merged_frames} フレーム / {merged_ms} ms")
+    return ok, detail
+
+
+def main(argv=None):
+    import argparse
+    import sys
+    import tempfile
+    import time
+    from converterEngine import ConversionJob, JobScheduler, validate_settings
+
+    parser = argparse.ArgumentParser(description="分割並列エンコードの結果を1プロセス変換と比較します。")
+    parser.add_argument("input", help="検証に使う動画ファイル")
+    parser.add_argument("--segments", type=int, default=os.cpu_count() or 2)
+    parser.add_argument("--fps", default="10")
+    parser.add_argument("--width", default="640")
+    parser.add_argument("--quality", default="75")
+    args = parser.parse_args(argv)
+    fps, width, quality = validate_settings(args.fps, args.width, args.quality)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, segments in (("single", 1), ("segmented", args.segments)):
+            scheduler = JobScheduler(1)
+            job = ConversionJob(args.input, fps, width, quality,
+                                output_dir=os.path.join(tmp, name), segments=segments)
+            started = time.monotonic()
+            scheduler.submit(job)
+            scheduler.shutdown(wait=True)
+            if job.status != "done":
+                print(f"{name}: 変換に失敗しました\n{job.error}", file=sys.stderr)
+                return 1
+            results[name] = (job.output_path, time.monotonic() - started, job.segments_used)
+        ok, detail = compare_outputs(results["single"][0], results["segmented"][0],
+                                     results["segmented"][2], fps)
+    print(detail)
+    print(f"所要時間: 1プロセス {results['single'][1]:.2f}s, "
+          f"分割({results['segmented'][2]}区間) {results['segmented'][1]:.2f}s")
+    print("一致" if ok else "不一致")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,107 @@
+"""
+目標ファイルサイズに収まる品質・幅を、短いサンプルのエンコード結果から見積もる。
+動画の数か所から短い区間を切り出して候補の品質でエンコードし、
+「1秒あたりのバイト数 = exp(a + b × 品質)」のモデルを当てはめて、
+予算内に収まる最も高い品質を探す。本番のエンコードは選んだ設定で1回だけ行う。
+"""
+import math
+
+# サンプルに使う区間の数と長さ（秒）
+SAMPLE_COUNT = 3
+SAMPLE_SECONDS = 2.0
+# サンプルをエンコードする候補の品質
+SAMPLE_QUALITIES = (20, 50, 80)
+# 見積もり誤差を見込んで予算のこの割合までに収める
+SIZE_SAFETY = 0.95
+# 品質を下げても収まらない場合に幅を縮める倍率と、その下限
+WIDTH_STEP = 0.75
+MIN_WIDTH = 160
+
+_SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "KB": 1024, "M": 1024 ** 2, "MB": 1024 ** 2,
+               "G": 1024 ** 3, "GB": 1024 ** 3}
+
+
+def parse_size(text):
+    """'500K' や '2MB'、'1048576' のようなサイズ指定をバイト数にする。"""
+    value = text.strip().upper()
+    number = value.rstrip("KMGB")
+    unit = value[len(number):]
+    if unit not in _SIZE_UNITS:
+        raise ValueError(f"サイズの単位が不正です: {text}")
+    size = int(float(number) * _SIZE_UNITS[unit])
+    if size <= 0:
+        raise ValueError("目標サイズは正の値で指定してください")
+    return size
+
+
+def sample_windows(duration, count=SAMPLE_COUNT, seconds=SAMPLE_SECONDS):
+    """
+    サンプルに使う区間 [(開始秒, 長さ秒), ...] を返す。
+    動画全体に均等に散らし、短い動画なら全体を1区間とする。
+    """
+    if duration <= count * seconds:
+        return [(0.0, duration)]
+    windows = []
+    for i in range(count):
+        center = duration * (i + 1) / (count + 1)
+        windows.append((max(0.0, center - seconds / 2), seconds))
+    return windows
+
+
+class SizeModel:
+    """品質から1秒あたりのバイト数を予測するモデル（log-linear）。"""
+
+    def __init__(self, a, b):
+        self.a = a
+        self.b = b
+
+    @classmethod
+    def fit(cls, points):
+        """[(品質, 1秒あたりのバイト数), ...] に最小二乗で当てはめる。"""
+        points = [(q, math.log(bps)) for q, bps in points if bps > 0]
+        if not points:
+            raise ValueError("サンプルのエンコード結果がありません")
+        if len(points) == 1:
+            # 1点しかなければ WebP の典型的な傾き（品質10で約1.3倍）を仮定する
+            q, y = points[0]
+            b = math.log(1.3) / 10
+            return cls(y - b * q, b)
+        n = len(points)
+        mean_q = sum(q for q, _ in points) / n
+        mean_y = sum(y for _, y in points) / n
+        var_q = sum((q - mean_q) ** 2 for q, _ in points)
+        b = sum((q - mean_q) * (y - mean_y) for q, y in points) / var_q if var_q else 0.0
+        # 品質を上げてサイズが減ることはないものとして扱う
+        b = max(b, 0.0)
+        return cls(mean_y - b * mean_q, b)
+
+    def scaled(self, factor):
+        """予測値を factor 倍したモデル（実測との差の補正用）。"""
+        return SizeModel(self.a + math.log(factor), self.b)
+
+    def bytes_per_second(self, quality):
+        return math.exp(self.a + self.b * quality)
+
+    def predict(self, quality, duration):
+        return self.bytes_per_second(quality) * duration
+
+    def best_quality(self, budget, duration, safety=SIZE_SAFETY):
+        """予算に収まる最も高い品質（0-100）を返す。品質0でも収まらなければ None。"""
+        limit = budget * safety
+        best = None
+        for quality in range(101):
+            if self.predict(quality, duration) <= limit:
+                best = quality
+            else:
+                break
+        return best
+
+
+def candidate_widths(width):
+    """幅の候補（指定幅から WIDTH_STEP 倍ずつ MIN_WIDTH まで）。"""
+    widths = [width]
+    while True:
+        next_width = int(widths[-1] * WIDTH_STEP) // 2 * 2
+        if next_width < MIN_WIDTH or next_width >= widths[-1]:
+            return widths
+        widths.append(next_width)
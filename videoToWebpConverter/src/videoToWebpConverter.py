@@ -1,39 +1,71 @@
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
 from tkinterdnd2 import DND_FILES, TkinterDnD
-import subprocess
-import threading
 import os
-import shlex
+from mediaProbe import ProbeCache, default_probe_cache_path, default_encode_cache_dir
+from encodeCache import EncodeCache
+from targetSize import parse_size
+from jobMetrics import MetricsLog, default_metrics_path
+from converterEngine import (
+    ConversionJob, JobScheduler, is_supported, validate_settings,
+    STATUS_QUEUED, STATUS_RUNNING, STATUS_DONE, STATUS_ERROR, STATUS_CANCELLED,
+)
+
+# ジョブ状態の表示名
+STATUS_LABELS = {
+    STATUS_QUEUED: "待機中",
+    STATUS_RUNNING: "変換中",
+    STATUS_DONE: "完了",
+    STATUS_ERROR: "エラー",
+    STATUS_CANCELLED: "キャンセル",
+}
+
+# ジョブ一覧の表示更新間隔（ミリ秒）
+POLL_INTERVAL = 200
+
 
 class VideoToWebPConverter(TkinterDnD.Tk):
     def __init__(self):
         super().__init__()
         self.title("Video to WebP Converter")
-        self.geometry("500x500")
+        self.geometry("600x820")
         self.configure(bg='white')
-        
+
+        self.scheduler = JobScheduler(
+            probe_cache=ProbeCache(default_probe_cache_path()),
+            encode_cache=EncodeCache(default_encode_cache_dir()),
+            metrics_log=MetricsLog(default_metrics_path()),
+        )
+        # ジョブID -> ツリービューの行ID
+        self.job_rows = {}
+        # 前回表示したジョブのリビジョン（進捗が更新された行だけ描き直す）
+        self.job_row_revisions = {}
+        # 完了サマリーを出すべきジョブがあるか
+        self.batch_pending = False
+
         self.create_widgets()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.after(POLL_INTERVAL, self.poll_jobs)
 
     def create_widgets(self):
         # ドラッグアンドドロップ領域のフレームを作成
-        self.drop_frame = tk.Frame(self, width=400, height=200, bg='#e0e0e0', relief='groove', bd=2)
+        self.drop_frame = tk.Frame(self, width=400, height=160, bg='#e0e0e0', relief='groove', bd=2)
         self.drop_frame.pack(pady=20)
         self.drop_frame.pack_propagate(False)
-        
+
         self.label = tk.Label(
-            self.drop_frame, 
-            text="ここに動画ファイルをドラッグ＆ドロップ\nまたはGIFをドラッグ＆ドロップ", 
-            bg='#e0e0e0', 
+            self.drop_frame,
+            text="ここに動画ファイルをドラッグ＆ドロップ\nまたはGIFをドラッグ＆ドロップ",
+            bg='#e0e0e0',
             font=('Arial', 12)
         )
         self.label.pack(expand=True)
-        
+
         # 対応している画像形式についての注釈を追加
         self.note_label = tk.Label(
-            self, 
-            text="対応している動画形式: MP4, MOV, AVI, MKV, GIF\nWebPファイルは同じフォルダに書き出されます。", 
-            bg='white', 
+            self,
+            text="対応している動画形式: MP4, MOV, AVI, MKV, GIF\nWebPファイルは同じフォルダに書き出されます。",
+            bg='white',
             font=('Arial', 10)
         )
         self.note_label.pack()
@@ -64,155 +96,183 @@ class VideoToWebPConverter(TkinterDnD.Tk):
         self.quality_entry.insert(0, "75")
         self.quality_entry.grid(row=2, column=1, pady=5)
 
-        # プログレスバー
+        # 同時変換数設定
+        tk.Label(settings_frame, text="同時変換数:", bg='white', font=('Arial', 12)).grid(row=3, column=0, sticky='e', pady=5)
+        self.workers_entry = tk.Entry(settings_frame)
+        self.workers_entry.insert(0, str(self.scheduler.max_workers))
+        self.workers_entry.grid(row=3, column=1, pady=5)
+
+        # 分割エンコード設定（長い動画を区間に分けて並列にエンコードする）
+        tk.Label(settings_frame, text="分割エンコード数:", bg='white', font=('Arial', 12)).grid(row=4, column=0, sticky='e', pady=5)
+        self.segments_entry = tk.Entry(settings_frame)
+        self.segments_entry.insert(0, "1")
+        self.segments_entry.grid(row=4, column=1, pady=5)
+
+        # 目標サイズ設定（指定すると品質はサンプルのエンコード結果から自動で決める）
+        tk.Label(settings_frame, text="目標サイズ (例: 500K, 2M):", bg='white', font=('Arial', 12)).grid(row=5, column=0, sticky='e', pady=5)
+        self.target_entry = tk.Entry(settings_frame)
+        self.target_entry.grid(row=5, column=1, pady=5)
+
+        # 重複フレーム除去設定（画面録画や静止の多いGIF向け）
+        tk.Label(settings_frame, text="重複フレーム除去 (0=無効, 1=標準):", bg='white', font=('Arial', 12)).grid(row=6, column=0, sticky='e', pady=5)
+        self.dedup_entry = tk.Entry(settings_frame)
+        self.dedup_entry.insert(0, "0")
+        self.dedup_entry.grid(row=6, column=1, pady=5)
+
+        # ジョブ一覧（ファイルごとの状態と進捗）
+        jobs_frame = tk.Frame(self, bg='white')
+        jobs_frame.pack(fill='both', expand=True, padx=20, pady=(10, 0))
+
+        self.job_tree = ttk.Treeview(jobs_frame, columns=("file", "status", "progress", "speed", "eta"), show="headings", height=8)
+        self.job_tree.heading("file", text="ファイル")
+        self.job_tree.heading("status", text="状態")
+        self.job_tree.heading("progress", text="進捗")
+        self.job_tree.heading("speed", text="速度")
+        self.job_tree.heading("eta", text="残り")
+        self.job_tree.column("file", width=210, anchor="w")
+        self.job_tree.column("status", width=65, anchor="center")
+        self.job_tree.column("progress", width=55, anchor="center")
+        self.job_tree.column("speed", width=55, anchor="center")
+        self.job_tree.column("eta", width=55, anchor="center")
+
+        vsb = ttk.Scrollbar(jobs_frame, orient="vertical", command=self.job_tree.yview)
+        self.job_tree.configure(yscrollcommand=vsb.set)
+        self.job_tree.pack(side='left', fill='both', expand=True)
+        vsb.pack(side='right', fill='y')
+
+        # ジョブ操作ボタン
+        buttons_frame = tk.Frame(self, bg='white')
+        buttons_frame.pack(pady=10)
+        tk.Button(buttons_frame, text="選択をキャンセル", command=self.cancel_selected).pack(side='left', padx=5)
+        tk.Button(buttons_frame, text="すべてキャンセル", command=self.scheduler.cancel_all).pack(side='left', padx=5)
+        tk.Button(buttons_frame, text="終了したジョブを消去", command=self.clear_finished).pack(side='left', padx=5)
+
+        # プログレスバー（バッチ全体の進捗）
         self.progress = ttk.Progressbar(self, orient='horizontal', length=400, mode='determinate')
-        self.progress.pack(pady=20)
+        self.progress.pack(pady=(0, 5))
 
-    def drop(self, event):
-        files = self.tk.splitlist(event.data)
-        for file in files:
-            if file.lower().endswith(('.mp4', '.mov', '.avi', '.mkv', '.gif')):
-                threading.Thread(target=self.convert_video, args=(file,)).start()
-            else:
-                messagebox.showerror("エラー", "サポートされていないファイル形式です。")
+        # 変換キャッシュの統計
+        self.cache_label = tk.Label(self, text=self.scheduler.encode_cache.stats_summary(), bg='white', font=('Arial', 9))
+        self.cache_label.pack(pady=(0, 10))
 
-    def get_unique_filename(self, filepath):
-        base, ext = os.path.splitext(filepath)
-        output_dir = os.path.dirname(filepath)
-        base_name = os.path.basename(base)
-        counter = 1
-        output_path = os.path.join(output_dir, base_name + '.webp')
-        while os.path.exists(output_path):
-            output_path = os.path.join(output_dir, f"{base_name}_{counter}.webp")
-            counter += 1
-        return output_path
-
-    def convert_video(self, filepath):
-        # ユーザー設定を取得
-        fps = self.fps_entry.get()
-        width = self.width_entry.get()
-        quality = self.quality_entry.get()
-
-        # 入力値のバリデーション
+    def read_settings(self):
+        # ユーザー設定を取得し、入力値のバリデーションを行う
         try:
-            fps = int(fps)
-            width = int(width)
-            quality = int(quality)
-            if not (0 <= quality <= 100):
+            fps, width, quality = validate_settings(
+                self.fps_entry.get(), self.width_entry.get(), self.quality_entry.get()
+            )
+            workers = int(self.workers_entry.get())
+            segments = int(self.segments_entry.get())
+            if workers < 1 or segments < 1:
+                raise ValueError
+            target = self.target_entry.get().strip()
+            target_bytes = parse_size(target) if target else None
+            dedup = float(self.dedup_entry.get())
+            if dedup < 0:
                 raise ValueError
         except ValueError:
             messagebox.showerror("入力エラー", "正しい数値を入力してください。")
+            return None
+        return fps, width, quality, workers, segments, target_bytes, dedup
+
+    def drop(self, event):
+        files = self.tk.splitlist(event.data)
+        settings = self.read_settings()
+        if settings is None:
             return
+        fps, width, quality, workers, segments, target_bytes, dedup = settings
 
-        output_path = self.get_unique_filename(filepath)
-
-        # 入力ファイルがGIFかどうかをチェック
-        is_gif = filepath.lower().endswith('.gif')
-
-        # ffmpegコマンドを設定
-        if is_gif:
-            cmd = [
-                'ffmpeg',
-                '-i', filepath,
-                '-vf', f'scale={width}:-1:flags=lanczos',  # 解像度を設定
-                '-loop', '0',
-                '-lossless', '0',
-                '-q:v', str(quality),
-                '-preset', 'default',
-                output_path
-            ]
-        else:
-            cmd = [
-                'ffmpeg',
-                '-i', filepath,
-                '-vf', f'fps={fps},scale={width}:-1:flags=lanczos',  # フレームレートと解像度を設定
-                '-vcodec', 'libwebp',
-                '-lossless', '0',
-                '-q:v', str(quality),  # 品質を設定
-                '-loop', '0',
-                '-an',
-                '-preset', 'default',
-                '-vsync', '0',
-                output_path
-            ]
-
-        # コマンドを文字列にして表示（デバッグ用）
-        cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
-        print(f"実行コマンド: {cmd_str}")
-
-        # プロセスの実行とエラー取得
-        try:
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='cp932',  # Windowsのデフォルトエンコーディング
-                errors='replace'
-            )
+        # 同時変換数の変更は、実行中のジョブがないときだけ反映する
+        if self.scheduler.is_idle():
+            self.scheduler.resize(workers)
+
+        # 変換開始を待たずに、ドロップされたファイルをまとめて並列にffprobeしておく
+        self.scheduler.prefetch_probes([file for file in files if is_supported(file)])
 
-            if is_gif:
-                self.progress.config(mode='indeterminate')
-                self.progress.start()
+        for file in files:
+            if is_supported(file):
+                job = self.scheduler.submit(ConversionJob(file, fps, width, quality, segments=segments,
+                                                     target_bytes=target_bytes, dedup=dedup))
+                self.job_rows[job.id] = self.job_tree.insert(
+                    "", "end", values=(os.path.basename(file), STATUS_LABELS[job.status], "", "", "")
+                )
+                self.batch_pending = True
             else:
-                total_duration = self.get_video_duration(filepath)
-                self.progress['maximum'] = total_duration
-
-            error_output = ""
-
-            while True:
-                line = process.stderr.readline()
-                if not line:
-                    break
-                if not is_gif and 'time=' in line:
-                    time_str = line.strip().split('time=')[1].split(' ')[0]
-                    current_time = self.ffmpeg_time_to_seconds(time_str)
-                    self.progress['value'] = current_time
-                    self.update_idletasks()
-                error_output += line
-
-            process.wait()
-            self.progress.stop()
-            self.progress['value'] = 0
-            self.progress.config(mode='determinate')
+                messagebox.showerror("エラー", "サポートされていないファイル形式です。")
 
-            if process.returncode == 0:
-                messagebox.showinfo("完了", f"変換が完了しました。\n{output_path}")
+    def cancel_selected(self):
+        selected = set(self.job_tree.selection())
+        for job in self.scheduler.jobs:
+            if self.job_rows.get(job.id) in selected:
+                self.scheduler.cancel(job)
+
+    def clear_finished(self):
+        for job in self.scheduler.jobs:
+            if job.finished:
+                self.job_tree.delete(self.job_rows.pop(job.id))
+                self.job_row_revisions.pop(job.id, None)
+        self.scheduler.remove_finished()
+
+    def poll_jobs(self):
+        # ワーカースレッドは状態を書き換えるだけで、ウィジェットの更新はここ（Tkスレッド）で行う
+        # 進捗の公開はエンジン側で間引かれており、ここでは変化したジョブの行だけを更新する
+        jobs = self.scheduler.jobs
+        for job in jobs:
+            revision = job.revision
+            if self.job_row_revisions.get(job.id) == revision:
+                continue
+            self.job_row_revisions[job.id] = revision
+            if job.progress is None:
+                progress_text = "--" if job.status == STATUS_RUNNING else ""
             else:
-                messagebox.showerror("エラー", f"変換中にエラーが発生しました。\n\n詳細:\n{error_output}")
-        except Exception as e:
-            messagebox.showerror("例外エラー", f"予期せぬエラーが発生しました。\n\n詳細:\n{str(e)}")
-
-    def get_video_duration(self, filepath):
-        cmd = [
-            'ffprobe',
-            '-v', 'error',
-            '-show_entries',
-            'format=duration',
-            '-of',
-            'default=noprint_wrappers=1:nokey=1',
-            filepath
-        ]
-        result = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='cp932',  # Windowsのデフォルトエンコーディング
-            errors='replace'
-        )
-        try:
-            return float(result.stdout.strip())
-        except ValueError:
-            return 0
+                progress_text = f"{job.progress:.0f}%"
+            speed = job.progress_info.get("speed")
+            speed_text = f"{speed:.2f}x" if speed else ""
+            eta_text = self.format_eta(job.eta) if job.status == STATUS_RUNNING and job.eta is not None else ""
+            values = (os.path.basename(job.filepath), STATUS_LABELS[job.status], progress_text, speed_text, eta_text)
+            self.job_tree.item(self.job_rows[job.id], values=values)
 
-    def ffmpeg_time_to_seconds(self, time_str):
-        try:
-            h, m, s = time_str.split(':')
-            s = float(s)
-            return int(h) * 3600 + int(m) * 60 + s
-        except ValueError:
-            return 0
+        if jobs:
+            finished = sum(1 for job in jobs if job.finished)
+            self.progress['maximum'] = len(jobs)
+            self.progress['value'] = finished
+            if finished == len(jobs) and self.batch_pending:
+                self.batch_pending = False
+                self.show_batch_summary(jobs)
+        else:
+            self.progress['value'] = 0
+
+        self.after(POLL_INTERVAL, self.poll_jobs)
+
+    @staticmethod
+    def format_eta(seconds):
+        minutes, seconds = divmod(int(seconds), 60)
+        return f"{minutes}:{seconds:02d}"
+
+    def show_batch_summary(self, jobs):
+        self.scheduler.save_caches()
+        self.cache_label.configure(text=self.scheduler.encode_cache.stats_summary())
+        done = [job for job in jobs if job.status == STATUS_DONE]
+        failed = [job for job in jobs if job.status == STATUS_ERROR]
+        cancelled = [job for job in jobs if job.status == STATUS_CANCELLED]
+        message = f"変換が完了しました。\n成功: {len(done)}  エラー: {len(failed)}  キャンセル: {len(cancelled)}"
+        dropped = sum(job.frames_dropped or 0 for job in done)
+        if dropped:
+            message += f"\n重複として除去したフレーム: {dropped}"
+        over_target = sum(1 for job in done if job.over_target)
+        if over_target:
+            message += f"\n目標サイズを超えたファイル: {over_target}"
+        if failed:
+            first = failed[0]
+            message += f"\n\n{os.path.basename(first.filepath)} の詳細:\n{first.error}"
+            messagebox.showerror("エラー", message)
+        else:
+            messagebox.showinfo("完了", message)
+
+    def on_close(self):
+        self.scheduler.shutdown()
+        self.scheduler.metrics_log.close()
+        self.destroy()
 
 if __name__ == "__main__":
     app = VideoToWebPConverter()